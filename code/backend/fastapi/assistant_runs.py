@@ -0,0 +1,165 @@
+import asyncio
+import os
+import random
+
+# Runs are streamed by default; polling is only used when streaming is disabled
+# or the stream breaks before the run reaches a terminal state.
+RUN_STREAMING = os.getenv("RUN_STREAMING", "true").lower() in ("1", "true", "yes")
+RUN_TIMEOUT = float(os.getenv("RUN_TIMEOUT", "120"))
+RUN_POLL_INITIAL_DELAY = float(os.getenv("RUN_POLL_INITIAL_DELAY", "0.5"))
+RUN_POLL_MAX_DELAY = float(os.getenv("RUN_POLL_MAX_DELAY", "8"))
+RUN_POLL_BACKOFF = 2.0
+
+# Statuses after which a run will never change again
+TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+
+
+class RunError(Exception):
+    """Raised when an assistant run does not complete successfully."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _increment(stats, key, amount=1):
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + amount
+
+
+def next_poll_delay(delay):
+    """
+    Returns the jittered sleep for the current poll and the base delay for the next one.
+
+    Args:
+        delay (float): The current base delay in seconds
+
+    Returns:
+        tuple: (seconds to sleep now, next base delay)
+    """
+    # "Equal jitter": always wait at least half the base delay so that polls
+    # stay spread out, but randomise the rest so concurrent runs don't align.
+    sleep_for = delay / 2 + random.uniform(0, delay / 2)
+    return sleep_for, min(delay * RUN_POLL_BACKOFF, RUN_POLL_MAX_DELAY)
+
+
+async def _cancel_quietly(client, thread_id, run_id):
+    try:
+        await client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+    except Exception as e:
+        print(f"Could not cancel run {run_id}: {e}")
+
+
+async def poll_run(client, thread_id, run, deadline, stats=None):
+    """
+    Polls a run with jittered exponential backoff until it stops making progress.
+
+    Args:
+        client: The AsyncOpenAI client
+        thread_id (str): The thread the run belongs to
+        run: The last known run object
+        deadline (float): Event loop time after which the run is abandoned
+        stats (dict, optional): Receives the ``run_polls`` counter
+
+    Returns:
+        The run in a terminal or ``requires_action`` state
+    """
+    loop = asyncio.get_running_loop()
+    delay = RUN_POLL_INITIAL_DELAY
+
+    while run.status not in TERMINAL_STATUSES and run.status != "requires_action":
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            await _cancel_quietly(client, thread_id, run.id)
+            raise RunError("timeout", f"Run {run.id} did not finish within {RUN_TIMEOUT}s")
+
+        sleep_for, delay = next_poll_delay(delay)
+        await asyncio.sleep(min(sleep_for, remaining))
+
+        run = await client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        _increment(stats, "run_polls")
+
+    return run
+
+
+async def _stream_run(client, thread_id, assistant_id, deadline, stats=None):
+    """Streams run events and returns the last run snapshot seen (may be None)."""
+    loop = asyncio.get_running_loop()
+    stream_manager = client.beta.threads.runs.stream(
+        thread_id=thread_id, assistant_id=assistant_id
+    )
+    async with stream_manager as stream:
+        _increment(stats, "run_streams")
+        try:
+            await asyncio.wait_for(stream.until_done(), timeout=deadline - loop.time())
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The caller no longer needs the answer, so stop paying for it
+            if stream.current_run is not None:
+                await asyncio.shield(_cancel_quietly(client, thread_id, stream.current_run.id))
+            raise
+        except Exception as e:
+            # The run may still be progressing server side; the caller falls
+            # back to polling it if we managed to learn its id.
+            print(f"Run stream interrupted, falling back to polling: {e}")
+        return stream.current_run
+
+
+async def run_assistant(client, thread_id, assistant_id, stats=None):
+    """
+    Runs an assistant on a thread and waits for it to finish.
+
+    Uses streamed run events when RUN_STREAMING is enabled and falls back to
+    backoff polling otherwise, all bounded by RUN_TIMEOUT.
+
+    Args:
+        client: The AsyncOpenAI client
+        thread_id (str): The thread to run the assistant on
+        assistant_id (str): The assistant to run
+        stats (dict, optional): Receives ``run_polls`` and ``run_streams`` counters
+
+    Returns:
+        The completed run
+
+    Raises:
+        RunError: If the run fails, is cancelled, expires, needs tool outputs
+            or does not finish before the deadline
+
+    If the calling task is cancelled, the run is cancelled on the server too.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + RUN_TIMEOUT
+    run = None
+
+    if RUN_STREAMING:
+        try:
+            run = await _stream_run(client, thread_id, assistant_id, deadline, stats)
+        except Exception as e:
+            # Streaming could not even be started, so no run exists yet
+            print(f"Run streaming unavailable, falling back to polling: {e}")
+
+    if run is None:
+        run = await client.beta.threads.runs.create(
+            thread_id=thread_id, assistant_id=assistant_id
+        )
+
+    try:
+        run = await poll_run(client, thread_id, run, deadline, stats)
+    except asyncio.CancelledError:
+        if run.status not in TERMINAL_STATUSES:
+            await asyncio.shield(_cancel_quietly(client, thread_id, run.id))
+        raise
+
+    if run.status == "completed":
+        return run
+
+    if run.status == "requires_action":
+        # The classifier only uses server-side tools, so there are no tool
+        # outputs we could submit; free the thread instead of leaving it locked.
+        await _cancel_quietly(client, thread_id, run.id)
+        raise RunError(run.status, f"Run {run.id} unexpectedly requires action")
+
+    last_error = getattr(run, "last_error", None)
+    detail = f": {last_error.message}" if last_error else ""
+    raise RunError(run.status, f"Run {run.id} ended with status '{run.status}'{detail}")
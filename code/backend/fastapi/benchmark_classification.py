@@ -0,0 +1,236 @@
+"""
+Latency benchmark of the classification engines against a local stub of the OpenAI API.
+
+    python benchmark_classification.py --emails 50 --concurrency 5 --latency 0.05 --model-time 1.0
+
+The stub answers every request after --latency seconds (the network round
+trip) and takes --model-time seconds to produce a run or a chat completion,
+so the difference between the engines is the number of round trips each
+one needs. --file-search-time adds the Assistant's retrieval step to its runs.
+
+For each engine it prints p50/p99 latency and the API requests per email:
+  - assistants: thread, message, streamed run, message list
+  - chat: one embedding (shared with the email's own) and one completion
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from openai import AsyncOpenAI
+
+from classification import ReferenceExamples, classify_with_assistant, classify_with_chat
+from embeddings import EmbeddingService
+
+REPLY = json.dumps(
+    {
+        "request_intents": [
+            {"intent": "Loan Payoff Request", "reasoning": "Asks for a payoff quote", "confidence_score": 0.92}
+        ],
+        "sub_requests": [{"sub_request": "Payoff quote", "reasoning": "Requested explicitly"}],
+    }
+)
+
+
+def stub_app(latency, model_time, file_search_time, requests):
+    """The subset of the OpenAI API used by the classifiers."""
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def round_trip(request, call_next):
+        requests[request.url.path.split("/")[2] if request.url.path.count("/") > 1 else "other"] += 1
+        await asyncio.sleep(latency)
+        return await call_next(request)
+
+    def run(thread_id, status):
+        return {
+            "id": f"run_{thread_id}",
+            "object": "thread.run",
+            "thread_id": thread_id,
+            "assistant_id": "asst_stub",
+            "status": status,
+            "created_at": 0,
+            "model": "stub",
+            "instructions": "",
+            "tools": [],
+            "parallel_tool_calls": False,
+        }
+
+    @app.post("/v1/threads")
+    async def create_thread():
+        return {"id": f"thread_{time.monotonic_ns()}", "object": "thread", "created_at": 0, "metadata": {}}
+
+    @app.post("/v1/threads/{thread_id}/messages")
+    async def create_message(thread_id: str):
+        return {
+            "id": "msg_user",
+            "object": "thread.message",
+            "thread_id": thread_id,
+            "role": "user",
+            "status": "completed",
+            "created_at": 0,
+            "content": [],
+            "attachments": [],
+            "metadata": {},
+        }
+
+    @app.post("/v1/threads/{thread_id}/runs")
+    async def create_run(thread_id: str):
+        async def events():
+            yield f"event: thread.run.created\ndata: {json.dumps(run(thread_id, 'queued'))}\n\n"
+            await asyncio.sleep(model_time + file_search_time)
+            yield f"event: thread.run.completed\ndata: {json.dumps(run(thread_id, 'completed'))}\n\n"
+            yield "event: done\ndata: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/threads/{thread_id}/messages")
+    async def list_messages(thread_id: str):
+        message = {
+            "id": "msg_reply",
+            "object": "thread.message",
+            "thread_id": thread_id,
+            "role": "assistant",
+            "status": "completed",
+            "created_at": 0,
+            "content": [{"type": "text", "text": {"value": f"```json\n{REPLY}\n```", "annotations": []}}],
+            "attachments": [],
+            "metadata": {},
+        }
+        return {"object": "list", "data": [message], "first_id": "msg_reply", "last_id": "msg_reply", "has_more": False}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completion(request: Request):
+        body = await request.json()
+        prompt_tokens = sum(len(message["content"]) for message in body["messages"]) // 4
+        static_tokens = len(body["messages"][0]["content"]) // 4
+        await asyncio.sleep(model_time)
+        return {
+            "id": "chatcmpl_stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": REPLY}}
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": 60,
+                "total_tokens": prompt_tokens + 60,
+                # Mimics the provider cache: prefixes of 1024+ tokens are served from it
+                "prompt_tokens_details": {"cached_tokens": static_tokens if static_tokens >= 1024 else 0},
+            },
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        data = []
+        for index, text in enumerate(body["input"]):
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            vector = np.random.default_rng(seed).normal(size=256)
+            data.append({"object": "embedding", "index": index, "embedding": (vector / np.linalg.norm(vector)).tolist()})
+        return {"object": "list", "data": data, "model": body["model"], "usage": {"prompt_tokens": 0, "total_tokens": 0}}
+
+    return app
+
+
+def start_stub(app):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/v1"
+
+
+def sample_email(number):
+    return (
+        f"From: borrower{number}@example.com\nSubject: Payoff quote for loan {1000 + number}\n\n"
+        f"Hello, please send me the payoff amount for loan {1000 + number} good through the end of the month."
+    )
+
+
+async def measure(classify, emails, concurrency):
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(email):
+        async with limit:
+            started = time.perf_counter()
+            await classify(email)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(email) for email in emails))
+    return latencies, time.perf_counter() - started
+
+
+async def run_benchmark(args, base_url, requests):
+    client = AsyncOpenAI(base_url=base_url, api_key="stub", max_retries=0)
+    emails = [sample_email(number) for number in range(args.emails)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        references = ReferenceExamples(
+            EmbeddingService(client), path=os.path.join(directory, "examples.jsonl")
+        )
+        references.replace(
+            f"Email: {sample_email(number)}\nIntent: Loan Payoff Request" for number in range(args.examples)
+        )
+        # Embed the reference examples before timing
+        await references.search("warm up")
+
+        engines = {
+            "assistants": lambda email: classify_with_assistant(client, "asst_stub", email, {}),
+            "chat": lambda email: classify_with_chat(client, references, email, {}),
+        }
+        print(
+            f"{args.emails} emails, concurrency {args.concurrency}, round trip {args.latency * 1000:.0f}ms,"
+            f" model {args.model_time:.2f}s, file search {args.file_search_time:.2f}s"
+        )
+        print(f"{'engine':<11} {'p50':>7} {'p99':>7} {'emails/s':>9} {'requests/email':>15}")
+        for name, classify in engines.items():
+            requests.clear()
+            latencies, elapsed = await measure(classify, emails, args.concurrency)
+            latencies.sort()
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(
+                f"{name:<11} {statistics.median(latencies):>6.2f}s {p99:>6.2f}s"
+                f" {len(emails) / elapsed:>9.1f} {sum(requests.values()) / len(emails):>15.1f}"
+                f"   {dict(requests)}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per API round trip")
+    parser.add_argument("--model-time", type=float, default=1.0, help="Seconds to generate an answer")
+    parser.add_argument("--file-search-time", type=float, default=0.0, help="Extra seconds per Assistant run")
+    parser.add_argument("--examples", type=int, default=200, help="Reference examples to retrieve from")
+    args = parser.parse_args()
+
+    requests = Counter()
+    server, base_url = start_stub(stub_app(args.latency, args.model_time, args.file_search_time, requests))
+    try:
+        asyncio.run(run_benchmark(args, base_url, requests))
+    finally:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Size and fidelity benchmark for the embedding storage formats.
+
+    python benchmark_embedding_storage.py --documents 10000 --dimensions 1536
+
+For each EMBEDDING_STORAGE format it prints:
+  - the BSON size of an email's embedding field and of the whole corpus
+  - the zlib-compressed size, a stand-in for WiredTiger block compression
+  - the memory held by the decoded documents in Python
+  - the time to encode and decode one embedding
+  - how closely cosine scores and the top 5 neighbours match the float vectors
+"""
+import argparse
+import sys
+import time
+import zlib
+
+import bson
+import numpy as np
+
+from embedding_storage import STORAGE_FORMATS, decode_embedding, encode_embedding
+
+
+def python_size(value):
+    """Approximate memory held by a decoded field value."""
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(sys.getsizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def per_call_microseconds(function, values):
+    started = time.perf_counter()
+    for value in values:
+        function(value)
+    return (time.perf_counter() - started) / len(values) * 1e6
+
+
+def normalised(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # text-embedding-3 vectors are unit length with small, roughly normal components
+    embeddings = normalised(rng.normal(size=(args.documents, args.dimensions))).astype(np.float32)
+    as_lists = embeddings.tolist()
+    queries = embeddings[rng.integers(0, args.documents, args.queries)]
+    exact_scores = queries @ embeddings.T
+    exact_top = np.argsort(-exact_scores, axis=1)[:, :5]
+
+    print(f"{args.documents} embeddings x {args.dimensions} dims")
+    print(
+        f"{'format':<8} {'bson/doc':>10} {'corpus':>10} {'zlib':>10} {'memory':>10}"
+        f" {'encode':>9} {'decode':>9} {'max |dscore|':>13} {'top-5 overlap':>14}"
+    )
+    baseline = None
+    for storage in STORAGE_FORMATS:
+        encoded = [encode_embedding(embedding, storage) for embedding in as_lists]
+        documents = [bson.encode({"embedding": value}) for value in encoded]
+        corpus = sum(len(document) for document in documents)
+        compressed = sum(len(zlib.compress(document)) for document in documents[:1000])
+        compressed = compressed * len(documents) / min(len(documents), 1000)
+        memory = sum(python_size(bson.decode(document)["embedding"]) for document in documents[:1000])
+        memory = memory * len(documents) / min(len(documents), 1000)
+
+        sample = as_lists[:1000]
+        encode_us = per_call_microseconds(lambda e: encode_embedding(e, storage), sample)
+        decode_us = per_call_microseconds(decode_embedding, encoded[:1000])
+
+        decoded = normalised(np.stack([decode_embedding(value) for value in encoded]))
+        scores = queries @ decoded.T
+        top = np.argsort(-scores, axis=1)[:, :5]
+        overlap = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(top, exact_top)])
+        error = np.abs(scores - exact_scores).max()
+
+        baseline = baseline or corpus
+        print(
+            f"{storage:<8} {corpus / len(documents) / 1024:>8.1f}KB {corpus / 1e6:>8.1f}MB"
+            f" {compressed / 1e6:>8.1f}MB {memory / 1e6:>8.1f}MB {encode_us:>7.1f}us"
+            f" {decode_us:>7.1f}us {error:>13.5f} {overlap:>14.3f}"
+            f"   ({corpus / baseline:.0%} of array)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Latency benchmark for OCR on scanned forms and phone photos.
+
+    python benchmark_ocr.py --images 10
+    python benchmark_ocr.py --files form1.jpg form2.png
+
+For each image it compares:
+  - baseline: pytesseract.image_to_string on the image as uploaded
+  - engine: ocr.image_to_text, which preprocesses (downsample, binarise, tile)
+    and reuses a tesserocr API when that package is installed
+
+Without the tesseract binary only the preprocessing is measured, along with
+the size of the image tesseract would be handed.
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import time
+
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+import ocr
+
+WORDS = (
+    "payoff escrow statement borrower principal interest balance due remit "
+    "loan account servicing transfer insurance refund wire funds closing"
+).split()
+
+
+def scanned_form(rng, phone):
+    """Renders a form page, as a 4032x3024 phone photo or a 600 DPI greyscale scan."""
+    size = (3024, 4032) if phone else (5100, 6600)
+    image = Image.new("RGB", size, (205, 198, 186) if phone else (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=size[0] // 60)
+    for line in range(45):
+        text = f"{rng.choice(WORDS).title()}: " + " ".join(rng.choices(WORDS, k=6))
+        draw.text((size[0] // 12, size[1] // 20 + line * size[1] // 50), text, fill=(40, 40, 45), font=font)
+    buffer = io.BytesIO()
+    if phone:
+        image.save(buffer, "JPEG", quality=88)
+    else:
+        image.convert("L").save(buffer, "PNG", dpi=(600, 600))
+    return buffer.getvalue()
+
+
+def png_bytes(image):
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return len(buffer.getvalue())
+
+
+def timed(function, content):
+    started = time.perf_counter()
+    result = function(Image.open(io.BytesIO(content)))
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--files", nargs="*", help="Images to OCR instead of generated forms")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.files:
+        images = []
+        for path in args.files:
+            with open(path, "rb") as file:
+                images.append((os.path.basename(path), file.read()))
+    else:
+        rng = random.Random(args.seed)
+        images = [
+            (f"{'photo' if number % 2 == 0 else 'scan'}-{number}", scanned_form(rng, number % 2 == 0))
+            for number in range(args.images)
+        ]
+
+    try:
+        pytesseract.get_tesseract_version()
+        recognise = True
+    except pytesseract.TesseractNotFoundError:
+        print("tesseract is not installed: measuring preprocessing only")
+        recognise = False
+    print(f"backend: {'tesserocr' if ocr.tesserocr is not None else 'pytesseract'}")
+    print(
+        f"{'image':<12} {'input':>11} {'ocr input':>11} {'png bytes':>21}"
+        f" {'preprocess':>11} {'baseline':>9} {'engine':>9}"
+    )
+
+    baseline_times, engine_times = [], []
+    for name, content in images:
+        original = Image.open(io.BytesIO(content))
+        preprocess_time, prepared = timed(ocr.preprocess, content)
+        row = (
+            f"{name:<12} {'%dx%d' % original.size:>11} {'%dx%d' % prepared.size:>11}"
+            f" {png_bytes(original) / 1e6:>8.1f}MB -> {png_bytes(prepared) / 1e6:>6.2f}MB"
+            f" {preprocess_time * 1000:>9.0f}ms"
+        )
+        if recognise:
+            baseline_time, _ = timed(pytesseract.image_to_string, content)
+            engine_time, _ = timed(ocr.image_to_text, content)
+            baseline_times.append(baseline_time)
+            engine_times.append(engine_time)
+            row += f" {baseline_time:>8.2f}s {engine_time:>8.2f}s"
+        print(row)
+
+    if recognise:
+        print(
+            f"median latency per image: baseline {statistics.median(baseline_times):.2f}s,"
+            f" engine {statistics.median(engine_times):.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
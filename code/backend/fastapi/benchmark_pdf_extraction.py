@@ -0,0 +1,128 @@
+"""
+Benchmark for PDF text extraction.
+
+    python benchmark_pdf_extraction.py --documents 4 --pages 40 --scanned-every 5
+    python benchmark_pdf_extraction.py --files statement1.pdf statement2.pdf
+
+Compares, per PDF:
+  - baseline: the previous extractor, calling extract_text() twice per page
+    and returning nothing for scanned pages
+  - sequential: the current extractor on the calling thread
+  - parallel: extract_text_async spread over the process pool, PDF_PAGES_PER_TASK
+    pages per task
+
+Generated PDFs mix typed pages with image-only "scanned" pages. Those are only
+OCRed when the tesseract binary is installed; otherwise they are left out.
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import PyPDF2
+import pytesseract
+from fpdf import FPDF
+from PIL import Image, ImageDraw
+
+import extraction
+
+WORDS = (
+    "payoff escrow statement borrower principal interest balance due remit "
+    "loan account servicing transfer insurance refund wire funds closing"
+).split()
+
+
+def baseline_extract(content):
+    reader = PyPDF2.PdfReader(io.BytesIO(content))
+    return "\n".join([page.extract_text() for page in reader.pages if page.extract_text()])
+
+
+def scanned_page_image(path, rng):
+    image = Image.new("L", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(40):
+        draw.text((80, 80 + line * 40), " ".join(rng.choices(WORDS, k=12)), fill="black")
+    image.save(path, quality=75)
+
+
+def make_pdf(pages, scanned_every, rng, directory):
+    pdf = FPDF()
+    pdf.set_font("Arial", size=10)
+    scan = os.path.join(directory, "scan.jpg")
+    scanned_page_image(scan, rng)
+    for number in range(pages):
+        pdf.add_page()
+        if scanned_every and number % scanned_every == scanned_every - 1:
+            pdf.image(scan, 0, 0, 210)
+        else:
+            pdf.multi_cell(0, 5, "\n".join(" ".join(rng.choices(WORDS, k=14)) for _ in range(45)))
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def timed(function):
+    started = time.perf_counter()
+    result = function()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--files", nargs="*", help="PDFs to extract instead of generated ones")
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--scanned-every", type=int, default=5, help="0 for no scanned pages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        print("tesseract is not installed: generating PDFs without scanned pages")
+        args.scanned_every = 0
+
+    if args.files:
+        documents = []
+        for path in args.files:
+            with open(path, "rb") as file:
+                documents.append((os.path.basename(path), file.read()))
+    else:
+        rng = random.Random(args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            documents = [
+                (f"generated-{number}.pdf", make_pdf(args.pages, args.scanned_every, rng, directory))
+                for number in range(args.documents)
+            ]
+
+    extraction.EXTRACTION_POOL = "process"
+    # Start the workers before timing anything
+    asyncio.run(extraction.extract_text_async("warmup.txt", b"warm up"))
+    print(
+        f"{extraction.EXTRACTION_WORKERS} workers, {extraction.PDF_PAGES_PER_TASK} pages per task,"
+        f" cap {extraction.PDF_MAX_PAGES} pages"
+    )
+    print(f"{'file':<24} {'pages':>6} {'baseline':>10} {'sequential':>11} {'parallel':>10} {'chars':>18}")
+
+    speedups = []
+    for filename, content in documents:
+        pages = len(PyPDF2.PdfReader(io.BytesIO(content)).pages)
+        baseline_time, baseline_text = timed(lambda: baseline_extract(content))
+        sequential_time, _ = timed(lambda: extraction.extract_text(filename, content))
+        parallel_time, text = timed(
+            lambda: asyncio.run(extraction.extract_text_async(filename, content, timeout=600))
+        )
+        speedups.append(sequential_time / parallel_time)
+        print(
+            f"{filename[:24]:<24} {pages:>6} {baseline_time:>9.2f}s {sequential_time:>10.2f}s"
+            f" {parallel_time:>9.2f}s {len(baseline_text):>8} -> {len(text):<8}"
+        )
+
+    extraction.shutdown_pool()
+    print(f"median parallel speed-up over sequential: {statistics.median(speedups):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
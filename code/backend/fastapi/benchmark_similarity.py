@@ -0,0 +1,119 @@
+"""
+Recall/latency benchmark for the local similarity backend.
+
+Builds LocalVectorIndex over synthetic, clustered embeddings and compares
+approximate (HNSW) search against exact search:
+
+    python benchmark_similarity.py --sizes 10000 100000 --dimensions 1536
+    python benchmark_similarity.py --sizes 1000000 --dimensions 256 --num-candidates 50 100 400
+
+For every corpus size it prints the build time, then p50/p99 query latency
+for exact search and recall@k and p50/p99 latency for each ``num_candidates``
+setting. Atlas' numCandidates behaves the same way but can only be measured
+against a cluster.
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from similarity import HNSW_EF_CONSTRUCTION, HNSW_M, LocalVectorIndex, hnswlib
+
+
+def synthetic_corpus(size, dimensions, clusters, rng, chunk=50000):
+    """Yields chunks of embeddings grouped around random topic centres."""
+    centres = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    for start in range(0, size, chunk):
+        rows = min(chunk, size - start)
+        assignment = rng.integers(0, clusters, rows)
+        noise = rng.normal(scale=0.6, size=(rows, dimensions)).astype(np.float32)
+        yield centres[assignment] + noise
+
+
+def percentiles(seconds):
+    milliseconds = np.array(seconds) * 1000
+    return np.percentile(milliseconds, 50), np.percentile(milliseconds, 99)
+
+
+def timed(function, queries):
+    results, seconds = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(function(query))
+        seconds.append(time.perf_counter() - started)
+    return results, seconds
+
+
+def benchmark(size, args, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        index = LocalVectorIndex(None, directory, m=args.m, ef_construction=args.ef_construction)
+
+        started = time.perf_counter()
+        row = 0
+        for vectors in synthetic_corpus(size, args.dimensions, args.clusters, rng):
+            # Row numbers stand in for ObjectIds
+            ids = [(row + i).to_bytes(12, "big") for i in range(len(vectors))]
+            index._append(ids, vectors)
+            row += len(vectors)
+        append_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        index.hnsw = index._build_hnsw(index.count)
+        hnsw_seconds = time.perf_counter() - started
+        print(
+            f"\n{size} vectors x {args.dimensions} dims: "
+            f"matrix {append_seconds:.1f}s, HNSW graph {hnsw_seconds:.1f}s"
+        )
+
+        # Queries are noisy copies of stored emails, like near-duplicates
+        picks = rng.integers(0, index.count, args.queries)
+        queries = index.vectors[picks] + rng.normal(
+            scale=args.query_noise, size=(args.queries, args.dimensions)
+        ).astype(np.float32)
+
+        exact, seconds = timed(lambda query: index.top_k(query, args.k), queries)
+        p50, p99 = percentiles(seconds)
+        print(f"  exact                    p50 {p50:7.2f}ms  p99 {p99:7.2f}ms")
+
+        truth = [{row for row, _ in matches} for matches in exact]
+        for num_candidates in args.num_candidates:
+            approximate, seconds = timed(
+                lambda query: index.ann_top_k(query, args.k, num_candidates), queries
+            )
+            found = sum(
+                len(expected & {row for row, _ in matches})
+                for expected, matches in zip(truth, approximate)
+            )
+            recall = found / sum(len(expected) for expected in truth)
+            p50, p99 = percentiles(seconds)
+            print(
+                f"  ann candidates={num_candidates:<6} p50 {p50:7.2f}ms  p99 {p99:7.2f}ms"
+                f"  recall@{args.k} {recall:.3f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--query-noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[20, 50, 100, 200])
+    parser.add_argument("--m", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if hnswlib is None:
+        parser.error("hnswlib is not installed; pip install hnswlib")
+
+    rng = np.random.default_rng(args.seed)
+    for size in args.sizes:
+        benchmark(size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
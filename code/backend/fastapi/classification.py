@@ -0,0 +1,304 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+from assistant_runs import RunError, run_assistant
+from token_budget import truncate_tokens
+
+# "assistants" runs the configured Assistant on a new thread, "chat" makes one
+# Chat Completions call with a JSON schema and locally retrieved examples
+CLASSIFIER_ENGINE = os.getenv("CLASSIFIER_ENGINE", "assistants").lower()
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o-mini")
+# Examples always sent in the static prompt prefix, and examples retrieved per email
+CLASSIFY_STATIC_EXAMPLES = int(os.getenv("CLASSIFY_STATIC_EXAMPLES", "3"))
+CLASSIFY_RETRIEVED_EXAMPLES = int(os.getenv("CLASSIFY_RETRIEVED_EXAMPLES", "3"))
+# Longer reference examples are cut to this many tokens
+REFERENCE_EXAMPLE_TOKENS = int(os.getenv("REFERENCE_EXAMPLE_TOKENS", "400"))
+REFERENCE_EXAMPLES_PATH = os.getenv(
+    "REFERENCE_EXAMPLES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "reference_examples.jsonl"),
+)
+
+CLASSIFICATION_INSTRUCTIONS = (
+    "You are an AI assistant that classifies loan servicing request emails. "
+    "For the given email content, provide the top 3 most relevant request intents, along with reasoning and a confidence score (0-1) for each. "
+    "Also, extract sub-request types (features) present in the email and justify why they are relevant. "
+)
+
+CLASSIFICATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "request_intents": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "intent": {"type": "string"},
+                    "reasoning": {"type": "string"},
+                    "confidence_score": {"type": "number"},
+                },
+                "required": ["intent", "reasoning", "confidence_score"],
+                "additionalProperties": False,
+            },
+        },
+        "sub_requests": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "sub_request": {"type": "string"},
+                    "reasoning": {"type": "string"},
+                },
+                "required": ["sub_request", "reasoning"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["request_intents", "sub_requests"],
+    "additionalProperties": False,
+}
+
+
+class ClassificationError(Exception):
+    """Raised when a classifier gives no usable answer; carries the HTTP status to report."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_json_reply(text):
+    """
+    Parses a JSON object from a model reply, with or without a markdown code fence.
+
+    Raises:
+        ClassificationError: If the reply holds no valid JSON
+    """
+    fenced = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    try:
+        return json.loads(fenced.group(1) if fenced else text)
+    except json.JSONDecodeError as e:
+        raise ClassificationError(f"Invalid JSON in response: {str(e)}")
+
+
+async def classify_with_assistant(client, assistant_id, email_body, metrics=None):
+    """
+    Classifies an email with the configured Assistant and its file_search dataset.
+
+    Takes at least five round trips: create a thread, add the message, run,
+    wait for the run and list the messages.
+
+    Args:
+        client: The AsyncOpenAI client
+        assistant_id (str): The Assistant to run
+        email_body (str): The email text to classify
+        metrics (dict, optional): Receives ``run_polls`` and ``run_streams`` counters
+
+    Returns:
+        dict: The classification
+    """
+    prompt = (
+        CLASSIFICATION_INSTRUCTIONS
+        + "Use the provided dataset file for reference. Format the response as a JSON object with 'request_intents' "
+        "containing a list of dictionaries (each with 'intent', 'reasoning', and 'confidence_score'), "
+        "and 'sub_requests' containing a list of dictionaries (each with 'sub_request' and 'reasoning')."
+        f"\n\nEmail Content:\n{email_body}"
+    )
+
+    # Create a thread to handle the classification
+    thread_response = await client.beta.threads.create()
+    thread_id = thread_response.id
+
+    # Send the email text as a message in the thread
+    await client.beta.threads.messages.create(thread_id=thread_id, role="user", content=prompt)
+
+    # Run the assistant and wait for it to finish (streamed, or polled with backoff)
+    try:
+        await run_assistant(client, thread_id, assistant_id, stats=metrics)
+    except RunError as e:
+        raise ClassificationError(
+            f"OpenAI Assistant failed to process request: {str(e)}",
+            status_code=504 if e.status == "timeout" else 500,
+        )
+
+    # The assistant's response is the first message in the list
+    messages = await client.beta.threads.messages.list(thread_id=thread_id)
+    if messages.data and messages.data[0].content:
+        return parse_json_reply(messages.data[0].content[0].text.value)
+
+    raise ClassificationError("Could not parse assistant response")
+
+
+def _render_example(value):
+    if isinstance(value, dict):
+        return "\n".join(f"{key}: {item}" for key, item in value.items())
+    return str(value).strip()
+
+
+def parse_reference_examples(filename, content):
+    """
+    Splits a reference dataset into examples.
+
+    JSON arrays, JSON lines and CSV rows become one example each, with every
+    field on its own line; other text is split on blank lines.
+
+    Args:
+        filename (str): The dataset file name, used to pick the format
+        content (str): The dataset text
+
+    Returns:
+        list: The examples as text, each cut to REFERENCE_EXAMPLE_TOKENS
+    """
+    extension = filename.split(".")[-1].lower()
+    if extension == "json":
+        data = json.loads(content)
+        records = data if isinstance(data, list) else [data]
+    elif extension == "jsonl":
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    elif extension == "csv":
+        records = list(csv.DictReader(io.StringIO(content)))
+    else:
+        records = re.split(r"\n\s*\n", content)
+    examples = (_render_example(record) for record in records)
+    return [truncate_tokens(example, REFERENCE_EXAMPLE_TOKENS) for example in examples if example]
+
+
+class ReferenceExamples:
+    """
+    Reference examples for the chat classifier, searched in memory.
+
+    The first CLASSIFY_STATIC_EXAMPLES examples are part of the static prompt
+    prefix. The rest are embedded once, on first use, and the closest ones to
+    each email are retrieved with a matrix-vector product, in place of the
+    Assistants file_search tool.
+    """
+
+    def __init__(self, embedding_service, path=REFERENCE_EXAMPLES_PATH, static_count=CLASSIFY_STATIC_EXAMPLES):
+        self.embedding_service = embedding_service
+        self.path = path
+        self.static_count = static_count
+        self.examples = []
+        self.matrix = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def static(self):
+        return self.examples[: self.static_count]
+
+    @property
+    def searchable(self):
+        return self.examples[self.static_count :]
+
+    def load(self):
+        """Loads the examples saved by the last configure call, if any."""
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                self.examples = [json.loads(line) for line in file if line.strip()]
+            self.matrix = None
+
+    def replace(self, examples):
+        """Replaces the examples and saves them for the next start."""
+        self.examples = list(examples)
+        self.matrix = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as file:
+            for example in self.examples:
+                file.write(json.dumps(example) + "\n")
+
+    async def _matrix(self):
+        async with self.lock:
+            if self.matrix is None:
+                vectors = np.asarray(
+                    await self.embedding_service.embed_many(self.searchable), dtype=np.float32
+                )
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                self.matrix = vectors / np.where(norms == 0, 1, norms)
+            return self.matrix
+
+    async def search(self, text, limit=CLASSIFY_RETRIEVED_EXAMPLES):
+        """
+        Returns the examples closest to a text, best first.
+
+        Args:
+            text (str): The email text
+            limit (int): Examples to return at most
+
+        Returns:
+            list: Example texts
+        """
+        if limit <= 0 or not self.searchable:
+            return []
+        # Shares the email's own embedding call when the text is the same
+        query, matrix = await asyncio.gather(self.embedding_service.embed(text), self._matrix())
+        scores = matrix @ np.asarray(query, dtype=np.float32)
+        return [self.searchable[index] for index in np.argsort(-scores)[:limit]]
+
+
+def static_prompt(examples):
+    """
+    Returns the system prompt: the instructions and the fixed examples.
+
+    It is identical for every email, so the provider's prompt cache can serve
+    it once it is long enough.
+    """
+    prompt = (
+        CLASSIFICATION_INSTRUCTIONS
+        + "Reference examples of classified emails are provided; use them for guidance. "
+        "Respond with a JSON object matching the given schema."
+    )
+    for number, example in enumerate(examples, start=1):
+        prompt += f"\n\nReference example {number}:\n{example}"
+    return prompt
+
+
+async def classify_with_chat(client, references, email_body, metrics=None, model=CHAT_MODEL):
+    """
+    Classifies an email with a single Chat Completions call.
+
+    The response is constrained to CLASSIFICATION_SCHEMA, so it always parses.
+
+    Args:
+        client: The AsyncOpenAI client
+        references (ReferenceExamples): Examples for the prompt
+        email_body (str): The email text to classify
+        metrics (dict, optional): Receives ``prompt_tokens`` and ``cached_prompt_tokens``
+        model (str): The chat model
+
+    Returns:
+        dict: The classification
+    """
+    retrieved = await references.search(email_body)
+    content = "".join(
+        f"Similar reference example {number}:\n{example}\n\n"
+        for number, example in enumerate(retrieved, start=1)
+    ) + f"Email Content:\n{email_body}"
+
+    response = await client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": static_prompt(references.static)},
+            {"role": "user", "content": content},
+        ],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "email_classification", "strict": True, "schema": CLASSIFICATION_SCHEMA},
+        },
+        temperature=0,
+    )
+
+    if metrics is not None and response.usage is not None:
+        details = response.usage.prompt_tokens_details
+        metrics["prompt_tokens"] = response.usage.prompt_tokens
+        metrics["cached_prompt_tokens"] = (details.cached_tokens or 0) if details else 0
+
+    message = response.choices[0].message
+    if getattr(message, "refusal", None):
+        raise ClassificationError(f"Model refused to classify the email: {message.refusal}")
+    if not message.content:
+        raise ClassificationError("Could not parse chat completion response")
+    return parse_json_reply(message.content)
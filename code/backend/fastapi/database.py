@@ -0,0 +1,213 @@
+import asyncio
+import os
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "dashboard")
+
+# Connection pool tuning. Each uvicorn worker gets its own pool, so keep
+# MONGO_MAX_POOL_SIZE x workers below the cluster's connection limit.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+# Exact $vectorSearch scans can take a while on large collections
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "60000"))
+
+SYSTEM_DATABASES = ["admin", "local", "config"]
+
+# Pages are sorted newest first; _id breaks ties between equal timestamps
+PAGE_SORT = [("created_at", -1), ("_id", -1)]
+# Exports run oldest first, walking the same index backwards
+EXPORT_SORT = [("created_at", 1), ("_id", 1)]
+
+
+def create_client(uri=MONGO_URI):
+    """
+    Creates the shared async MongoDB client with tuned pool sizes and timeouts.
+
+    The client connects lazily, so it can be created at import time.
+    """
+    return AsyncIOMotorClient(
+        uri,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        appname="email-orchestrator",
+    )
+
+
+async def fetch_documents(collection, query=None, projection=None, sort=None, skip=0, limit=100):
+    """
+    Returns one page of documents from a collection.
+
+    Args:
+        collection: The Motor collection
+        query (dict, optional): The filter
+        projection (dict, optional): Fields to include or exclude
+        sort (list, optional): (field, direction) pairs
+        skip (int): Documents to skip
+        limit (int): Maximum number of documents to return
+
+    Returns:
+        list: The documents
+    """
+    cursor = collection.find(query or {}, projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    if skip:
+        cursor = cursor.skip(skip)
+    # Limit server side too, so no batch beyond the page is ever sent
+    return await cursor.limit(limit).to_list(length=limit)
+
+
+async def iter_documents(collection, query=None, projection=None, sort=None, batch_size=1000):
+    """
+    Yields every matching document, fetching them from the server batch by batch.
+
+    The cursor is closed on the server if the consumer stops early, e.g. when
+    a client disconnects halfway through an export.
+
+    Args:
+        collection: The Motor collection
+        query (dict, optional): The filter
+        projection (dict, optional): Fields to include or exclude
+        sort (list, optional): (field, direction) pairs
+        batch_size (int): Documents per round trip to the server
+    """
+    cursor = collection.find(query or {}, projection, batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    try:
+        async for document in cursor:
+            yield document
+    finally:
+        await cursor.close()
+
+
+def _after_filter(position):
+    """Matches the documents sorted after a (created_at, _id) position in PAGE_SORT order."""
+    created_at, document_id = position
+    if created_at is None:
+        # Documents without a timestamp sort last, ordered by _id alone
+        return {"created_at": None, "_id": {"$lt": document_id}}
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": document_id}},
+            {"created_at": None},
+        ]
+    }
+
+
+def _with_sort_keys(projection):
+    """
+    Makes sure a projection returns the sort keys needed for the next position.
+
+    Returns:
+        tuple: (projection to query with, sort keys to strip from the results)
+    """
+    if not projection:
+        return projection, []
+    projection = dict(projection)
+    inclusive = any(value for key, value in projection.items() if key != "_id")
+    hidden = []
+    for key in ("created_at", "_id"):
+        if key in projection and not projection[key]:
+            del projection[key]
+            hidden.append(key)
+        elif inclusive and key not in projection and key != "_id":
+            projection[key] = True
+            hidden.append(key)
+    return projection, hidden
+
+
+async def fetch_page(collection, query=None, projection=None, after=None, skip=0, limit=100):
+    """
+    Returns one page of documents, newest first, using keyset pagination.
+
+    Resuming from the position of the previous page's last document lets the
+    server seek straight to the page through the created_at/_id index, however
+    deep it is, where ``skip`` has to walk past every skipped document.
+
+    Args:
+        collection: The Motor collection
+        query (dict, optional): The filter
+        projection (dict, optional): Fields to include or exclude
+        after (list, optional): The position returned with the previous page
+        skip (int): Documents to skip, for callers still paginating by offset
+        limit (int): Maximum number of documents to return
+
+    Returns:
+        tuple: (documents, position to fetch the next page from, or None on the last page)
+    """
+    if after is not None:
+        query = {"$and": [query, _after_filter(after)]} if query else _after_filter(after)
+    query_projection, hidden = _with_sort_keys(projection)
+
+    # One extra document tells whether another page exists, without counting
+    documents = await fetch_documents(
+        collection, query, query_projection, PAGE_SORT, skip, limit + 1
+    )
+    position = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        position = [documents[-1].get("created_at"), documents[-1]["_id"]]
+
+    for document in documents:
+        for key in hidden:
+            document.pop(key, None)
+    return documents, position
+
+
+async def ensure_indexes(collection):
+    """Creates the index backing PAGE_SORT; logs instead of failing if MongoDB is unreachable."""
+    try:
+        await collection.create_index(PAGE_SORT)
+    except Exception as e:
+        print(f"Could not create indexes on {collection.name}: {e}")
+
+
+async def count_collections(database):
+    """
+    Counts the documents of every collection in a database concurrently.
+
+    Uses the collection metadata rather than scanning, so the counts are
+    estimates (exact unless the server shut down uncleanly).
+
+    Returns:
+        list: ``{"name", "document_count"}`` for each collection
+    """
+    names = await database.list_collection_names()
+    counts = await asyncio.gather(*(database[name].estimated_document_count() for name in names))
+    return [
+        {"name": name, "document_count": count} for name, count in zip(names, counts)
+    ]
+
+
+async def describe_databases(client, exclude=SYSTEM_DATABASES):
+    """
+    Lists the non-system databases of the cluster with their collections.
+
+    Returns:
+        list: ``{"name", "collections", "collection_names"}`` for each database
+    """
+    names = [name for name in await client.list_database_names() if name not in exclude]
+    collections = await asyncio.gather(
+        *(client[name].list_collection_names() for name in names)
+    )
+    return [
+        {
+            "name": name,
+            "collections": len(collection_names),
+            "collection_names": collection_names,
+        }
+        for name, collection_names in zip(names, collections)
+    ]
@@ -0,0 +1,159 @@
+import asyncio
+import os
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+# How embeddings are written to MongoDB:
+#   "array"   - BSON array of doubles (~8 bytes per dimension plus per-element overhead)
+#   "float32" - packed float32 vector BinData (4 bytes per dimension)
+#   "int8"    - int8-quantized vector BinData (1 byte per dimension)
+# Atlas Vector Search indexes all three. Documents written in different
+# formats can coexist; every reader decodes them transparently.
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "array").lower()
+STORAGE_FORMATS = ("array", "float32", "int8")
+
+VECTOR_SUBTYPE = 9
+# Vector BinData starts with a dtype byte and a padding byte
+_HEADERS = {
+    "float32": BinaryVectorDtype.FLOAT32.value + b"\x00",
+    "int8": BinaryVectorDtype.INT8.value + b"\x00",
+}
+_DTYPES = {"float32": np.dtype("<f4"), "int8": np.dtype("i1")}
+
+
+def quantize_int8(embedding):
+    """
+    Scales an embedding into int8 by its largest component.
+
+    Every vector gets its own scale, which cosine similarity ignores, so
+    rankings and scores are preserved to within quantization error.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    peak = float(np.abs(vector).max()) if vector.size else 0.0
+    if peak == 0:
+        return np.zeros(vector.shape, dtype=np.int8)
+    return np.round(vector * (127 / peak)).astype(np.int8)
+
+
+def encode_embedding(embedding, storage=EMBEDDING_STORAGE):
+    """
+    Encodes an embedding in a storage format.
+
+    Args:
+        embedding (list): The embedding vector
+        storage (str): One of STORAGE_FORMATS
+
+    Returns:
+        list or Binary: The value to store in the ``embedding`` field
+    """
+    # Packed directly with NumPy; Binary.from_vector packs element by element
+    if storage == "float32":
+        vector = np.asarray(embedding, dtype=_DTYPES["float32"])
+        return Binary(_HEADERS["float32"] + vector.tobytes(), VECTOR_SUBTYPE)
+    if storage == "int8":
+        return Binary(_HEADERS["int8"] + quantize_int8(embedding).tobytes(), VECTOR_SUBTYPE)
+    if storage == "array":
+        return [float(value) for value in embedding]
+    raise ValueError(f"Unknown embedding storage format: {storage}")
+
+
+def storage_format(value):
+    """Returns the STORAGE_FORMATS name of a stored embedding, or "binary" for other BinData."""
+    if not isinstance(value, Binary):
+        return "array"
+    if value.subtype == VECTOR_SUBTYPE:
+        for storage, header in _HEADERS.items():
+            if value[:2] == header:
+                return storage
+    return "binary"
+
+
+def decode_embedding(value):
+    """
+    Decodes a stored embedding in any format into a float32 array.
+
+    int8 vectors come back in their quantized scale, which is fine for
+    cosine similarity but not for dot products against unquantized vectors.
+
+    Raises:
+        ValueError: If the value is BinData of an unsupported kind
+    """
+    storage = storage_format(value)
+    if storage == "array":
+        return np.asarray(value, dtype=np.float32)
+    if storage not in _DTYPES:
+        raise ValueError("Unsupported embedding BinData; expected a float32 or int8 vector")
+    return np.frombuffer(value, dtype=_DTYPES[storage], offset=2).astype(np.float32)
+
+
+def query_vector(embedding, storage=EMBEDDING_STORAGE):
+    """
+    Returns a query embedding in the form Atlas expects for the stored format.
+
+    int8 indexes are queried with int8 vectors; float vectors are sent as is.
+    """
+    if storage == "int8":
+        return encode_embedding(embedding, "int8")
+    return list(embedding)
+
+
+async def migrate_embeddings(collection, storage=EMBEDDING_STORAGE, batch_size=500, dry_run=False):
+    """
+    Rewrites every stored embedding that isn't already in the given format.
+
+    Documents are walked in _id order and updated a batch at a time, so the
+    migration can run against a live collection and be restarted at will.
+
+    Args:
+        collection: The Motor emails collection
+        storage (str): The target format, one of STORAGE_FORMATS
+        batch_size (int): Documents updated concurrently
+        dry_run (bool): Only count the documents that would change
+
+    Returns:
+        dict: ``scanned``, ``converted`` and ``bytes_before``/``bytes_after``
+        of the embedding fields
+    """
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown embedding storage format: {storage}")
+
+    report = {"scanned": 0, "converted": 0, "bytes_before": 0, "bytes_after": 0}
+    updates = []
+
+    async def flush():
+        if updates and not dry_run:
+            await asyncio.gather(
+                *(
+                    collection.update_one({"_id": document_id}, {"$set": {"embedding": value}})
+                    for document_id, value in updates
+                )
+            )
+        updates.clear()
+
+    cursor = collection.find(
+        {"embedding": {"$exists": True}}, {"embedding": 1}, batch_size=batch_size
+    ).sort("_id", 1)
+    async for document in cursor:
+        report["scanned"] += 1
+        value = document["embedding"]
+        if storage_format(value) == storage:
+            continue
+        encoded = encode_embedding(decode_embedding(value), storage)
+        report["converted"] += 1
+        report["bytes_before"] += embedding_bytes(value)
+        report["bytes_after"] += embedding_bytes(encoded)
+        updates.append((document["_id"], encoded))
+        if len(updates) >= batch_size:
+            await flush()
+    await flush()
+    return report
+
+
+def embedding_bytes(value):
+    """Returns the BSON size of an ``embedding`` field value."""
+    if isinstance(value, Binary):
+        # int32 length + subtype byte + payload
+        return 5 + len(value)
+    # int32 length + terminator, then per element: type byte, index key and double
+    return 5 + sum(1 + len(str(index)) + 1 + 8 for index in range(len(value)))
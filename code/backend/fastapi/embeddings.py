@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import os
+
+import numpy as np
+from cachetools import LRUCache
+
+from rate_governor import current_lane, lane_priority, openai_lane
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# How long the first request of a batch waits for others to join it
+EMBEDDING_BATCH_WINDOW = float(os.getenv("EMBEDDING_BATCH_WINDOW", "0.02"))
+# The API accepts up to 2048 inputs per call; stay well below its token cap too
+EMBEDDING_MAX_BATCH = int(os.getenv("EMBEDDING_MAX_BATCH", "256"))
+EMBEDDING_MAX_BATCH_CHARS = int(os.getenv("EMBEDDING_MAX_BATCH_CHARS", "600000"))
+# Memory held by cached vectors; a 1536-dimension float32 vector takes 6 KB
+EMBEDDING_CACHE_BYTES = int(os.getenv("EMBEDDING_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+
+def pool_embeddings(vectors, weights=None):
+    """
+    Combines the embeddings of an email's chunks into one unit-length vector.
+
+    Args:
+        vectors (list): The chunk embeddings
+        weights (list, optional): Relative weight of each chunk, e.g. its length
+
+    Returns:
+        list: The weighted mean, normalised like the model's own embeddings
+    """
+    pooled = np.average(np.asarray(vectors, dtype=np.float64), axis=0, weights=weights)
+    norm = np.linalg.norm(pooled)
+    return (pooled / norm if norm else pooled).tolist()
+
+
+class EmbeddingService:
+    """
+    Generates embeddings, coalescing concurrent requests into batched API calls.
+
+    Requests arriving within EMBEDDING_BATCH_WINDOW of each other are sent as a
+    single ``embeddings.create`` call. Vectors are cached by text hash as
+    float32 arrays, an eighth of the size of a list of Python floats, and
+    identical texts requested concurrently share one input slot.
+    """
+
+    def __init__(
+        self,
+        client,
+        model=EMBEDDING_MODEL,
+        batch_window=EMBEDDING_BATCH_WINDOW,
+        max_batch=EMBEDDING_MAX_BATCH,
+        max_batch_chars=EMBEDDING_MAX_BATCH_CHARS,
+        cache_bytes=EMBEDDING_CACHE_BYTES,
+    ):
+        self.client = client
+        self.model = model
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_batch_chars = max_batch_chars
+        self.cache = LRUCache(maxsize=cache_bytes, getsizeof=lambda vector: vector.nbytes)
+        # Texts waiting for the next API call: key -> (text, future)
+        self.pending = {}
+        self.pending_chars = 0
+        # The most urgent OpenAI lane among the pending texts' callers
+        self.pending_lane = None
+        self.flush_handle = None
+        # Keep references to running API calls so they aren't garbage collected
+        self.sending = set()
+        self.stats = {
+            "requests": 0,
+            "cache_hits": 0,
+            "coalesced": 0,
+            "api_calls": 0,
+            "api_inputs": 0,
+            "api_errors": 0,
+        }
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    async def embed(self, text):
+        """
+        Returns the embedding of a single text.
+
+        Args:
+            text (str): The text to embed
+
+        Returns:
+            list: The embedding vector
+        """
+        self.stats["requests"] += 1
+        key = self._key(text)
+
+        if key in self.cache:
+            self.stats["cache_hits"] += 1
+            return self.cache[key].tolist()
+
+        if key in self.pending:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.pending[key][1])
+
+        # Don't let one oversized batch exceed the API input limits
+        if self.pending and (
+            len(self.pending) >= self.max_batch
+            or self.pending_chars + len(text) > self.max_batch_chars
+        ):
+            self._flush()
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (text, future)
+        self.pending_chars += len(text)
+        lane = current_lane()
+        if self.pending_lane is None or lane_priority(lane) < lane_priority(self.pending_lane):
+            self.pending_lane = lane
+
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush
+            )
+
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts):
+        """Returns the embeddings of several texts, in order."""
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch, self.pending, self.pending_chars = self.pending, {}, 0
+        lane, self.pending_lane = self.pending_lane, None
+        # A batch shared with an interactive request is sent in its lane
+        with openai_lane(lane):
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+        self.sending.add(task)
+        task.add_done_callback(self.sending.discard)
+
+    async def _send(self, batch):
+        keys = list(batch)
+        try:
+            response = await self.client.embeddings.create(
+                input=[batch[key][0] for key in keys], model=self.model
+            )
+            self.stats["api_calls"] += 1
+            self.stats["api_inputs"] += len(keys)
+            # The API returns one item per input, tagged with its input index
+            for item in response.data:
+                key = keys[item.index]
+                try:
+                    self.cache[key] = np.asarray(item.embedding, dtype=np.float32)
+                except ValueError:
+                    pass  # larger than the whole cache
+                batch[key][1].set_result(item.embedding)
+            missing = [future for _, future in batch.values() if not future.done()]
+            if missing:
+                raise ValueError(f"Embedding response is missing {len(missing)} inputs")
+        except Exception as e:
+            self.stats["api_errors"] += 1
+            for _, future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Waiters that gave up must not log "exception never retrieved"
+                    future.exception()
+
+    def get_stats(self):
+        """Returns request, cache and batching counters."""
+        return {
+            **self.stats,
+            "cache_entries": len(self.cache),
+            "cache_bytes": self.cache.currsize,
+            "avg_batch_size": round(self.stats["api_inputs"] / self.stats["api_calls"], 2)
+            if self.stats["api_calls"]
+            else 0.0,
+        }
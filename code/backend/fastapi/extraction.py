@@ -0,0 +1,310 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import docx
+import PyPDF2
+from PIL import Image
+
+from mime import format_email_text, parse_eml
+from ocr import image_to_text
+from worker_pool import WorkerCrashed, WorkerPool
+
+# "process" isolates CPU-heavy OCR/PDF parsing in worker processes, "thread"
+# is handy for local development and "inline" runs on the calling thread.
+EXTRACTION_POOL = os.getenv("EXTRACTION_POOL", "process").lower()
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 2)))
+EXTRACTION_TIMEOUT = float(os.getenv("EXTRACTION_TIMEOUT", "60"))
+
+# PDF pages beyond the cap are not extracted; long statements rarely change
+# the intent after the first pages
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "50"))
+# Pages handed to one worker task; larger PDFs are spread across the pool
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+# Pages with less embedded text than this are treated as scanned and OCRed
+PDF_OCR_MIN_CHARS = int(os.getenv("PDF_OCR_MIN_CHARS", "20"))
+
+SUPPORTED_EXTENSIONS = {"pdf", "docx", "png", "jpg", "jpeg", "txt", "eml"}
+
+
+class UnsupportedFileType(ValueError):
+    """Raised when no extractor exists for a file's extension."""
+
+
+class ExtractionTimeout(Exception):
+    """Raised when extracting a single file takes longer than EXTRACTION_TIMEOUT."""
+
+
+class ExtractionCrashed(Exception):
+    """Raised when the worker extracting a file died (e.g. a native library crash)."""
+
+
+def file_extension(filename):
+    return filename.split(".")[-1].lower()
+
+
+def ocr_image(image):
+    """Runs OCR over a PIL image and returns the recognised text."""
+    return image_to_text(image)
+
+
+def _pdf_page_text(page):
+    """
+    Returns the text of one PDF page, OCRing its images when it has no text layer.
+
+    Each page's text is extracted once. Scanned pages are stored as one or more
+    images with little or no embedded text, so those are recognised instead.
+    """
+    text = page.extract_text() or ""
+    if len(text.strip()) >= PDF_OCR_MIN_CHARS:
+        return text
+
+    scanned = []
+    try:
+        images = page.images
+    except Exception as e:
+        print(f"Could not read the images of a PDF page: {e}")
+        images = []
+    for image in images:
+        try:
+            scanned.append(ocr_image(Image.open(io.BytesIO(image.data))))
+        except Exception as e:
+            print(f"Could not OCR image {image.name} of a PDF page: {e}")
+    scanned_text = "\n".join(part.strip() for part in scanned if part.strip())
+    return scanned_text if len(scanned_text) > len(text.strip()) else text
+
+
+def extract_pdf_pages(content, start, stop):
+    """
+    Extracts the text of pages [start, stop) of a PDF.
+
+    Runs inside pool workers, so several workers can share one large PDF.
+
+    Args:
+        content (bytes-like): The PDF content
+        start (int): First page to extract
+        stop (int): Page to stop before; clamped to the page count
+
+    Returns:
+        tuple: (list of page texts, total number of pages in the PDF)
+    """
+    reader = PyPDF2.PdfReader(io.BytesIO(content))
+    page_count = len(reader.pages)
+    texts = [_pdf_page_text(reader.pages[index]) for index in range(start, min(stop, page_count))]
+    return texts, page_count
+
+
+def join_pdf_pages(texts, page_count):
+    """Joins extracted page texts, noting when the page cap cut the PDF short."""
+    text = "\n".join(text for text in texts if text)
+    if page_count > PDF_MAX_PAGES:
+        text += f"\n\n[Truncated: extracted {PDF_MAX_PAGES} of {page_count} pages]"
+    return text
+
+
+def extract_text(filename, content):
+    """
+    Extracts text from the content of a supported file.
+
+    Runs inside pool workers, so it must stay a plain module-level function.
+
+    Args:
+        filename (str): The file name, used to pick the extractor
+        content (bytes-like): The file content, e.g. bytes or a memoryview
+
+    Returns:
+        str: The extracted text
+
+    Raises:
+        UnsupportedFileType: If the file type is not supported
+    """
+    file_type = file_extension(filename)
+    if file_type == "pdf":
+        return join_pdf_pages(*extract_pdf_pages(content, 0, PDF_MAX_PAGES))
+    elif file_type == "docx":
+        doc = docx.Document(io.BytesIO(content))
+        return "\n".join([p.text for p in doc.paragraphs])
+    elif file_type in ["png", "jpg", "jpeg"]:
+        return ocr_image(Image.open(io.BytesIO(content)))
+    elif file_type == "txt":
+        return str(content, "utf-8")
+    elif file_type == "eml":
+        return format_email_text(parse_eml(content))
+    else:
+        raise UnsupportedFileType(f"Unsupported file type: {file_type}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if EXTRACTION_POOL == "process":
+                # spawn keeps workers free of the server's threads and sockets
+                _pool = WorkerPool(EXTRACTION_WORKERS, multiprocessing.get_context("spawn"))
+            else:
+                _pool = ThreadPoolExecutor(
+                    max_workers=EXTRACTION_WORKERS, thread_name_prefix="extract"
+                )
+        return _pool
+
+
+def shutdown_pool():
+    """Stops the extraction workers; called when the app shuts down."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if isinstance(pool, WorkerPool):
+        pool.shutdown()
+    elif pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_text_async(filename, content, timeout=None, cache=None):
+    """
+    Extracts text from a file on the extraction pool without blocking the event loop.
+
+    A worker crash is retried once on a fresh worker process. A crash or a
+    timeout only ever stops the process working on this file, so it cannot
+    take down extraction for other requests.
+
+    Args:
+        filename (str): The file name, used to pick the extractor
+        content (bytes-like): The file content
+        timeout (float, optional): Seconds allowed for this file, defaults to EXTRACTION_TIMEOUT
+        cache (ExtractionCache, optional): Serves repeat attachments without re-extracting
+
+    Returns:
+        str: The extracted text
+
+    Raises:
+        UnsupportedFileType: If the file type is not supported
+        ExtractionTimeout: If extraction takes longer than the timeout
+        ExtractionCrashed: If the worker process died twice in a row
+    """
+    # Fail fast without a round trip to a worker
+    if file_extension(filename) not in SUPPORTED_EXTENSIONS:
+        raise UnsupportedFileType(f"Unsupported file type: {file_extension(filename)}")
+
+    if file_extension(filename) == "pdf":
+        extract = lambda: _extract_pdf_on_pool(filename, content, timeout)
+    else:
+        extract = lambda: _extract_on_pool(filename, content, timeout)
+    if cache is not None:
+        return await cache.get_or_extract(filename, content, extract)
+    return await extract()
+
+
+async def _extract_pdf_on_pool(filename, content, timeout):
+    """
+    Extracts a PDF a few pages per task so a long document uses several workers.
+
+    The first task also reports the page count, so short PDFs still take a
+    single round trip; the remaining pages up to PDF_MAX_PAGES are then
+    extracted in parallel.
+    """
+    if EXTRACTION_POOL == "inline":
+        return extract_text(filename, content)
+    if EXTRACTION_POOL == "process" and not isinstance(content, bytes):
+        # Copied once here rather than once per task
+        content = bytes(content)
+
+    step = max(1, PDF_PAGES_PER_TASK)
+    texts, page_count = await _extract_on_pool(
+        filename, content, timeout, extract_pdf_pages, content, 0, min(step, PDF_MAX_PAGES)
+    )
+    last_page = min(page_count, PDF_MAX_PAGES)
+    rest = await asyncio.gather(
+        *(
+            _extract_on_pool(
+                filename,
+                content,
+                timeout,
+                extract_pdf_pages,
+                content,
+                start,
+                min(start + step, last_page),
+            )
+            for start in range(step, last_page, step)
+        )
+    )
+    for page_texts, _ in rest:
+        texts.extend(page_texts)
+    return join_pdf_pages(texts, page_count)
+
+
+async def parse_email_async(filename, content, timeout=None):
+    """
+    Parses an .eml file on the extraction pool in a single MIME walk.
+
+    Args:
+        filename (str): The file name, used in error messages
+        content (bytes-like): The .eml file content
+        timeout (float, optional): Seconds allowed, defaults to EXTRACTION_TIMEOUT
+
+    Returns:
+        dict: The parsed email, see mime.parse_eml
+    """
+    return await _extract_on_pool(filename, content, timeout, parse_eml, content)
+
+
+async def _extract_on_pool(filename, content, timeout, function=None, *args):
+    if function is None:
+        function, args = extract_text, (filename, content)
+    if EXTRACTION_POOL == "inline":
+        return function(*args)
+
+    timeout = EXTRACTION_TIMEOUT if timeout is None else timeout
+    if EXTRACTION_POOL == "process" and not isinstance(content, bytes):
+        # Worker processes receive a pickled copy; memoryviews can't be pickled
+        args = tuple(bytes(arg) if arg is content else arg for arg in args)
+
+    for attempt in range(2):
+        pool = _get_pool()
+        if isinstance(pool, WorkerPool):
+            task = pool.submit(function, *args)
+            future, stop = task.future, task.kill
+        else:
+            # A thread can't be stopped; a timed out one finishes in the background
+            future = pool.submit(function, *args)
+            stop = future.cancel
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            # Kill only the worker stuck on this file, e.g. a hung tesseract call
+            stop()
+            raise ExtractionTimeout(f"Extracting {filename} took longer than {timeout}s")
+        except asyncio.CancelledError:
+            stop()
+            raise
+        except WorkerCrashed:
+            print(f"Extraction worker crashed on {filename} (attempt {attempt + 1})")
+
+    raise ExtractionCrashed(f"Extraction worker crashed while processing {filename}")
+
+
+async def extract_many(files, timeout=None, cache=None):
+    """
+    Extracts text from several files in parallel.
+
+    Args:
+        files (iterable): (filename, bytes) tuples
+        timeout (float, optional): Seconds allowed per file
+        cache (ExtractionCache, optional): Serves repeat attachments without re-extracting
+
+    Returns:
+        list: Extracted text, or the exception raised, for each file in order
+    """
+    return await asyncio.gather(
+        *(
+            extract_text_async(filename, content, timeout, cache)
+            for filename, content in files
+        ),
+        return_exceptions=True,
+    )
@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+from cachetools import LRUCache
+
+# Bump whenever extraction output changes so stale cached text is ignored
+EXTRACTOR_VERSION = "4"
+
+# "mongo", "disk" or "none" for the persistent tier
+EXTRACTION_CACHE_BACKEND = os.getenv("EXTRACTION_CACHE_BACKEND", "mongo").lower()
+EXTRACTION_CACHE_DIR = os.getenv(
+    "EXTRACTION_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "extraction"),
+)
+# Upper bound on the characters of text held by the in-memory tier
+EXTRACTION_CACHE_MEMORY_CHARS = int(os.getenv("EXTRACTION_CACHE_MEMORY_CHARS", str(64 * 1024 * 1024)))
+# Days an entry of the "mongo" tier is kept after it was written
+EXTRACTION_CACHE_TTL_DAYS = float(os.getenv("EXTRACTION_CACHE_TTL_DAYS", "30"))
+
+# Settings that change the extracted text; see settings_fingerprint
+EXTRACTION_SETTINGS = (
+    "PDF_MAX_PAGES",
+    "PDF_OCR_MIN_CHARS",
+    "OCR_LANG",
+    "OCR_TARGET_DPI",
+    "OCR_MAX_SHORT_SIDE",
+    "OCR_TILE_HEIGHT",
+)
+
+
+def settings_fingerprint(environ=None):
+    """
+    Returns a short hash of the extraction settings configured in the environment.
+
+    Text extracted with other settings (e.g. fewer PDF pages or another OCR
+    language) then misses the cache instead of being served. Changes to the
+    settings' defaults come with an EXTRACTOR_VERSION bump instead.
+    """
+    environ = os.environ if environ is None else environ
+    settings = "\n".join(f"{name}={environ.get(name, '')}" for name in EXTRACTION_SETTINGS)
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:12]
+
+
+SETTINGS_FINGERPRINT = settings_fingerprint()
+
+
+def cache_key(filename, content, fingerprint=None):
+    """
+    Returns the content address of an attachment.
+
+    The extension is part of the key because the same bytes are extracted
+    differently depending on the declared type (e.g. .txt vs .eml), and so is
+    the fingerprint of the extraction settings.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    extension = filename.split(".")[-1].lower()
+    fingerprint = SETTINGS_FINGERPRINT if fingerprint is None else fingerprint
+    return f"{EXTRACTOR_VERSION}:{fingerprint}:{extension}:{digest}"
+
+
+class MongoTextStore:
+    """Persistent tier backed by an async MongoDB collection keyed by content address."""
+
+    def __init__(self, collection, ttl_days=EXTRACTION_CACHE_TTL_DAYS):
+        self.collection = collection
+        self.ttl_days = ttl_days
+
+    async def ensure_indexes(self):
+        """Creates the TTL index that expires entries ``ttl_days`` after they were written."""
+        await self.collection.create_index(
+            "created_at", expireAfterSeconds=int(self.ttl_days * 24 * 3600)
+        )
+
+    async def get(self, key):
+        document = await self.collection.find_one({"_id": key}, {"text": 1})
+        return document["text"] if document else None
+
+    async def put(self, key, text):
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"text": text, "created_at": datetime.now()}},
+            upsert=True,
+        )
+
+
+class DiskTextStore:
+    """Persistent tier storing one UTF-8 file per content address."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = key.replace(":", "-")
+        # Fan out over sub-directories so no single directory gets huge
+        return os.path.join(self.directory, name[-2:], name + ".txt")
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._read, key)
+
+    async def put(self, key, text):
+        await asyncio.to_thread(self._write, key, text)
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so readers never see a partial file
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(path), delete=False
+        ) as f:
+            f.write(text)
+        os.replace(f.name, path)
+
+
+class ExtractionCache:
+    """
+    Two-tier cache of extracted attachment text keyed by content address.
+
+    Lookups check an in-memory LRU first and then the persistent store;
+    concurrent misses for the same attachment share a single extraction, which
+    runs to completion (and is cached) even if its first caller goes away.
+    """
+
+    def __init__(self, store=None, memory_chars=EXTRACTION_CACHE_MEMORY_CHARS):
+        self.store = store
+        self.memory = LRUCache(maxsize=memory_chars, getsizeof=lambda text: max(1, len(text)))
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "coalesced": 0,
+            "misses": 0,
+            "store_errors": 0,
+        }
+
+    async def ensure_indexes(self):
+        """Creates the persistent store's indexes, if it has any; logs if that fails."""
+        if not hasattr(self.store, "ensure_indexes"):
+            return
+        try:
+            await self.store.ensure_indexes()
+        except Exception as e:
+            print(f"Could not create extraction cache indexes: {e}")
+
+    def _remember(self, key, text):
+        with self.lock:
+            # Texts larger than the whole memory tier are only kept on disk/in Mongo
+            if len(text) <= self.memory.maxsize:
+                self.memory[key] = text
+
+    async def get_or_extract(self, filename, content, extract):
+        """
+        Returns the cached text for an attachment, extracting it on a miss.
+
+        Args:
+            filename (str): The attachment file name
+            content (bytes): The attachment content
+            extract (callable): Async callable returning the extracted text
+
+        Returns:
+            str: The extracted text
+        """
+        key = cache_key(filename, content)
+
+        with self.lock:
+            text = self.memory.get(key)
+        if text is not None:
+            self.stats["memory_hits"] += 1
+            return text
+
+        if key in self.inflight:
+            # The same attachment is already being extracted for another email
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        # The extraction runs as its own task, so a caller that is cancelled
+        # (e.g. a disconnected client) doesn't cancel it for the others waiting
+        task = asyncio.ensure_future(self._load_or_extract(key, extract))
+        self.inflight[key] = task
+        task.add_done_callback(lambda done: self._settle(key, done))
+        return await asyncio.shield(task)
+
+    async def _load_or_extract(self, key, extract):
+        text = await self._load_persistent(key)
+        if text is not None:
+            self.stats["persistent_hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            text = await extract()
+            await self._save_persistent(key, text)
+        self._remember(key, text)
+        return text
+
+    def _settle(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            # Nobody may be waiting any more; don't log "exception never retrieved"
+            task.exception()
+
+    async def _load_persistent(self, key):
+        if self.store is None:
+            return None
+        try:
+            return await self.store.get(key)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"Extraction cache read failed: {e}")
+            return None
+
+    async def _save_persistent(self, key, text):
+        if self.store is None:
+            return
+        try:
+            await self.store.put(key, text)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            print(f"Extraction cache write failed: {e}")
+
+    def get_stats(self):
+        """Returns hit/miss counters and the in-memory tier size."""
+        hits = (
+            self.stats["memory_hits"] + self.stats["persistent_hits"] + self.stats["coalesced"]
+        )
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_chars": self.memory.currsize,
+        }
+
+
+def create_extraction_cache(database=None):
+    """
+    Creates the extraction cache configured by EXTRACTION_CACHE_BACKEND.
+
+    Args:
+        database (optional): The async MongoDB database for the "mongo" backend
+
+    Returns:
+        ExtractionCache: The cache (memory-only when the backend is "none")
+    """
+    if EXTRACTION_CACHE_BACKEND == "mongo" and database is not None:
+        store = MongoTextStore(database["extraction_cache"])
+    elif EXTRACTION_CACHE_BACKEND == "disk":
+        store = DiskTextStore(EXTRACTION_CACHE_DIR)
+    else:
+        store = None
+    return ExtractionCache(store)
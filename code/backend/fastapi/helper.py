@@ -1,11 +1,67 @@
 import requests
 import os
+import time
 from dotenv import load_dotenv
 import json
+import httpx
+import urllib3
+
+from rate_governor import OPENAI_MAX_RETRIES, retry_delay, retryable
 
 load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 
+def post_with_retries(url, **kwargs):
+    """
+    Makes a POST request to the OpenAI API, retrying what is safe to retry.
+
+    Follows rate_governor.retryable: rate limits (429) and connections that
+    failed before the request was sent are retried; server errors and dropped
+    connections are not, as these POSTs create files, vector stores and
+    assistants that a second attempt would duplicate. Waits as long as the
+    response's Retry-After asks, or a jittered exponential backoff without
+    one, up to OPENAI_MAX_RETRIES times.
+
+    Args:
+        url (str): The API endpoint
+        **kwargs: Passed on to requests.post
+
+    Returns:
+        requests.Response: The last response
+    """
+    # Only the method, headers and path matter to retryable
+    request = httpx.Request("POST", url, headers=kwargs.get("headers"))
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        # Rewind uploaded files before sending them again
+        for _, file in (kwargs.get("files") or {}).values():
+            file.seek(0)
+        try:
+            response = requests.post(url, **kwargs)
+        except requests.ConnectionError as e:
+            if attempt == OPENAI_MAX_RETRIES or not retryable(request, error=_as_httpx_error(e)):
+                raise
+            delay = retry_delay(attempt)
+        else:
+            if not retryable(request, response.status_code) or attempt == OPENAI_MAX_RETRIES:
+                return response
+            if b"insufficient_quota" in response.content:
+                return response
+            delay = retry_delay(attempt, response.headers)
+        print(f"Retrying {url} in {delay:.1f}s")
+        time.sleep(delay)
+
+
+def _as_httpx_error(error):
+    """Maps a requests connection error to the httpx error retryable knows it by."""
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    if isinstance(error, requests.ConnectTimeout) or isinstance(
+        reason, urllib3.exceptions.NewConnectionError
+    ):
+        # The connection was never made, so nothing was sent
+        return httpx.ConnectError(str(error))
+    return httpx.ReadError(str(error))
+
+
 def upload_file_to_openai(file_path):
     """
     Uploads a file to OpenAI API for use with assistants.
@@ -42,7 +98,7 @@ def upload_file_to_openai(file_path):
         }
         
         # Make the POST request
-        response = requests.post(url, headers=headers, files=files, data=data)
+        response = post_with_retries(url, headers=headers, files=files, data=data)
     
     # Check if the request was successful
     if response.status_code == 200:
@@ -78,7 +134,7 @@ def create_vector_store():
     }
     
     # Make the POST request
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    response = post_with_retries(url, headers=headers, data=json.dumps(data))
     
     # Check if the request was successful
     if response.status_code in [200, 201]:
@@ -117,7 +173,7 @@ def add_file_to_vector_store(vector_store_id, file_id):
     }
     
     # Make the POST request
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    response = post_with_retries(url, headers=headers, data=json.dumps(data))
     
     # Check if the request was successful
     if response.status_code in [200, 201]:
@@ -179,7 +235,7 @@ def create_assistant_with_vector_store(file_path, prompt_text):
     }
     
     # Make the POST request
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    response = post_with_retries(url, headers=headers, data=json.dumps(data))
     
     # Check if the request was successful
     if response.status_code in [200, 201]:
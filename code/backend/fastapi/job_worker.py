@@ -0,0 +1,55 @@
+"""
+Processes emails queued with POST /process_email?async=true, outside the API.
+
+    python job_worker.py --concurrency 4
+
+Run as many worker processes as the ingestion load needs; they share the
+queue in MongoDB. Set JOB_API_WORKERS=0 on the API processes so that only
+these workers take jobs. SIGTERM lets running jobs finish before exiting.
+
+Workers need SIMILARITY_BACKEND=atlas: the local index lives in the memory
+and files of one process, so emails a worker stored would be missing from the
+API's index (and two processes would write the same index files).
+"""
+import argparse
+import asyncio
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import main
+from jobs import JOB_POLL_INTERVAL, run_workers
+from similarity import SIMILARITY_BACKEND
+
+
+async def run(concurrency, poll_interval):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await main.start_services()
+    print(f"Processing jobs, {concurrency} at a time")
+    try:
+        await run_workers(
+            main.job_queue, main.process_job, concurrency, poll_interval=poll_interval, stop=stop
+        )
+    finally:
+        main.stop_services()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--concurrency", type=int, default=4, help="Jobs processed at the same time")
+    parser.add_argument("--poll-interval", type=float, default=JOB_POLL_INTERVAL)
+    args = parser.parse_args()
+    if SIMILARITY_BACKEND == "local":
+        sys.exit("job_worker.py needs SIMILARITY_BACKEND=atlas; with the local index, run jobs in the API (JOB_API_WORKERS)")
+    asyncio.run(run(args.concurrency, args.poll_interval))
+
+
+if __name__ == "__main__":
+    cli()
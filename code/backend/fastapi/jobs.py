@@ -0,0 +1,346 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
+
+from database import PAGE_SORT, fetch_page
+
+JOBS_COLLECTION = os.getenv("JOBS_COLLECTION", "jobs")
+JOB_FILES_COLLECTION = os.getenv("JOB_FILES_COLLECTION", "job_files")
+# Attempts per job before it is marked failed, and the base of the backoff between them
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "10"))
+# A running job whose worker stops renewing its lease for this long is run again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+# How often an idle worker looks for new jobs
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# Uploaded files are stored in parts well below MongoDB's 16 MB document limit
+JOB_FILE_PART_BYTES = 8 * 1024 * 1024
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying the job cannot help, e.g. an unsupported file."""
+
+
+def worker_name():
+    """Returns a name identifying this worker process in job documents."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class JobQueue:
+    """
+    A durable queue of emails to process, kept in MongoDB.
+
+    Jobs move from ``queued`` to ``running`` to ``done`` or ``failed``. A
+    worker claims a job atomically and holds a lease on it that it renews
+    while working; if the worker dies, the lease runs out and another worker
+    picks the job up. Failed attempts are retried with exponential backoff up
+    to ``max_attempts``.
+
+    The uploaded files of a job are stored in a separate collection, in parts,
+    and deleted once the job has finished.
+    """
+
+    def __init__(self, jobs, files, max_attempts=JOB_MAX_ATTEMPTS, lease_seconds=JOB_LEASE_SECONDS):
+        self.jobs = jobs
+        self.files = files
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+    async def ensure_indexes(self):
+        """Creates the indexes used to claim, list and load jobs; logs if MongoDB is unreachable."""
+        try:
+            await asyncio.gather(
+                self.jobs.create_index([("status", 1), ("run_after", 1)]),
+                self.jobs.create_index([("status", 1), ("lease_until", 1)]),
+                self.jobs.create_index(PAGE_SORT),
+                self.files.create_index([("job_id", 1), ("index", 1), ("part", 1)]),
+            )
+        except Exception as e:
+            print(f"Could not create job indexes: {e}")
+
+    async def enqueue(self, request, files=()):
+        """
+        Adds a job to the queue.
+
+        Args:
+            request (dict): What the handler needs besides the files
+            files (iterable): (role, filename, bytes-like content) tuples
+
+        Returns:
+            ObjectId: The job id
+        """
+        job_id = ObjectId()
+        parts = []
+        names = []
+        for index, (role, filename, content) in enumerate(files):
+            names.append({"role": role, "filename": filename, "size": len(content)})
+            view = memoryview(content)
+            for part, start in enumerate(range(0, max(len(view), 1), JOB_FILE_PART_BYTES)):
+                parts.append(
+                    {
+                        "job_id": job_id,
+                        "index": index,
+                        "part": part,
+                        "data": Binary(bytes(view[start : start + JOB_FILE_PART_BYTES])),
+                    }
+                )
+        # Files first, so a worker never claims a job whose files are missing
+        if parts:
+            await self.files.insert_many(parts)
+
+        now = datetime.now()
+        await self.jobs.insert_one(
+            {
+                "_id": job_id,
+                "status": "queued",
+                "request": request,
+                "files": names,
+                "attempts": 0,
+                "max_attempts": self.max_attempts,
+                "created_at": now,
+                "updated_at": now,
+                "run_after": now,
+                "lease_until": None,
+                "worker": None,
+                "result": None,
+                "error": None,
+            }
+        )
+        return job_id
+
+    async def claim(self, worker):
+        """
+        Takes the oldest runnable job: queued and due, or running with an expired lease.
+
+        Returns:
+            dict or None: The claimed job, now ``running`` and leased to ``worker``
+        """
+        now = datetime.now()
+        job = await self.jobs.find_one_and_update(
+            {
+                "$or": [
+                    {"status": "queued", "run_after": {"$lte": now}},
+                    {"status": "running", "lease_until": {"$lt": now}},
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": worker,
+                    "started_at": now,
+                    "updated_at": now,
+                    "lease_until": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None and job["attempts"] > job["max_attempts"]:
+            # Its last worker died mid-attempt and there are none left
+            await self.finish(job, error="Worker stopped before the job finished")
+            return await self.claim(worker)
+        return job
+
+    async def renew(self, job, worker):
+        """Extends the lease of a running job; returns False if the job was taken over."""
+        now = datetime.now()
+        result = await self.jobs.update_one(
+            {"_id": job["_id"], "status": "running", "worker": worker},
+            {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now}},
+        )
+        return result.matched_count == 1
+
+    async def load_files(self, job):
+        """
+        Reassembles the uploaded files of a job.
+
+        Returns:
+            list: (role, filename, bytes) tuples in upload order
+        """
+        parts = await self.files.find({"job_id": job["_id"]}).sort(
+            [("index", 1), ("part", 1)]
+        ).to_list(length=None)
+        contents = {}
+        for part in parts:
+            contents.setdefault(part["index"], []).append(bytes(part["data"]))
+        return [
+            (file["role"], file["filename"], b"".join(contents.get(index, [])))
+            for index, file in enumerate(job.get("files") or [])
+        ]
+
+    def _leased(self, job):
+        # Only the worker still holding the job may record its outcome
+        return {"_id": job["_id"], "status": "running", "worker": job["worker"]}
+
+    async def finish(self, job, result=None, error=None):
+        """
+        Marks a job done (or failed, given an error) and deletes its files.
+
+        Returns:
+            bool: False if the job's lease was lost to another worker, which
+            then owns the job; nothing is changed
+        """
+        now = datetime.now()
+        updated = await self.jobs.update_one(
+            self._leased(job),
+            {
+                "$set": {
+                    "status": "failed" if error else "done",
+                    "result": result,
+                    "error": error,
+                    "finished_at": now,
+                    "updated_at": now,
+                    "lease_until": None,
+                }
+            },
+        )
+        if updated.matched_count == 0:
+            return False
+        await self.files.delete_many({"job_id": job["_id"]})
+        return True
+
+    async def retry_later(self, job, error):
+        """
+        Queues a failed attempt again after an exponential backoff, or fails the job.
+
+        Returns:
+            bool: False if the job's lease was lost to another worker
+        """
+        if job["attempts"] >= job["max_attempts"]:
+            return await self.finish(job, error=error)
+        now = datetime.now()
+        delay = JOB_RETRY_DELAY * 2 ** (job["attempts"] - 1)
+        updated = await self.jobs.update_one(
+            self._leased(job),
+            {
+                "$set": {
+                    "status": "queued",
+                    "error": error,
+                    "run_after": now + timedelta(seconds=delay),
+                    "updated_at": now,
+                    "lease_until": None,
+                    "worker": None,
+                }
+            },
+        )
+        return updated.matched_count == 1
+
+    async def get(self, job_id):
+        """Returns a job by id, or None."""
+        return await self.jobs.find_one({"_id": job_id})
+
+    async def page(self, status=None, projection=None, after=None, limit=50):
+        """Returns one page of jobs, newest first (see database.fetch_page)."""
+        query = {"status": status} if status else None
+        return await fetch_page(self.jobs, query, projection, after=after, limit=limit)
+
+    async def counts(self):
+        """Returns the number of jobs in each status."""
+        counts = {status: 0 for status in JOB_STATUSES}
+        async for row in self.jobs.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+
+async def _keep_leased(queue, job, worker, stop, lost):
+    """Renews a job's lease until ``stop`` is set; calls ``lost`` if another worker took it."""
+    interval = queue.lease_seconds / 3
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            try:
+                renewed = await queue.renew(job, worker)
+            except Exception as e:
+                print(f"Could not renew the lease of job {job['_id']}: {e}")
+                continue
+            if not renewed:
+                lost()
+                return
+
+
+async def run_job(queue, job, handler, worker):
+    """
+    Runs one claimed job and records its outcome.
+
+    Args:
+        queue (JobQueue): The queue the job came from
+        job (dict): The claimed job
+        handler: ``async handler(job, files)`` returning the job's result
+        worker (str): The name the job is leased to
+    """
+    async def work():
+        return await handler(job, await queue.load_files(job))
+
+    stop = asyncio.Event()
+    task = asyncio.ensure_future(work())
+    lost = []
+
+    def lose_lease():
+        # Another worker runs the job now; stop before storing it twice
+        lost.append(True)
+        task.cancel()
+
+    lease = asyncio.ensure_future(_keep_leased(queue, job, worker, stop, lose_lease))
+    try:
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not lost:
+                raise
+            recorded = False
+        except PermanentJobError as e:
+            print(f"Job {job['_id']} failed: {e}")
+            recorded = await queue.finish(job, error=str(e))
+        except Exception as e:
+            print(f"Job {job['_id']} attempt {job['attempts']} failed: {e}")
+            recorded = await queue.retry_later(job, str(e))
+        else:
+            recorded = await queue.finish(job, result=result)
+        if not recorded:
+            print(f"Job {job['_id']}: lease lost to another worker, outcome discarded")
+    finally:
+        task.cancel()
+        stop.set()
+        await lease
+
+
+async def run_workers(queue, handler, concurrency=1, poll_interval=JOB_POLL_INTERVAL, stop=None):
+    """
+    Processes jobs until ``stop`` is set, ``concurrency`` at a time.
+
+    Args:
+        queue (JobQueue): The queue to take jobs from
+        handler: ``async handler(job, files)`` returning the job's result
+        concurrency (int): Jobs run at the same time
+        poll_interval (float): Seconds an idle worker waits before looking again
+        stop (asyncio.Event, optional): Stops the workers once their current job is done
+    """
+    stop = stop or asyncio.Event()
+    name = worker_name()
+
+    async def work(slot):
+        worker = f"{name}/{slot}"
+        while not stop.is_set():
+            try:
+                job = await queue.claim(worker)
+            except Exception as e:
+                print(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await run_job(queue, job, handler, worker)
+
+    await asyncio.gather(*(work(slot) for slot in range(concurrency)))
@@ -0,0 +1,145 @@
+import os
+from collections import defaultdict
+
+# Classify from the similar emails' labels when their vote is confident enough
+KNN_ENABLED = os.getenv("KNN_ENABLED", "true").lower() in ("1", "true", "yes")
+# Share of the neighbours' score mass that must agree on the top intent
+KNN_CONFIDENCE = float(os.getenv("KNN_CONFIDENCE", "0.8"))
+# Labelled neighbours needed for a vote, and the score each must reach
+KNN_MIN_NEIGHBOURS = int(os.getenv("KNN_MIN_NEIGHBOURS", "3"))
+KNN_MIN_SCORE = float(os.getenv("KNN_MIN_SCORE", "0.9"))
+# Share of fast-path emails also sent to the LLM to measure agreement
+KNN_AUDIT_RATE = float(os.getenv("KNN_AUDIT_RATE", "0.05"))
+# Emails stored before classification_source was recorded were all labelled by the LLM
+VOTING_SOURCES = ("llm", None)
+
+
+def top_intent(classification):
+    """Returns the normalised highest-confidence intent of a classification, or None."""
+    intents = (classification or {}).get("request_intents") or []
+    intents = [intent for intent in intents if isinstance(intent, dict) and intent.get("intent")]
+    if not intents:
+        return None
+    best = max(intents, key=lambda intent: intent.get("confidence_score") or 0)
+    return best["intent"].strip().lower()
+
+
+class KnnClassifier:
+    """
+    Classifies an email by a score-weighted vote of its similar emails.
+
+    Each stored email is a labelled example: its embedding finds it as a
+    neighbour and its classification is the label. Every neighbour scoring at
+    least ``min_score`` votes for its top intent with its similarity score; the
+    winning intent's share of the votes is the confidence. Only labels from the
+    LLM vote: a kNN or reused label is a copy of other emails' labels, and
+    letting it vote would make past votes reinforce themselves.
+
+    Counters track how many emails the vote classified and how often it agrees
+    with the LLM, both on emails the LLM classified anyway (shadow votes) and
+    on the sample of fast-path emails re-checked by the LLM (audits).
+    """
+
+    def __init__(
+        self,
+        confidence=KNN_CONFIDENCE,
+        min_neighbours=KNN_MIN_NEIGHBOURS,
+        min_score=KNN_MIN_SCORE,
+        enabled=KNN_ENABLED,
+    ):
+        self.confidence = confidence
+        self.min_neighbours = min_neighbours
+        self.min_score = min_score
+        self.enabled = enabled
+        self.stats = {
+            "fast_path": 0,
+            "llm": 0,
+            "shadow_compared": 0,
+            "shadow_agreed": 0,
+            "audited": 0,
+            "audit_agreed": 0,
+        }
+
+    def vote(self, similar_emails):
+        """
+        Votes over the labelled neighbours of an email.
+
+        Args:
+            similar_emails (list): Search results with ``score``, ``classification``
+                and ``classification_source``
+
+        Returns:
+            dict or None: ``classification`` in the LLM's format, ``confidence``
+            and ``neighbours`` (voters), or None with too few voters
+        """
+        weights = defaultdict(float)
+        labels = {}
+        sub_requests = {}
+        voters = 0
+        for neighbour in sorted(similar_emails, key=lambda n: n.get("score", 0), reverse=True):
+            score = neighbour.get("score", 0)
+            intent = top_intent(neighbour.get("classification"))
+            if (
+                intent is None
+                or score < self.min_score
+                or neighbour.get("classification_source") not in VOTING_SOURCES
+            ):
+                continue
+            voters += 1
+            weights[intent] += score
+            for candidate in neighbour["classification"]["request_intents"]:
+                if isinstance(candidate, dict) and str(candidate.get("intent", "")).strip().lower() == intent:
+                    # Keep the closest neighbour's spelling and sub-requests
+                    labels.setdefault(intent, candidate["intent"])
+            sub_requests.setdefault(intent, neighbour["classification"].get("sub_requests") or [])
+
+        if voters < self.min_neighbours:
+            return None
+
+        total = sum(weights.values())
+        ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "classification": {
+                "request_intents": [
+                    {
+                        "intent": labels[intent],
+                        "reasoning": f"Top intent of {voters} similar emails, weighted by similarity",
+                        "confidence_score": round(weight / total, 4),
+                    }
+                    for intent, weight in ranked[:3]
+                ],
+                "sub_requests": sub_requests[ranked[0][0]],
+            },
+            "confidence": ranked[0][1] / total,
+            "neighbours": voters,
+        }
+
+    def is_confident(self, vote):
+        return self.enabled and vote is not None and vote["confidence"] >= self.confidence
+
+    def record_fast_path(self, served):
+        self.stats["fast_path" if served else "llm"] += 1
+
+    def record_agreement(self, vote, classification, audited=False):
+        """Counts whether a vote's top intent matches the LLM's classification."""
+        if vote is None:
+            return
+        agreed = top_intent(vote["classification"]) == top_intent(classification)
+        prefix = "audit" if audited else "shadow"
+        self.stats["audited" if audited else "shadow_compared"] += 1
+        self.stats[f"{prefix}_agreed"] += int(agreed)
+
+    def get_stats(self):
+        """Returns the fast-path share and the agreement rates with the LLM."""
+        decided = self.stats["fast_path"] + self.stats["llm"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "fast_path_share": round(self.stats["fast_path"] / decided, 4) if decided else 0.0,
+            "shadow_agreement": round(self.stats["shadow_agreed"] / self.stats["shadow_compared"], 4)
+            if self.stats["shadow_compared"]
+            else None,
+            "audit_agreement": round(self.stats["audit_agreed"] / self.stats["audited"], 4)
+            if self.stats["audited"]
+            else None,
+        }
@@ -1,36 +1,189 @@
 from fastapi import FastAPI, UploadFile, Form, File, HTTPException, Query
 from typing import List, Dict, Any, Optional
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
-from openai import AsyncOpenAI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
 import os
 import json
-import PyPDF2
-import docx
-import pytesseract
-from PIL import Image
 from dotenv import load_dotenv
-import io
 import random
 import string
 from datetime import datetime
 from bson import ObjectId, json_util
 import tempfile
 import shutil
-import email
-import email.policy
-from email.parser import BytesParser
-import mimetypes
-import uuid
+import asyncio
+import contextlib
+import functools
+import mailbox
+import threading
+import time
+import zipfile
+
+# Load environment variables before the modules below read their configuration
+load_dotenv()
 
 # Import the create_assistant_with_vector_store method from helper.py
 from helper import create_assistant_with_vector_store
+from classification import (
+    CLASSIFIER_ENGINE,
+    ClassificationError,
+    ReferenceExamples,
+    classify_with_assistant,
+    classify_with_chat,
+    parse_reference_examples,
+)
+from pipeline import StageError, StageGraph, run_pipeline, stage_semaphores
+from extraction import (
+    UnsupportedFileType,
+    extract_many,
+    extract_text_async,
+    parse_email_async,
+    shutdown_pool,
+)
+from mime import format_email_text
+from extraction_cache import create_extraction_cache
+from embeddings import EmbeddingService, pool_embeddings
+from token_budget import budget_sections, format_sections, split_tokens
+from knn_classifier import KNN_AUDIT_RATE, KnnClassifier
+from similarity import (
+    SIMILAR_EMAIL_PROJECTION,
+    create_similarity_backend,
+    hydrate_similar_emails,
+    similar_email_references,
+)
+from embedding_storage import encode_embedding
+from database import (
+    MONGO_DB_NAME,
+    count_collections,
+    create_client,
+    describe_databases,
+    EXPORT_SORT,
+    ensure_indexes,
+    fetch_page,
+    iter_documents,
+)
+from uploads import (
+    MAX_BATCH_EMAIL_BYTES,
+    MAX_BATCH_UPLOAD_BYTES,
+    MAX_REQUEST_UPLOAD_BYTES,
+    UPLOAD_CHUNK_BYTES,
+    UploadBudget,
+    UploadTooLarge,
+    read_upload,
+)
+from stats import STATS_COLLECTION, EmailStats, StatsCache
+from jobs import (
+    JOB_FILES_COLLECTION,
+    JOB_STATUSES,
+    JOBS_COLLECTION,
+    JobQueue,
+    PermanentJobError,
+    run_workers,
+)
+from rate_governor import GovernedTransport, RateGovernor, openai_lane, retry_after
+from serialization import MongoJSONResponse, decode_cursor, encode_cursor, ndjson_chunks, sse_event
+
+
+async def start_services():
+    """Prepares everything emails are processed with; shared by the API and job workers."""
+    # Map (or build) the local vector index before taking traffic
+    await similarity_backend.load()
+    await ensure_indexes(collection)
+    await job_queue.ensure_indexes()
+    await extraction_cache.ensure_indexes()
+    reference_examples.load()
+    # Count the existing emails once; afterwards counters are kept up to date
+    try:
+        await email_stats.ensure()
+    except Exception as e:
+        print(f"Could not build email stats: {e}")
 
-# Load environment variables
-load_dotenv()
 
-app = FastAPI()
+def stop_services():
+    # Stop the attachment extraction workers
+    shutdown_pool()
+    client_db.close()
 
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_services()
+    stop_workers = asyncio.Event()
+    workers = None
+    if JOB_API_WORKERS > 0:
+        workers = asyncio.ensure_future(
+            run_workers(job_queue, process_job, JOB_API_WORKERS, stop=stop_workers)
+        )
+    yield
+    if workers is not None:
+        # Let running jobs finish briefly; unfinished ones are retried once
+        # their lease runs out
+        stop_workers.set()
+        await asyncio.wait({workers}, timeout=JOB_SHUTDOWN_GRACE)
+        workers.cancel()
+    stop_services()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def upload_limit(path):
+    """Returns the request body limit of an upload endpoint, or None for other paths."""
+    limit = {
+        "/process_email": MAX_REQUEST_UPLOAD_BYTES,
+        "/process_email/stream": MAX_REQUEST_UPLOAD_BYTES,
+        "/process_emails/batch": MAX_BATCH_UPLOAD_BYTES,
+    }.get(path)
+    # Allow for the multipart boundaries and form fields around the files
+    return None if limit is None else limit + UPLOAD_CHUNK_BYTES
+
+
+class UploadLimitMiddleware:
+    """
+    Rejects upload requests whose body is larger than their endpoint allows.
+
+    A declared Content-Length is checked before anything is received. Chunked
+    requests declare none, so the body is counted as it arrives and the request
+    fails with a 413 as soon as it crosses the limit, before the multipart
+    parser has spooled the rest of it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = upload_limit(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        detail = f"Uploads are larger than {limit - UPLOAD_CHUNK_BYTES} bytes in total"
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse(status_code=413, content={"detail": detail})
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the body parser; FastAPI passes it on as is
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, counting_receive, send)
+
+
+app.add_middleware(UploadLimitMiddleware)
+
+
+# Added last so it wraps every other middleware: the responses they return
+# early (e.g. 413) still get CORS headers
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Adjust this in production to specific origins
@@ -39,21 +192,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Every OpenAI request waits for its model's rate limits, in its lane, and is
+# retried by the governor rather than by the SDK
+openai_governor = RateGovernor()
+
 # Initialize OpenAI client
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(transport=GovernedTransport(openai_governor)),
+)
+
+# Shared by /process_email and the batch endpoint so concurrent emails are
+# embedded in batched API calls
+embedding_service = EmbeddingService(client)
 
-# MongoDB setup
-MONGO_URI = os.getenv("MONGO_URI")
-client_db = MongoClient(MONGO_URI)
-db = client_db["dashboard"]
+# MongoDB setup (async, so queries never block the event loop)
+client_db = create_client()
+db = client_db[MONGO_DB_NAME]
 collection = db["emails"]
 
+# Atlas $vectorSearch or the local NumPy index, chosen by SIMILARITY_BACKEND
+similarity_backend = create_similarity_backend(collection)
+
+# Cache of extracted attachment text, keyed by attachment content
+extraction_cache = create_extraction_cache(db)
+
+# Dashboard counters, updated as emails are stored, and a short-lived cache
+# for the statistics endpoints
+email_stats = EmailStats(collection, db[STATS_COLLECTION])
+stats_cache = StatsCache()
+
+# Emails submitted with ?async=true, processed by job workers
+job_queue = JobQueue(db[JOBS_COLLECTION], db[JOB_FILES_COLLECTION])
+# Job workers run inside each API process; set to 0 when job_worker.py
+# processes run on their own
+JOB_API_WORKERS = int(os.getenv("JOB_API_WORKERS", "2"))
+JOB_SHUTDOWN_GRACE = float(os.getenv("JOB_SHUTDOWN_GRACE", "10"))
+
+# Examples from the configured dataset, retrieved locally by the chat classifier
+reference_examples = ReferenceExamples(embedding_service)
+
+# Votes over the labels of similar emails before falling back to the LLM
+knn_classifier = KnnClassifier()
+# LLM checks of fast-path classifications, kept referenced until they finish
+audit_tasks = set()
+
 # Set the uploaded Assistant ID (Replace with actual ID after uploading)
 ASSISTANT_ID = "asst_FS8ltK3lrQwZ4BmGQ5CtD7ZI"
 
+# Reuse a past email's classification instead of running the assistant when
+# the best match scores at least this high. Atlas cosine scores are mapped to
+# (1 + cosine) / 2, so 0.99 only matches near-duplicates. Set above 1 to disable.
+CLASSIFICATION_REUSE_THRESHOLD = float(os.getenv("CLASSIFICATION_REUSE_THRESHOLD", "0.99"))
+
+# Start classifying before the similarity search returns and cancel the
+# assistant run if a near-duplicate turns up. Faster, but duplicates still pay
+# for creating the thread; set to false to classify only after the search.
+CLASSIFY_SPECULATIVELY = os.getenv("CLASSIFY_SPECULATIVELY", "true").lower() in ("1", "true", "yes")
+
 # Create a temporary directory if it doesn't exist
 TMP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tmp")
 os.makedirs(TMP_DIR, exist_ok=True)
+# Batch uploads are spooled outside the source tree, where the OS cleans up
+# whatever a crashed batch leaves behind
+BATCH_SPOOL_DIR = os.getenv("BATCH_SPOOL_DIR", tempfile.gettempdir())
 
 # List of domain names for generating random email addresses
 EMAIL_DOMAINS = [
@@ -91,220 +295,435 @@ def generate_random_email():
     return f"{username}@{domain}"
 
 
-def extract_text_from_file(file: UploadFile) -> str:
-    """Extracts text from supported file types."""
-    print(file)
-    content = file.file.read()
-    file_type = file.filename.split(".")[-1].lower()
-    if file_type == "pdf":
-        reader = PyPDF2.PdfReader(io.BytesIO(content))
-        return "\n".join(
-            [page.extract_text() for page in reader.pages if page.extract_text()]
-        )
-    elif file_type == "docx":
-        doc = docx.Document(io.BytesIO(content))
-        return "\n".join([p.text for p in doc.paragraphs])
-    elif file_type in ["png", "jpg", "jpeg"]:
-        image = Image.open(io.BytesIO(content))
-        return pytesseract.image_to_string(image)
-    elif file_type == "txt":
-        return content.decode("utf-8")
-    elif file_type == "eml":
-        # Parse the .eml file
-        msg = BytesParser(policy=email.policy.default).parse(io.BytesIO(content))
-
-        # Extract the email body
-        email_body = ""
-
-        # Get the plain text body
-        if msg.get_body(preferencelist=("plain",)):
-            email_body = msg.get_body(preferencelist=("plain",)).get_content()
-        # If no plain text, try HTML
-        elif msg.get_body(preferencelist=("html",)):
-            # This is a simple approach - in production you might want to use
-            # a proper HTML to text converter like html2text
-            html_body = msg.get_body(preferencelist=("html",)).get_content()
-            email_body = f"HTML Email: {html_body}"
-
-        # Add headers information
-        headers = f"From: {msg['from']}\nTo: {msg['to']}\nSubject: {msg['subject']}\nDate: {msg['date']}\n\n"
-
-        return headers + email_body
-    else:
-        raise HTTPException(status_code=400, detail="Unsupported file type")
+async def classify_email(email_body: str, metrics: Optional[dict] = None) -> dict:
+    """
+    Classifies the request intents and sub-request types of an email, with confidence scores.
+
+    CLASSIFIER_ENGINE picks the OpenAI Assistant (a thread and a run per email)
+    or a single Chat Completions call with a JSON schema. Engine counters
+    (``run_polls``, ``run_streams``, ``prompt_tokens``...) are added to
+    ``metrics`` when given.
+    """
+    try:
+        if CLASSIFIER_ENGINE == "chat":
+            return await classify_with_chat(client, reference_examples, email_body, metrics)
+        return await classify_with_assistant(client, ASSISTANT_ID, email_body, metrics)
+    except ClassificationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
 
-def extract_attachments_from_eml(eml_content):
+# Define a function to generate embeddings
+async def get_embedding(text):
+    """Generates vector embeddings for the given text."""
+    return await embedding_service.embed(text)
+
+
+async def store_email(email_data: dict):
+    """Stores email in MongoDB."""
+    result = await collection.insert_one(email_data)
+    # Make the new email findable by the local index right away
+    await similarity_backend.add(result.inserted_id, email_data["embedding"])
+    try:
+        await email_stats.record(email_data)
+    except Exception as e:
+        # The email is stored; a missed increment is fixed by the next rebuild
+        print(f"Could not update email stats: {e}")
+
+
+async def search_similar_emails(query_embedding, **options):
     """
-    Extracts attachments from an EML file.
+    Performs a vector search for similar emails on the configured backend.
 
     Args:
-        eml_content (bytes): The content of the EML file
-
-    Returns:
-        list: A list of dictionaries containing attachment information
+        query_embedding (list): The embedding to search with
+        **options: ``limit``, ``num_candidates``, ``min_score`` and ``exact``
+            overrides; unset ones come from the SIMILARITY_* configuration
     """
-    # Parse the email message
-    msg = BytesParser(policy=email.policy.default).parse(io.BytesIO(eml_content))
+    return await similarity_backend.search(query_embedding, **options)
 
-    attachments = []
 
-    # Iterate through all attachments
-    for part in msg.iter_attachments():
-        # Get the filename
-        filename = part.get_filename()
-        if not filename:
-            # Generate a filename if none exists
-            ext = mimetypes.guess_extension(part.get_content_type())
-            filename = f"attachment-{uuid.uuid4()}{ext if ext else '.bin'}"
+def cleanup_temp_files(file_paths):
+    """Cleans up temporary files."""
+    for path in file_paths:
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                print(f"Error removing temporary file {path}: {e}")
 
-        # Get the content
-        content = part.get_content()
 
-        # Save the attachment to a temporary file
-        temp_path = os.path.join(TMP_DIR, filename)
+async def extract_email_text(email_body=None, email_file=None, attachments=()):
+    """
+    Extracts the text of an email body, an email file and attachments.
 
-        # Handle binary content
-        if isinstance(content, bytes):
-            with open(temp_path, "wb") as f:
-                f.write(content)
-        else:
-            # Handle text content
-            with open(temp_path, "w", encoding="utf-8") as f:
-                f.write(content)
+    Extraction runs on the extraction pool and all attachments of the email are
+    extracted in parallel.
 
-        attachments.append(
-            {
-                "filename": filename,
-                "path": temp_path,
-                "content_type": part.get_content_type(),
-            }
-        )
+    Args:
+        email_body (str, optional): Plain text email body
+        email_file (tuple, optional): (filename, bytes) of an .eml or other supported file
+        attachments (iterable): (filename, bytes) tuples of separate attachments
+
+    Returns:
+        tuple: ((heading, text) sections, the body first and then one per
+        attachment, see token_budget.format_sections; list of processed
+        attachment filenames)
+    """
+    # Case 1: Process email body if provided
+    extracted_text = email_body or ""
+    attachment_files = []
+
+    # Case 2 & 3: Process .eml file if provided
+    if email_file:
+        email_filename, email_content = email_file
+        if email_filename.lower().endswith(".eml"):
+            # One MIME walk yields the body, headers, forwarded messages and
+            # the embedded attachments
+            parsed = await parse_email_async(email_filename, email_content)
+            extracted_text += format_email_text(parsed)
+            attachment_files.extend(parsed["attachments"])
+        else:
+            try:
+                extracted_text += await extract_text_async(
+                    email_filename, email_content, cache=extraction_cache
+                )
+            except UnsupportedFileType:
+                raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    # Process additional attachments
+    attachment_files.extend(attachments)
+
+    sections = [("", extracted_text)]
+    processed_attachments = []
+    attachment_texts = await extract_many(attachment_files, cache=extraction_cache)
+    for (filename, _), attachment_text in zip(attachment_files, attachment_texts):
+        # Failed extractions come back as exceptions, cancellations included
+        if isinstance(attachment_text, BaseException):
+            if not isinstance(attachment_text, UnsupportedFileType):
+                print(f"Error extracting text from {filename}: {attachment_text}")
+            # If we can't extract text, just note the attachment
+            sections.append((f"[Attachment: {filename} - Could not extract text]", ""))
+        else:
+            sections.append((f"[Attachment: {filename}]", attachment_text))
+        processed_attachments.append(filename)
 
-    return attachments
+    return sections, processed_attachments
 
 
-async def classify_email(email_body: str) -> dict:
-    """Uses OpenAI Assistant to classify email request type and extract sub-request types with confidence scores."""
+def new_email_state(email_body=None, email_file=None, attachment_files=(), search_options=None):
+    """
+    Creates the state passed between the stages of EMAIL_GRAPH.
 
-    prompt = (
-        "You are an AI assistant that classifies loan servicing request emails. "
-        "For the given email content, provide the top 3 most relevant request intents, along with reasoning and a confidence score (0-1) for each. "
-        "Also, extract sub-request types (features) present in the email and justify why they are relevant. "
-        "Use the provided dataset file for reference. Format the response as a JSON object with 'request_intents' "
-        "containing a list of dictionaries (each with 'intent', 'reasoning', and 'confidence_score'), "
-        "and 'sub_requests' containing a list of dictionaries (each with 'sub_request' and 'reasoning')."
-        f"\n\nEmail Content:\n{email_body}"
+    Args:
+        email_body (str, optional): Plain text email body
+        email_file (tuple, optional): (filename, bytes) of an .eml or other supported file
+        attachment_files (iterable): (filename, bytes) tuples of separate attachments
+        search_options (dict, optional): Overrides passed to search_similar_emails
+    """
+    return {
+        "email_body": email_body,
+        "email_file": email_file,
+        "attachment_files": list(attachment_files),
+        "search_options": search_options or {},
+        # Per-email counters and stage timings returned alongside the result
+        "metrics": {"run_polls": 0},
+    }
+
+
+async def extract_stage(state):
+    sections, processed_attachments = await extract_email_text(
+        state.pop("email_body"), state.pop("email_file"), state.pop("attachment_files")
     )
+    extracted_text = format_sections(sections)
 
-    # Create a thread to handle the classification
-    thread_response = await client.beta.threads.create()
-    thread_id = thread_response.id
+    # If we have no content, raise an error
+    if not extracted_text:
+        raise HTTPException(status_code=400, detail="No email content provided")
 
-    # Send the email text as a message in the thread
-    await client.beta.threads.messages.create(
-        thread_id=thread_id, role="user", content=prompt
+    state["email"] = extracted_text
+    state["attachments"] = processed_attachments
+    # The classifier sees the body first and a bounded share of each attachment
+    state["classification_text"], state["metrics"]["classification_tokens"] = (
+        await asyncio.to_thread(budget_sections, sections)
     )
+    return state
 
-    # Run the assistant to process the request
-    run_response = await client.beta.threads.runs.create(
-        thread_id=thread_id, assistant_id=ASSISTANT_ID
-    )
 
-    # Wait for completion
-    while run_response.status not in ["completed", "failed"]:
-        run_response = await client.beta.threads.runs.retrieve(
-            thread_id=thread_id, run_id=run_response.id
-        )
+def find_reusable_classification(similar_emails, threshold=CLASSIFICATION_REUSE_THRESHOLD):
+    """
+    Returns the closest similar email whose classification can be reused, if any.
 
-    if run_response.status == "failed":
-        raise HTTPException(
-            status_code=500, detail="OpenAI Assistant failed to process request"
-        )
+    Args:
+        similar_emails (list): Vector search results, each with a ``score``
+        threshold (float): Minimum score for a neighbour to count as a duplicate
 
-    # Extract the response from the assistant
-    messages = await client.beta.threads.messages.list(thread_id=thread_id)
+    Returns:
+        dict or None: The neighbour to reuse the classification from
+    """
+    candidates = [
+        neighbour
+        for neighbour in similar_emails
+        if neighbour.get("score", 0) >= threshold
+        and isinstance(neighbour.get("classification"), dict)
+        and neighbour["classification"].get("request_intents")
+    ]
+    return max(candidates, key=lambda neighbour: neighbour["score"], default=None)
+
+
+def reuse_classification(state):
+    """Copies a near-duplicate's classification into the state; returns False if there is none."""
+    neighbour = find_reusable_classification(state["similar_emails"])
+    if neighbour is None:
+        return False
+    state["classification"] = neighbour["classification"]
+    state["classification_reused_from"] = {
+        "_id": neighbour["_id"],
+        "receiver_email": neighbour.get("receiver_email"),
+        "created_at": neighbour.get("created_at"),
+        "score": neighbour["score"],
+    }
+    state["metrics"]["classification_reused"] = True
+    state["metrics"]["classification_source"] = "reused"
+    return True
+
+
+async def audit_knn_classification(vote, email_text):
+    """Classifies a fast-path email with the LLM too and counts whether they agree."""
+    try:
+        # Audits are background work; they must not hold up uploads
+        with openai_lane("batch"):
+            classification = await classify_email(email_text)
+    except Exception as e:
+        print(f"Could not audit kNN classification: {e}")
+        return
+    knn_classifier.record_agreement(vote, classification, audited=True)
 
-    # Get the assistant's response (first message in the list)
-    if messages.data and len(messages.data) > 0:
-        # Get the first message (assistant's response)
-        assistant_message = messages.data[0]
 
-        if assistant_message.content and len(assistant_message.content) > 0:
-            # Get the text content
-            text_content = assistant_message.content[0].text.value
+def knn_classification(state):
+    """Classifies from the similar emails' vote if it is confident; returns False otherwise."""
+    vote = knn_classifier.vote(state["similar_emails"])
+    if not knn_classifier.is_confident(vote):
+        return False
+    state["classification"] = vote["classification"]
+    state["classification_reused_from"] = None
+    state["metrics"]["classification_reused"] = False
+    state["metrics"]["classification_source"] = "knn"
+    state["metrics"]["knn_confidence"] = round(vote["confidence"], 4)
+    knn_classifier.record_fast_path(True)
 
-            # The JSON is often wrapped in a markdown code block, so we need to extract it
-            if "" in text_content:
-                # Extract the JSON part from the markdown code block
-                json_text = text_content.split("json")[1].split("```")[0].strip()
-            else:
-                json_text = text_content
+    if random.random() < KNN_AUDIT_RATE:
+        task = asyncio.ensure_future(audit_knn_classification(vote, state["classification_text"]))
+        audit_tasks.add(task)
+        task.add_done_callback(audit_tasks.discard)
+    return True
 
-            try:
-                return json.loads(json_text)  # Parse response JSON
-            except json.JSONDecodeError as e:
-                # If not valid JSON, return as text
-                raise HTTPException(
-                    status_code=500, detail=f"Invalid JSON in response: {str(e)}"
-                )
 
-    # Fallback if we can't extract proper response
-    raise HTTPException(status_code=500, detail="Could not parse assistant response")
+def classify_without_llm(state):
+    """Fills in the classification from a near-duplicate or a confident kNN vote, if possible."""
+    return reuse_classification(state) or knn_classification(state)
 
 
-# Define a function to generate embeddings
-async def get_embedding(text):
-    """Generates vector embeddings for the given text."""
-    embedding = await client.embeddings.create(
-        input=[text], model="text-embedding-3-small"
+async def classify_stage(state):
+    search = state["stages"]["search"]
+
+    # Near-duplicates of an already classified email, and emails whose similar
+    # emails agree on the intent, skip the assistant entirely
+    if search.done() and classify_without_llm(state):
+        return state
+
+    classification = asyncio.ensure_future(
+        classify_email(state["classification_text"], metrics=state["metrics"])
     )
-    return embedding.data[0].embedding
+    try:
+        if not search.done():
+            # Classification started speculatively; drop it if the search
+            # settles the classification before the assistant has answered
+            await asyncio.wait({classification, search}, return_when=asyncio.FIRST_COMPLETED)
+            if (
+                not classification.done()
+                and not search.cancelled()
+                and search.exception() is None
+                and classify_without_llm(state)
+            ):
+                return state
+
+        state["classification"] = await classification
+        state["classification_reused_from"] = None
+        state["metrics"]["classification_reused"] = False
+        state["metrics"]["classification_source"] = "llm"
+        knn_classifier.record_fast_path(False)
+        if search.done() and not search.cancelled() and search.exception() is None:
+            # Measure how the vote would have done against the LLM's answer
+            knn_classifier.record_agreement(
+                knn_classifier.vote(state["similar_emails"]), state["classification"]
+            )
+        return state
+    finally:
+        classification.cancel()
 
 
-def store_email(email_data: dict):
-    """Stores email in MongoDB."""
-    collection.insert_one(email_data)
+async def embed_stage(state):
+    # Long emails are embedded in chunks (at most EMBEDDING_MAX_CHUNKS) that
+    # are pooled into one vector, so no input exceeds the model's limit
+    chunks = await asyncio.to_thread(split_tokens, state["email"])
+    state["metrics"]["embedding_chunks"] = len(chunks)
+    if len(chunks) == 1:
+        state["embedding"] = await get_embedding(chunks[0])
+        return state
 
+    vectors = await asyncio.gather(*(get_embedding(chunk) for chunk in chunks))
+    state["embedding"] = pool_embeddings(vectors, weights=[len(chunk) for chunk in chunks])
+    return state
 
-def search_similar_emails(query_embedding):
-    """Performs a vector search in MongoDB for similar emails."""
-    pipeline = [
-        {
-            "$vectorSearch": {
-                "index": "vector_index",
-                "queryVector": query_embedding,
-                "path": "embedding",
-                "exact": True,
-                "limit": 5,
-            }
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "email": 1,
-                "classification": 1,
-                "receiver_email": 1,
-                "similar_emails": 1,
-                "created_at": 1,
-                "embedding": 0,
-                "attachments": 0,
-                "score": {"$meta": "vectorSearchScore"},
-            }
-        },
+
+async def search_stage(state):
+    state["similar_emails"] = await search_similar_emails(
+        state["embedding"], **state["search_options"]
+    )
+    return state
+
+
+async def store_stage(state):
+    # Generate a random receiver email ID
+    state["receiver_email"] = generate_random_email()
+
+    # Add timestamp for when the email was processed
+    state["created_at"] = datetime.now()
+
+    # Create the email data object
+    email_data = {
+        "email": state["email"],
+        "classification": state["classification"],
+        "classification_reused_from": state["classification_reused_from"],
+        # "llm", "knn" (vote of similar emails) or "reused" (near-duplicate)
+        "classification_source": state["metrics"].get("classification_source"),
+        # Only references; neighbours are loaded again when the email is listed
+        "similar_emails": similar_email_references(state["similar_emails"]),
+        "receiver_email": state["receiver_email"],
+        "created_at": state["created_at"],
+        "attachments": state["attachments"],
+        # Packed as BinData when EMBEDDING_STORAGE is float32 or int8
+        "embedding": encode_embedding(state["embedding"]),
+    }
+
+    print(email_data)
+
+    # Store the email in MongoDB
+    await store_email(email_data)
+    return state
+
+
+# Every email goes extract -> {classify, embed -> search} -> store. Classification
+# doesn't need the embedding, so both branches run concurrently.
+EMAIL_GRAPH = StageGraph(
+    [
+        ("extract", extract_stage, []),
+        ("embed", embed_stage, ["extract"]),
+        ("search", search_stage, ["embed"]),
+        ("classify", classify_stage, ["extract"] if CLASSIFY_SPECULATIVELY else ["search"]),
+        ("store", store_stage, ["classify", "search"]),
     ]
-    results = collection.aggregate(pipeline)
-    return list(results)
+)
 
 
-def cleanup_temp_files(file_paths):
-    """Cleans up temporary files."""
-    for path in file_paths:
-        if os.path.exists(path):
-            try:
-                os.remove(path)
-            except Exception as e:
-                print(f"Error removing temporary file {path}: {e}")
+async def run_email_graph(state, semaphores=None, listener=None):
+    """Runs an email through EMAIL_GRAPH and logs its stage timings."""
+    try:
+        return await EMAIL_GRAPH.run(state, semaphores=semaphores, listener=listener)
+    finally:
+        print(f"Email metrics: {state['metrics']}")
+
+
+def rate_limited_error(error):
+    """Turns an OpenAI rate limit that outlasted the governor's retries into a 503."""
+    delay = retry_after(error.response.headers) if error.response is not None else None
+    return HTTPException(
+        status_code=503,
+        detail=f"OpenAI rate limit reached, try again later: {str(error)}",
+        headers={"Retry-After": str(int(delay) + 1 if delay is not None else 30)},
+    )
+
+
+def similarity_query_options(similar_limit, num_candidates, min_score, exact):
+    """Collects the similarity search overrides given as query parameters."""
+    options = {
+        "limit": similar_limit,
+        "num_candidates": num_candidates,
+        "min_score": min_score,
+        "exact": exact,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def similar_emails_response(similar_emails):
+    return [{**neighbour, "_id": str(neighbour["_id"])} for neighbour in similar_emails]
+
+
+def reused_from_response(reused_from):
+    return {**reused_from, "_id": str(reused_from["_id"])} if reused_from else reused_from
+
+
+# What each stage adds to the state, sent with its "finished" progress event
+STAGE_RESULTS = {
+    "extract": lambda state: {
+        "attachments": state["attachments"],
+        "classification_tokens": state["metrics"]["classification_tokens"],
+    },
+    "classify": lambda state: {
+        "classification": state["classification"],
+        "classification_source": state["metrics"].get("classification_source"),
+        "classification_reused_from": reused_from_response(state["classification_reused_from"]),
+    },
+    "embed": lambda state: {"embedding_chunks": state["metrics"]["embedding_chunks"]},
+    "search": lambda state: {"similar_emails": similar_emails_response(state["similar_emails"])},
+    "store": lambda state: {
+        "receiver_email": state["receiver_email"],
+        "created_at": state["created_at"],
+    },
+}
+
+
+def email_response(state):
+    """Builds the API response for a processed email."""
+    return {
+        "classification": state["classification"],
+        "classification_reused_from": reused_from_response(state["classification_reused_from"]),
+        "similar_emails": similar_emails_response(state["similar_emails"]),
+        "receiver_email": state["receiver_email"],
+        "created_at": state["created_at"],
+        "attachments": state["attachments"],
+        "metrics": state["metrics"],
+    }
+
+
+async def read_email_uploads(email_file, attachments, resources):
+    """
+    Reads the files uploaded with an email into memory, within the upload caps.
+
+    Files above UPLOAD_SPILL_BYTES are spilled to anonymous temporary files.
+    Either way the content is handed on as a memoryview, without copies.
+
+    Args:
+        email_file (UploadFile, optional): The .eml or other email file
+        attachments (list): Separately uploaded attachments
+        resources (contextlib.ExitStack): Releases the content when the request ends
+
+    Returns:
+        tuple: ((filename, content) of the email file or None, [(filename, content)])
+
+    Raises:
+        UploadTooLarge: If a file or all files together exceed the caps
+    """
+    budget = UploadBudget()
+
+    async def read(upload):
+        content = await read_upload(upload, budget=budget)
+        resources.callback(content.close)
+        return (upload.filename, content.view())
+
+    email_upload = await read(email_file) if email_file else None
+    attachment_uploads = [await read(attachment) for attachment in attachments]
+    return email_upload, attachment_uploads
 
 
 @app.post("/process_email")
@@ -312,6 +731,11 @@ async def process_email(
     email_body: Optional[str] = Form(None),
     email_file: Optional[UploadFile] = File(None),
     attachments: List[UploadFile] = File([]),
+    similar_limit: Optional[int] = Query(None, ge=1, le=100),
+    num_candidates: Optional[int] = Query(None, ge=1, le=10000),
+    min_score: Optional[float] = Query(None, ge=0, le=1),
+    exact: Optional[bool] = Query(None),
+    async_mode: bool = Query(False, alias="async"),
 ):
     """
     Processes an email, classifies it, extracts details, and checks for duplicates.
@@ -321,125 +745,484 @@ async def process_email(
     2. .eml file with embedded attachments
     3. .eml file with separate attachments
     4. Any combination of the above
+
+    The similarity search can be tuned per request with ``similar_limit``,
+    ``num_candidates``, ``min_score`` and ``exact``.
+
+    With ``async=true`` the email is queued and a job id is returned at once
+    (202); poll ``/jobs/{job_id}`` for the result.
     """
     print(email_body), print(email_file), print(attachments)
-    temp_files = []  # Track temporary files for cleanup
+    with contextlib.ExitStack() as resources:
+        try:
+            email_upload, attachment_uploads = await read_email_uploads(
+                email_file, attachments, resources
+            )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        search_options = similarity_query_options(similar_limit, num_candidates, min_score, exact)
+        if async_mode:
+            return await enqueue_email(email_body, email_upload, attachment_uploads, search_options)
+
+        try:
+            state = new_email_state(email_body, email_upload, attachment_uploads, search_options)
+            try:
+                await run_email_graph(state)
+            except StageError as e:
+                raise e.error
+
+            # Return the response
+            return email_response(state)
+
+        except HTTPException as e:
+            # Keeps the status stages report, e.g. 504 for a classification timeout
+            print(f"Error processing email: {e.detail}")
+            raise
+        except RateLimitError as e:
+            print(f"Error processing email: {str(e)}")
+            raise rate_limited_error(e)
+        except Exception as e:
+            print(f"Error processing email: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
+
+
+@app.post("/process_email/stream")
+async def process_email_stream(
+    email_body: Optional[str] = Form(None),
+    email_file: Optional[UploadFile] = File(None),
+    attachments: List[UploadFile] = File([]),
+    similar_limit: Optional[int] = Query(None, ge=1, le=100),
+    num_candidates: Optional[int] = Query(None, ge=1, le=10000),
+    min_score: Optional[float] = Query(None, ge=0, le=1),
+    exact: Optional[bool] = Query(None),
+):
+    """
+    Processes an email like /process_email, reporting progress as server-sent events.
+
+    Each stage of EMAIL_GRAPH (extract, classify, embed, search, store) sends a
+    ``stage`` event when it starts and when it finishes; the latter carries its
+    wall time and what the stage produced, so the similar emails arrive as soon
+    as the search is done, usually well before the classification. The stream
+    ends with a ``result`` event holding the /process_email response, or an
+    ``error`` event naming the failed stage.
+
+    Disconnecting stops the processing, as with /process_emails/batch.
+    """
+    resources = contextlib.ExitStack()
     try:
-        extracted_text = ""
-        processed_attachments = []
-
-        # Case 1: Process email body if provided
-        if email_body:
-            extracted_text = email_body
-
-        # Case 2 & 3: Process .eml file if provided
-        if email_file:
-            # Read the email file content
-            email_content = await email_file.read()
-
-            # Extract text from the email file
-            if email_file.filename.lower().endswith(".eml"):
-                # Parse the email to get the body
-                extracted_text += extract_text_from_file(email_file)
-
-                # Extract embedded attachments from the .eml file
-                embedded_attachments = extract_attachments_from_eml(email_content)
-                temp_files.extend([att["path"] for att in embedded_attachments])
-
-                # Process each embedded attachment
-                for attachment in embedded_attachments:
-                    # Create a temporary UploadFile-like object
-                    with open(attachment["path"], "rb") as f:
-                        content = f.read()
-
-                    temp_upload_file = UploadFile(
-                        filename=attachment["filename"], file=io.BytesIO(content)
-                    )
-
-                    # Try to extract text from the attachment
-                    try:
-                        attachment_text = extract_text_from_file(temp_upload_file)
-                        extracted_text += f"\n\n[Attachment: {attachment['filename']}]\n{attachment_text}"
-                        processed_attachments.append(attachment["filename"])
-                    except HTTPException:
-                        # If we can't extract text, just note the attachment
-                        extracted_text += f"\n\n[Attachment: {attachment['filename']} - Could not extract text]"
-                        processed_attachments.append(attachment["filename"])
+        email_upload, attachment_uploads = await read_email_uploads(
+            email_file, attachments, resources
+        )
+    except UploadTooLarge as e:
+        resources.close()
+        raise HTTPException(status_code=413, detail=str(e))
+
+    search_options = similarity_query_options(similar_limit, num_candidates, min_score, exact)
+    state = new_email_state(email_body, email_upload, attachment_uploads, search_options)
+    return StreamingResponse(
+        email_progress_events(state, resources),
+        media_type="text/event-stream",
+        # Proxies must pass events on as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def email_progress_events(state, resources):
+    """
+    Runs an email through EMAIL_GRAPH and yields its progress as server-sent events.
+
+    The events are produced by the graph's stage listener as the stages run,
+    so streaming them costs no extra processing.
+
+    Args:
+        state (dict): The email state from new_email_state
+        resources (contextlib.ExitStack): Holds the uploads; closed when the stream ends
+    """
+    events = asyncio.Queue()
+
+    def listener(event, name, state):
+        progress = {"stage": name, "status": event}
+        if event == "finished":
+            progress["elapsed"] = state["metrics"]["stage_timings"][name]
+            progress["result"] = STAGE_RESULTS[name](state)
+        events.put_nowait(sse_event("stage", progress))
+
+    graph = asyncio.ensure_future(run_email_graph(state, listener=listener))
+    graph.add_done_callback(lambda _: events.put_nowait(None))
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            yield event
+
+        try:
+            graph.result()
+        except StageError as e:
+            print(f"Error processing email: {str(e)}")
+            error = rate_limited_error(e.error) if isinstance(e.error, RateLimitError) else e.error
+            if isinstance(error, HTTPException):
+                status_code, detail = error.status_code, error.detail
             else:
-                # For non-eml files, just extract the text
-                extracted_text += extract_text_from_file(email_file)
+                status_code, detail = 500, f"Error processing email: {str(e.error)}"
+            yield sse_event("error", {"stage": e.stage, "status_code": status_code, "detail": detail})
+            return
+        yield sse_event("result", email_response(state))
+    finally:
+        graph.cancel()
+        resources.close()
 
-        # Process additional attachments
-        for attachment in attachments:
-            try:
-                attachment_text = extract_text_from_file(attachment)
-                extracted_text += (
-                    f"\n\n[Attachment: {attachment.filename}]\n{attachment_text}"
-                )
-                processed_attachments.append(attachment.filename)
-            except HTTPException:
-                # If we can't extract text, just note the attachment
-                extracted_text += (
-                    f"\n\n[Attachment: {attachment.filename} - Could not extract text]"
+
+async def enqueue_email(email_body, email_upload, attachment_uploads, search_options):
+    """Queues an email for the job workers and returns the 202 response with its job id."""
+    if not email_body and email_upload is None and not attachment_uploads:
+        raise HTTPException(status_code=400, detail="No email content provided")
+
+    files = [("attachment", filename, content) for filename, content in attachment_uploads]
+    if email_upload is not None:
+        files.insert(0, ("email_file", *email_upload))
+    job_id = await job_queue.enqueue(
+        {"email_body": email_body, "search_options": search_options}, files
+    )
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": str(job_id), "status": "queued", "status_url": f"/jobs/{job_id}"},
+    )
+
+
+async def process_job(job, files):
+    """
+    Runs a queued email through EMAIL_GRAPH; the job handler of the workers.
+
+    Returns:
+        dict: The same response /process_email returns, stored as the job result
+
+    Raises:
+        PermanentJobError: If the email itself is invalid, so retrying can't help
+    """
+    request = job["request"]
+    email_file = next(((name, content) for role, name, content in files if role == "email_file"), None)
+    attachments = [(name, content) for role, name, content in files if role == "attachment"]
+    state = new_email_state(
+        request.get("email_body"), email_file, attachments, request.get("search_options")
+    )
+    try:
+        # Queued emails give way to interactive uploads at the rate limits
+        with openai_lane("batch"):
+            await run_email_graph(state)
+    except StageError as e:
+        if isinstance(e.error, HTTPException) and e.error.status_code < 500:
+            raise PermanentJobError(e.error.detail)
+        raise e.error
+    return jsonable_encoder(email_response(state))
+
+
+def spool_batch_uploads(uploads, max_bytes=None):
+    """
+    Copies uploaded batch files into temporary files owned by the batch.
+
+    FastAPI closes uploads as soon as the handler returns, while the batch keeps
+    reading them for as long as results are streamed back.
+
+    Returns:
+        list: (original filename, temporary path) tuples
+
+    Raises:
+        UploadTooLarge: If the files together exceed ``max_bytes`` (default
+            MAX_BATCH_UPLOAD_BYTES); nothing is kept
+    """
+    max_bytes = MAX_BATCH_UPLOAD_BYTES if max_bytes is None else max_bytes
+    spooled = []
+    total = 0
+    try:
+        for upload in uploads:
+            filename = upload.filename or "email"
+            with tempfile.NamedTemporaryFile(
+                dir=BATCH_SPOOL_DIR, prefix="batch-", suffix=os.path.splitext(filename)[1], delete=False
+            ) as temp_file:
+                spooled.append((filename, temp_file.name))
+                while True:
+                    chunk = upload.file.read(UPLOAD_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if total > max_bytes:
+                        raise UploadTooLarge(f"Uploads are larger than {max_bytes} bytes in total")
+                    temp_file.write(chunk)
+    except BaseException:
+        cleanup_temp_files([path for _, path in spooled])
+        raise
+    return spooled
+
+
+def open_batch_uploads(spooled_uploads, resources):
+    """
+    Expands spooled batch uploads into individual emails.
+
+    Zip archives are expanded into their members and mbox files into their
+    messages; any other file is treated as a single email. Opening an archive
+    parses it, so this runs in a thread; email bytes are read lazily when the
+    email enters the pipeline.
+
+    An upload that can't be opened (e.g. a corrupt zip) and archive members
+    above MAX_BATCH_EMAIL_BYTES become items with an ``error``, reported on
+    their own result line, so the rest of the batch still runs.
+
+    Args:
+        spooled_uploads (list): (filename, path) tuples from spool_batch_uploads
+        resources (contextlib.ExitStack): Keeps archives open until the batch ends
+
+    Returns:
+        list: Dicts with ``filename`` and either ``load``, a callable returning
+        the email bytes, or ``error``
+    """
+    items = []
+    for filename, path in spooled_uploads:
+        try:
+            items.extend(expand_batch_upload(filename, path, resources))
+        except Exception as e:
+            print(f"Could not open batch upload {filename}: {e}")
+            items.append({"filename": filename, "error": f"Could not open {filename}: {e}"})
+    return items
+
+
+def expand_batch_upload(filename, path, resources):
+    """Lists the emails of one spooled batch upload (see open_batch_uploads)."""
+    items = []
+    extension = filename.lower().rsplit(".", 1)[-1]
+    # Archives are read from worker threads, so serialise access to them
+    lock = threading.Lock()
+
+    if extension == "zip":
+        archive = zipfile.ZipFile(path)
+        resources.callback(archive.close)
+
+        def load_member(name, archive=archive, lock=lock):
+            with lock:
+                return archive.read(name)
+
+        for info in archive.infolist():
+            if info.is_dir() or os.path.basename(info.filename).startswith("."):
+                continue
+            if info.file_size > MAX_BATCH_EMAIL_BYTES:
+                items.append(
+                    {
+                        "filename": info.filename,
+                        "error": f"{info.filename} is larger than {MAX_BATCH_EMAIL_BYTES} bytes",
+                    }
                 )
-                processed_attachments.append(attachment.filename)
-
-        # If we have no content, raise an error
-        if not extracted_text:
-            raise HTTPException(status_code=400, detail="No email content provided")
-
-        # Classify the email
-        classification = await classify_email(extracted_text)
-        embedded_email = await get_embedding(extracted_text)
-        similar_emails = search_similar_emails(embedded_email)
-
-        # Generate a random receiver email ID
-        receiver_email = generate_random_email()
-
-        # Add timestamp for when the email was processed
-        timestamp = datetime.now()
-
-        # Create the email data object
-        email_data = {
-            "email": extracted_text,
-            "classification": classification,
-            "similar_emails": similar_emails,
-            "receiver_email": receiver_email,
-            "created_at": timestamp,
-            "attachments": processed_attachments,
-            "embedding": embedded_email,
-        }
+                continue
+            items.append(
+                {"filename": info.filename, "load": functools.partial(load_member, info.filename)}
+            )
 
-        print(email_data)
+    elif extension == "mbox":
+        mbox = mailbox.mbox(path, create=False)
+        resources.callback(mbox.close)
 
-        # Store the email in MongoDB
-        store_email(email_data)
+        def load_message(key, mbox=mbox, lock=lock):
+            with lock:
+                return mbox.get_bytes(key)
 
-        # Return the response
-        return {
-            "classification": classification,
-            "similar_emails": similar_emails,
-            "receiver_email": receiver_email,
-            "created_at": timestamp,
-            "attachments": processed_attachments,
+        for position, key in enumerate(mbox.iterkeys()):
+            items.append(
+                {"filename": f"{filename}#{position}.eml", "load": functools.partial(load_message, key)}
+            )
+
+    else:
+
+        def load_file(path=path):
+            with open(path, "rb") as f:
+                return f.read()
+
+        items.append({"filename": filename, "load": load_file})
+    return items
+
+
+async def load_batch_stage(item, search_options=None):
+    """Reads one batch email into a fresh email state."""
+    if "error" in item:
+        raise ValueError(item["error"])
+    content = await asyncio.to_thread(item["load"])
+    filename = item["filename"]
+    if "." not in os.path.basename(filename):
+        # Bare archive members are treated as raw RFC 822 messages
+        filename += ".eml"
+    return new_email_state(email_file=(filename, content), search_options=search_options)
+
+
+@app.post("/process_emails/batch")
+async def process_emails_batch(
+    emails: List[UploadFile] = File(...),
+    extract_concurrency: Optional[int] = Query(None, ge=1),
+    classify_concurrency: Optional[int] = Query(None, ge=1),
+    embed_concurrency: Optional[int] = Query(None, ge=1),
+    search_concurrency: Optional[int] = Query(None, ge=1),
+    store_concurrency: Optional[int] = Query(None, ge=1),
+    similar_limit: Optional[int] = Query(None, ge=1, le=100),
+    num_candidates: Optional[int] = Query(None, ge=1, le=10000),
+    min_score: Optional[float] = Query(None, ge=0, le=1),
+    exact: Optional[bool] = Query(None),
+):
+    """
+    Processes many emails through the full pipeline with bounded concurrency per stage.
+
+    Accepts any mix of individual email files (.eml, .txt, .pdf, ...), zip
+    archives of emails and mbox files. Results are streamed back as NDJSON, one
+    line per email in completion order, followed by a summary line. An upload
+    that can't be opened gets an error line of its own.
+
+    The uploads together may be up to MAX_BATCH_UPLOAD_BYTES (413 otherwise).
+    """
+    concurrency = {
+        name: value
+        for name, value in {
+            "extract": extract_concurrency,
+            "classify": classify_concurrency,
+            "embed": embed_concurrency,
+            "search": search_concurrency,
+            "store": store_concurrency,
+        }.items()
+        if value is not None
+    }
+    # The per-stage limits are shared by every email of the batch
+    semaphores = stage_semaphores(EMAIL_GRAPH.names, concurrency)
+
+    async def analyze(state):
+        # Batches give way to interactive uploads at the OpenAI rate limits
+        with openai_lane("batch"):
+            return await run_email_graph(state, semaphores=semaphores)
+
+    load = functools.partial(
+        load_batch_stage,
+        search_options=similarity_query_options(similar_limit, num_candidates, min_score, exact),
+    )
+    stages = [("load", load), ("analyze", analyze)]
+
+    try:
+        spooled_uploads = await asyncio.to_thread(spool_batch_uploads, emails)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    resources = contextlib.ExitStack()
+    try:
+        batch_items = await asyncio.to_thread(open_batch_uploads, spooled_uploads, resources)
+    except BaseException:
+        resources.close()
+        cleanup_temp_files([path for _, path in spooled_uploads])
+        raise
+
+    async def results():
+        filenames = {}
+        succeeded = failed = 0
+        started = time.perf_counter()
+
+        def items():
+            for index, item in enumerate(batch_items):
+                filenames[index] = item["filename"]
+                yield item
+
+        try:
+            async for outcome in run_pipeline(items(), stages, concurrency):
+                line = {
+                    "index": outcome["index"],
+                    "filename": filenames.pop(outcome["index"], None),
+                    "elapsed": round(outcome["elapsed"], 3),
+                }
+                if "error" in outcome:
+                    failed += 1
+                    line["status"] = "error"
+                    line["stage"] = outcome["error"].stage
+                    line["error"] = str(outcome["error"].error)
+                else:
+                    succeeded += 1
+                    line["status"] = "ok"
+                    line["result"] = email_response(outcome["result"])
+                yield json.dumps(jsonable_encoder(line)) + "\n"
+
+            summary = {
+                "total": succeeded + failed,
+                "succeeded": succeeded,
+                "failed": failed,
+                "elapsed": round(time.perf_counter() - started, 3),
+            }
+            yield json.dumps({"summary": summary}) + "\n"
+        finally:
+            resources.close()
+            cleanup_temp_files([path for _, path in spooled_uploads])
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Returns the status of a queued email and, once done, its result."""
+    if not ObjectId.is_valid(job_id):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    job = await job_queue.get(ObjectId(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return MongoJSONResponse(job)
+
+
+@app.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+):
+    """
+    Lists jobs, newest first, without their requests and results.
+
+    Filter with ``status`` (queued, running, done or failed) and pass a page's
+    ``next_cursor`` as ``cursor`` to get the following page.
+    """
+    if status is not None and status not in JOB_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(JOB_STATUSES)}")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    (jobs, position), counts = await asyncio.gather(
+        job_queue.page(status, {"request": False, "result": False}, after=after, limit=limit),
+        job_queue.counts(),
+    )
+    return MongoJSONResponse(
+        {
+            "jobs": jobs,
+            "counts": counts,
+            "page": {
+                "limit": limit,
+                "has_more": position is not None,
+                "next_cursor": encode_cursor(position) if position else None,
+            },
         }
+    )
 
-    except Exception as e:
-        print(f"Error processing email: {str(e)}")
-        # Clean up temporary files in case of error
-        cleanup_temp_files(temp_files)
-        raise HTTPException(status_code=500, detail=f"Error processing email: {str(e)}")
 
-    finally:
-        # Always clean up temporary files
-        cleanup_temp_files(temp_files)
+@app.get("/metrics")
+async def get_metrics():
+    """Returns runtime counters of the processing pipeline."""
+    return {
+        "extraction_cache": extraction_cache.get_stats(),
+        "embeddings": embedding_service.get_stats(),
+        "similarity": similarity_backend.get_stats(),
+        "stats_cache": stats_cache.get_stats(),
+        "knn_classifier": knn_classifier.get_stats(),
+        "openai_governor": openai_governor.get_stats(),
+        "classifier": {
+            "engine": CLASSIFIER_ENGINE,
+            "reference_examples": len(reference_examples.examples),
+        },
+    }
 
 
 @app.get("/database/collections")
 async def get_collections():
     """Returns a list of all collections in the database."""
     try:
-        collections = db.list_collection_names()
+        collections = await db.list_collection_names()
         return {"collections": collections}
     except Exception as e:
         raise HTTPException(
@@ -447,39 +1230,156 @@ async def get_collections():
         )
 
 
+# Fields returned by default when listing a collection. Embeddings are never
+# returned: at 1536 floats each they would dwarf everything else on the page.
+DEFAULT_DOCUMENT_FIELDS = {
+    "emails": [
+        "email",
+        "classification",
+        "classification_reused_from",
+        "classification_source",
+        "receiver_email",
+        "created_at",
+        "attachments",
+        "similar_emails._id",
+        "similar_emails.email",
+        "similar_emails.score",
+    ],
+}
+
+
+# Vectors are never listed or exported (embedding_chunks may still be present
+# on emails stored before chunk vectors stopped being kept)
+VECTOR_PROJECTION = {"embedding": False, "embedding_chunks": False}
+
+
+def document_projection(collection_name, fields=None):
+    """
+    Builds the projection for listing a collection.
+
+    Args:
+        collection_name (str): The collection being listed
+        fields (str, optional): Comma-separated fields to return, e.g.
+            ``email,classification,_id``; defaults to DEFAULT_DOCUMENT_FIELDS
+
+    Returns:
+        dict: The MongoDB projection
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+    else:
+        names = DEFAULT_DOCUMENT_FIELDS.get(collection_name)
+    if not names:
+        return {"_id": False, **VECTOR_PROJECTION}
+
+    projection = {
+        name: True
+        for name in names
+        if name.split(".")[0] not in VECTOR_PROJECTION
+    }
+    if not projection:
+        raise HTTPException(status_code=400, detail="No returnable fields requested")
+    projection.setdefault("_id", False)
+    return projection
+
+
+def similar_email_projection(projection):
+    """
+    Returns the neighbour fields to load for the similar-email references of a listing.
+
+    Returns:
+        dict: The projection for hydrate_similar_emails, or None if the listing
+        doesn't include similar emails
+    """
+    if projection.get("similar_emails"):
+        return SIMILAR_EMAIL_PROJECTION
+    fields = {
+        name.split(".", 1)[1]: True
+        for name, included in projection.items()
+        if name.startswith("similar_emails.") and included
+    }
+    fields.pop("_id", None)
+    fields.pop("score", None)
+    return fields or None
+
+
 @app.get("/database/collections/{collection_name}/documents")
-async def get_documents(collection_name: str, limit: int = 100, skip: int = 0):
-    """Returns documents from a specific collection with pagination."""
+async def get_documents(
+    collection_name: str,
+    limit: int = Query(100, ge=1, le=1000),
+    skip: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    """
+    Returns documents from a specific collection, newest first, with pagination.
+
+    Pass the ``next_cursor`` of a page as ``cursor`` to get the following page;
+    ``skip`` still works but gets slower the deeper the page. ``fields`` picks
+    the returned fields (comma-separated, ``_id`` only if listed).
+    """
     try:
-        if collection_name not in db.list_collection_names():
+        if collection_name not in await db.list_collection_names():
             raise HTTPException(
                 status_code=404, detail=f"Collection '{collection_name}' not found"
             )
 
+        try:
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         # Get the collection
         target_collection = db[collection_name]
 
-        # Count total documents
-        total_documents = target_collection.count_documents({})
-
-        # Get documents with pagination
-        documents = list(
-            target_collection.find({}, {"_id": False})
-            .sort("created_at", -1)
-            .skip(skip)
-            .limit(limit)
+        projection = document_projection(collection_name, fields)
+        neighbour_projection = (
+            similar_email_projection(projection) if collection_name == "emails" else None
+        )
+        query_projection = projection
+        if neighbour_projection and not projection.get("similar_emails"):
+            # Sub-fields of the neighbours are loaded through the references,
+            # which need their _id (and score) even if it wasn't asked for
+            query_projection = {**projection, "similar_emails._id": True, "similar_emails.score": True}
+
+        # Count total documents (from collection metadata) and get the page concurrently
+        total_documents, (documents, position) = await asyncio.gather(
+            target_collection.estimated_document_count(),
+            fetch_page(
+                target_collection,
+                projection=query_projection,
+                after=after,
+                skip=skip,
+                limit=limit,
+            ),
         )
 
-        return {
-            "collection": collection_name,
-            "total_documents": total_documents,
-            "documents": documents,
-            "page": {
-                "limit": limit,
-                "skip": skip,
-                "has_more": (skip + limit) < total_documents,
-            },
-        }
+        # Emails store their neighbours as references; load the whole page's
+        # neighbours in one query
+        if neighbour_projection:
+            await hydrate_similar_emails(target_collection, documents, neighbour_projection)
+        if query_projection is not projection:
+            unrequested = [
+                name for name in ("_id", "score") if not projection.get(f"similar_emails.{name}")
+            ]
+            for document in documents:
+                for neighbour in document.get("similar_emails") or []:
+                    for name in unrequested:
+                        neighbour.pop(name, None)
+
+        return MongoJSONResponse(
+            {
+                "collection": collection_name,
+                "total_documents": total_documents,
+                "documents": documents,
+                "page": {
+                    "limit": limit,
+                    "skip": skip,
+                    "has_more": position is not None,
+                    "next_cursor": encode_cursor(position) if position else None,
+                },
+            }
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -488,21 +1388,71 @@ async def get_documents(collection_name: str, limit: int = 100, skip: int = 0):
         )
 
 
+@app.get("/database/collections/{collection_name}/export")
+async def export_documents(
+    collection_name: str,
+    fields: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    compress: bool = False,
+    batch_size: int = Query(1000, ge=1, le=10000),
+):
+    """
+    Streams a collection as NDJSON, oldest first, in constant memory.
+
+    ``fields`` selects the exported fields like the documents endpoint; by
+    default every field but the embedding is exported, including ``_id``.
+    ``created_after`` (inclusive) and ``created_before`` (exclusive) restrict
+    the export to a created_at range, and ``compress`` gzips the stream.
+    """
+    if collection_name not in await db.list_collection_names():
+        raise HTTPException(
+            status_code=404, detail=f"Collection '{collection_name}' not found"
+        )
+
+    query = {}
+    if created_after or created_before:
+        query["created_at"] = {}
+        if created_after:
+            query["created_at"]["$gte"] = created_after
+        if created_before:
+            query["created_at"]["$lt"] = created_before
+
+    projection = document_projection(collection_name, fields) if fields else dict(VECTOR_PROJECTION)
+    documents = iter_documents(
+        db[collection_name], query, projection, EXPORT_SORT, batch_size=batch_size
+    )
+
+    filename = f"{collection_name}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        ndjson_chunks(documents, compress=compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.get("/database/stats")
 async def get_database_stats():
-    """Returns statistics about the database and its collections."""
-    try:
-        stats = {"database": db.name, "collections": [], "total_documents": 0}
+    """
+    Returns statistics about the database, its collections and the processed emails.
 
-        for collection_name in db.list_collection_names():
-            collection_stats = {
-                "name": collection_name,
-                "document_count": db[collection_name].count_documents({}),
-            }
-            stats["collections"].append(collection_stats)
-            stats["total_documents"] += collection_stats["document_count"]
+    Document counts come from collection metadata and email counters from the
+    stats summary, and the result is cached for STATS_CACHE_TTL seconds.
+    """
+
+    async def compute():
+        collections, emails = await asyncio.gather(
+            count_collections(db), email_stats.summary()
+        )
+        return {
+            "database": db.name,
+            "collections": collections,
+            "total_documents": sum(c["document_count"] for c in collections),
+            "emails": emails,
+        }
 
-        return stats
+    try:
+        return await stats_cache.get("database_stats", compute)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error fetching database stats: {str(e)}"
@@ -513,30 +1463,11 @@ async def get_database_stats():
 async def list_databases():
     """Returns a list of all databases in the MongoDB cluster."""
     try:
-        # Get list of all databases
-        databases = client_db.list_database_names()
-
-        # Filter out system databases if desired
-        filtered_databases = [
-            db_name
-            for db_name in databases
-            if db_name not in ["admin", "local", "config"]
-        ]
-
-        # Get basic stats for each database
-        db_stats = []
-        for db_name in filtered_databases:
-            current_db = client_db[db_name]
-            collections = current_db.list_collection_names()
-
-            db_info = {
-                "name": db_name,
-                "collections": len(collections),
-                "collection_names": collections,
-            }
-            db_stats.append(db_info)
-
-        return {"total_databases": len(filtered_databases), "databases": db_stats}
+        # Get basic stats for each non-system database
+        db_stats = await stats_cache.get(
+            "databases", lambda: describe_databases(client_db)
+        )
+        return {"total_databases": len(db_stats), "databases": db_stats}
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error listing databases: {str(e)}"
@@ -567,8 +1498,9 @@ async def configure_assistant(
             shutil.copyfileobj(file.file, temp_file)
 
         # Create the assistant with the vector store
-        assistant_response = create_assistant_with_vector_store(
-            temp_file_path, prompt_text
+        # Blocking requests (retried on rate limits), so off the event loop
+        assistant_response = await asyncio.to_thread(
+            create_assistant_with_vector_store, temp_file_path, prompt_text
         )
 
         # Extract the assistant ID from the response
@@ -578,7 +1510,14 @@ async def configure_assistant(
         global ASSISTANT_ID
         ASSISTANT_ID = assistant_id
         print(f'Assistant ID: {ASSISTANT_ID}')
-        
+
+        # The chat classifier retrieves examples from the same dataset locally
+        try:
+            with open(temp_file_path, encoding="utf-8", errors="replace") as dataset:
+                reference_examples.replace(parse_reference_examples(file.filename, dataset.read()))
+        except Exception as e:
+            print(f"Could not load reference examples from {file.filename}: {e}")
+
         # Clean up - delete the temporary file
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
@@ -0,0 +1,50 @@
+"""
+Converts the stored embeddings of the emails collection to another storage format.
+
+    python migrate_embedding_storage.py --storage float32
+    python migrate_embedding_storage.py --storage int8 --dry-run
+
+Set EMBEDDING_STORAGE to the same format so new emails are written in it too.
+Safe to interrupt and re-run: documents already in the target format are skipped.
+"""
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import MONGO_DB_NAME, create_client
+from embedding_storage import STORAGE_FORMATS, migrate_embeddings
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--storage", choices=STORAGE_FORMATS, required=True)
+    parser.add_argument("--collection", default="emails")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = create_client()
+    try:
+        report = await migrate_embeddings(
+            client[MONGO_DB_NAME][args.collection],
+            args.storage,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+        )
+    finally:
+        client.close()
+
+    saved = report["bytes_before"] - report["bytes_after"]
+    action = "Would convert" if args.dry_run else "Converted"
+    print(
+        f"{action} {report['converted']} of {report['scanned']} embeddings to {args.storage}: "
+        f"{report['bytes_before'] / 1e6:.1f} MB -> {report['bytes_after'] / 1e6:.1f} MB "
+        f"({saved / 1e6:.1f} MB saved)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
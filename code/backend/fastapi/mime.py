@@ -0,0 +1,151 @@
+import email
+import email.policy
+import mimetypes
+import os
+import re
+from html.parser import HTMLParser
+
+FORWARDED_SEPARATOR = "---------- Forwarded message ----------"
+
+
+class _HTMLText(HTMLParser):
+    """Collects the visible text of an HTML document, one line per block element."""
+
+    SKIPPED_TAGS = {"head", "script", "style", "title", "template"}
+    BLOCK_TAGS = {
+        "address", "article", "blockquote", "br", "dd", "div", "dl", "dt", "footer",
+        "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "ol", "p", "pre",
+        "section", "table", "td", "th", "tr", "ul",
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """
+    Converts an HTML email body to plain text.
+
+    Scripts, styles and the head are dropped, block elements start new lines
+    and runs of whitespace collapse as a browser would render them.
+    """
+    parser = _HTMLText()
+    parser.feed(html)
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def attachment_filename(part, position):
+    """
+    Returns a display name for a MIME attachment.
+
+    Names are chosen by the sender, so only the base name is kept; a part
+    without one is named after its position and content type.
+    """
+    filename = os.path.basename((part.get_filename() or "").replace("\\", "/"))
+    if not filename:
+        extension = mimetypes.guess_extension(part.get_content_type()) or ".bin"
+        filename = f"attachment-{position + 1}{extension}"
+    return filename
+
+
+def _attachment_content(part):
+    if part.get_content_maintype() == "text":
+        # Decoded with the part's charset, then handed on as UTF-8
+        return part.get_content().encode("utf-8")
+    return part.get_payload(decode=True) or b""
+
+
+def _is_body_part(part):
+    return (
+        part.get_content_type() in ("text/plain", "text/html")
+        and part.get_content_disposition() != "attachment"
+        and not part.get_filename()
+    )
+
+
+def _parse_message(message, attachments):
+    parsed = {
+        # Plain strings: header objects can't be pickled back from pool workers
+        "headers": {
+            name: str(message[name]) if message[name] is not None else None
+            for name in ("from", "to", "subject", "date")
+        },
+        "body": "",
+        "forwarded": [],
+    }
+    plain, html = [], []
+
+    def walk(part):
+        if part.get_content_type() == "message/rfc822":
+            # A forwarded message: parse it in the same pass, its attachments
+            # join the outer message's
+            parsed["forwarded"].append(_parse_message(part.get_payload(0), attachments))
+        elif part.is_multipart():
+            for subpart in part.iter_parts():
+                walk(subpart)
+        elif _is_body_part(part):
+            (plain if part.get_content_subtype() == "plain" else html).append(part.get_content())
+        else:
+            attachments.append(
+                (attachment_filename(part, len(attachments)), _attachment_content(part))
+            )
+
+    walk(message)
+    # Like get_body(), prefer the plain text alternative over the HTML one
+    if plain:
+        parsed["body"] = "\n".join(plain)
+    elif html:
+        parsed["body"] = "\n".join(html_to_text(text) for text in html)
+    return parsed
+
+
+def parse_eml(content):
+    """
+    Parses an .eml file in a single walk over its MIME tree.
+
+    Args:
+        content (bytes-like): The .eml file content
+
+    Returns:
+        dict: ``headers`` (from, to, subject, date), ``body`` text (HTML is
+        converted to text when there is no plain part), ``forwarded``
+        messages parsed the same way, and ``attachments`` as (filename, bytes)
+        tuples, including those of forwarded messages
+    """
+    message = email.message_from_bytes(bytes(content), policy=email.policy.default)
+    attachments = []
+    parsed = _parse_message(message, attachments)
+    parsed["attachments"] = attachments
+    return parsed
+
+
+def format_email_text(parsed):
+    """Renders a parsed email as the headers-then-body text that gets classified."""
+    headers = parsed["headers"]
+    text = (
+        f"From: {headers['from']}\nTo: {headers['to']}\n"
+        f"Subject: {headers['subject']}\nDate: {headers['date']}\n\n"
+    ) + parsed["body"]
+    for forwarded in parsed["forwarded"]:
+        text += f"\n\n{FORWARDED_SEPARATOR}\n" + format_email_text(forwarded)
+    return text
@@ -0,0 +1,150 @@
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Each extraction worker runs its own OCR; tesseract's OpenMP threads would
+# otherwise oversubscribe the CPU when several workers OCR at once. Must be
+# set before tesseract is loaded.
+os.environ.setdefault("OMP_THREAD_LIMIT", os.getenv("OCR_THREADS", "1"))
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # the in-process API is optional, pytesseract is the fallback
+    tesserocr = None
+
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Tesseract is tuned for ~300 DPI text; denser scans are scaled down to it
+OCR_TARGET_DPI = int(os.getenv("OCR_TARGET_DPI", "300"))
+# Phone photos carry no useful DPI, so their shorter side is capped instead
+# (a letter page is 2550 px wide at 300 DPI)
+OCR_MAX_SHORT_SIDE = int(os.getenv("OCR_MAX_SHORT_SIDE", "2550"))
+# Images taller than this are recognised in bands cut along blank rows
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "3300"))
+
+_local = threading.local()
+
+
+def _target_scale(image):
+    """Returns the factor that brings an image down to OCR resolution (never above 1)."""
+    scale = 1.0
+    dpi = image.info.get("dpi")
+    if dpi and dpi[0] > OCR_TARGET_DPI:
+        scale = OCR_TARGET_DPI / float(dpi[0])
+    short_side = min(image.size) * scale
+    if short_side > OCR_MAX_SHORT_SIDE:
+        scale *= OCR_MAX_SHORT_SIDE / short_side
+    return scale
+
+
+def otsu_threshold(pixels):
+    """Returns the grey level that best separates ink from paper (Otsu's method)."""
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(histogram)
+    total = weight[-1]
+    mean = np.cumsum(histogram * levels)
+    background = total - weight
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mean[-1] * weight - total * mean) ** 2 / (weight * background)
+    # A blank image has no split at all
+    return int(np.argmax(np.nan_to_num(between[:-1])))
+
+
+def preprocess(image):
+    """
+    Prepares an image for OCR: upright, greyscale, at OCR resolution and binarised.
+
+    JPEGs are decoded straight at a reduced size when they are larger than
+    needed, which is most of the cost for full-resolution phone photos.
+
+    Args:
+        image (PIL.Image.Image): The image, ideally not loaded yet
+
+    Returns:
+        PIL.Image.Image: A 1-bit image, black text on white
+    """
+    scale = _target_scale(image)
+    width, height = image.size
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if scale < 1 and image.format == "JPEG":
+        image.draft("L", size)
+    image = ImageOps.exif_transpose(image)
+    if (image.width > image.height) != (width > height):
+        # exif_transpose turned the image a quarter, so the target turns with it
+        size = size[::-1]
+    if image.mode in ("RGBA", "LA", "P"):
+        # Transparent regions become paper rather than black
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+    image = image.convert("L")
+    if scale < 1 and image.size != size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    pixels = np.asarray(image)
+    binary = pixels > otsu_threshold(pixels)
+    if binary.mean() < 0.5:
+        # Light text on a dark background
+        binary = ~binary
+    return Image.fromarray(binary)
+
+
+def tile_bounds(image, tile_height=None):
+    """
+    Splits a tall binarised image into bands of at most ``tile_height`` rows.
+
+    Each cut is moved to the row with the least ink in the lower half of the
+    band (the lowest such row), so lines of text are not sliced in half.
+
+    Returns:
+        list: (top, bottom) row ranges covering the whole image
+    """
+    tile_height = tile_height or OCR_TILE_HEIGHT
+    if image.height <= tile_height:
+        return [(0, image.height)]
+
+    ink = (~np.asarray(image)).sum(axis=1)
+    bounds = []
+    top = 0
+    while image.height - top > tile_height:
+        window = ink[top + tile_height // 2 : top + tile_height]
+        cut = top + tile_height // 2 + len(window) - 1 - int(np.argmin(window[::-1]))
+        bounds.append((top, cut))
+        top = cut
+    bounds.append((top, image.height))
+    return bounds
+
+
+def _recognise(image):
+    if tesserocr is not None:
+        # One API per worker thread, so the language model is loaded once and
+        # reused for every image instead of by a new process per call
+        api = getattr(_local, "api", None)
+        if api is None:
+            api = _local.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        api.SetImage(image)
+        return api.GetUTF8Text()
+    return pytesseract.image_to_string(image, lang=OCR_LANG)
+
+
+def image_to_text(image):
+    """
+    Recognises the text of an image.
+
+    Args:
+        image (PIL.Image.Image): The image to read
+
+    Returns:
+        str: The recognised text, tile by tile for very tall images
+    """
+    image = preprocess(image)
+    bounds = tile_bounds(image)
+    if len(bounds) == 1:
+        texts = [_recognise(image)]
+    else:
+        texts = [_recognise(image.crop((0, top, image.width, bottom))) for top, bottom in bounds]
+    return "\n".join(text.strip() for text in texts if text.strip())
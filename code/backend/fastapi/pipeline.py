@@ -0,0 +1,216 @@
+import asyncio
+import os
+import time
+
+# Default number of items allowed inside each stage at once. Classification and
+# embedding are network bound and can run wide; extraction is CPU bound.
+DEFAULT_STAGE_CONCURRENCY = {
+    "extract": int(os.getenv("BATCH_EXTRACT_CONCURRENCY", "4")),
+    "classify": int(os.getenv("BATCH_CLASSIFY_CONCURRENCY", "8")),
+    "embed": int(os.getenv("BATCH_EMBED_CONCURRENCY", "16")),
+    "search": int(os.getenv("BATCH_SEARCH_CONCURRENCY", "8")),
+    "store": int(os.getenv("BATCH_STORE_CONCURRENCY", "8")),
+}
+
+# Upper bound on items admitted into the pipeline but not yet finished, so a
+# backfill of tens of thousands of emails never holds them all in memory.
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", "64"))
+
+
+class StageError(Exception):
+    """Raised when an item fails inside a pipeline stage."""
+
+    def __init__(self, stage, error):
+        super().__init__(f"{stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+def stage_semaphores(names, concurrency=None, default=BATCH_MAX_IN_FLIGHT):
+    """
+    Creates one semaphore per stage from DEFAULT_STAGE_CONCURRENCY and overrides.
+
+    Args:
+        names (iterable): The stage names
+        concurrency (dict, optional): Per-stage limits overriding DEFAULT_STAGE_CONCURRENCY
+        default (int): Limit for stages without a configured one
+
+    Returns:
+        dict: Stage name -> asyncio.Semaphore
+    """
+    limits = {**DEFAULT_STAGE_CONCURRENCY, **(concurrency or {})}
+    return {name: asyncio.Semaphore(max(1, limits.get(name, default))) for name in names}
+
+
+class StageGraph:
+    """
+    Runs the stages of one item as a dependency graph.
+
+    Each stage is an async callable receiving a shared state dict. A stage
+    starts as soon as all stages it requires have finished, so independent
+    branches run concurrently. While running, ``state["stages"]`` maps stage
+    names to their tasks, which lets a stage use another stage's outcome
+    opportunistically without declaring a dependency on it.
+    """
+
+    def __init__(self, stages):
+        """
+        Args:
+            stages (list): (name, async callable, list of required stage names)
+                tuples, listed so that every stage comes after its requirements
+        """
+        self.stages = stages
+        seen = set()
+        for name, _, requires in stages:
+            missing = [required for required in requires if required not in seen]
+            if missing:
+                raise ValueError(f"Stage '{name}' requires unknown or later stages {missing}")
+            seen.add(name)
+
+    @property
+    def names(self):
+        return [name for name, _, _ in self.stages]
+
+    async def run(self, state, semaphores=None, listener=None):
+        """
+        Runs every stage on the state and records their wall times.
+
+        Args:
+            state (dict): The shared state; timings are written to
+                ``state["metrics"]["stage_timings"]``
+            semaphores (dict, optional): Per-stage semaphores bounding concurrency
+                across items (see stage_semaphores)
+            listener (callable, optional): Called as ``listener(event, name, state)``
+                with ``"started"`` when a stage starts running and ``"finished"``
+                once it has succeeded
+
+        Returns:
+            dict: The state
+
+        Raises:
+            StageError: For the first stage that fails; all other stages are cancelled
+        """
+        timings = state.setdefault("metrics", {}).setdefault("stage_timings", {})
+        tasks = state["stages"] = {}
+        started = time.perf_counter()
+
+        async def execute(name, stage):
+            stage_started = time.perf_counter()
+            if listener is not None:
+                listener("started", name, state)
+            await stage(state)
+            timings[name] = round(time.perf_counter() - stage_started, 4)
+            if listener is not None:
+                listener("finished", name, state)
+
+        async def run_stage(name, stage, requires):
+            if requires:
+                await asyncio.gather(*(tasks[required] for required in requires))
+            semaphore = (semaphores or {}).get(name)
+            try:
+                if semaphore is None:
+                    await execute(name, stage)
+                else:
+                    async with semaphore:
+                        await execute(name, stage)
+            except asyncio.CancelledError:
+                raise
+            except StageError:
+                raise
+            except Exception as e:
+                raise StageError(name, e) from e
+
+        for name, stage, requires in self.stages:
+            tasks[name] = asyncio.ensure_future(run_stage(name, stage, requires))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            # Let cancelled stages unwind before the error propagates
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            timings["total"] = round(time.perf_counter() - started, 4)
+            del state["stages"]
+        return state
+
+
+async def run_pipeline(items, stages, concurrency=None, max_in_flight=BATCH_MAX_IN_FLIGHT):
+    """
+    Drives items through a sequence of async stages with a concurrency limit per stage.
+
+    Items flow independently, so a slow item in one stage never holds up items
+    behind it in other stages. Results are yielded as soon as each item finishes.
+
+    Args:
+        items (iterable): The items to process; consumed lazily
+        stages (list): (name, async callable) pairs; each callable receives the
+            value returned by the previous stage
+        concurrency (dict, optional): Per-stage limits overriding DEFAULT_STAGE_CONCURRENCY
+        max_in_flight (int): Maximum number of items being processed at once
+
+    Yields:
+        dict: ``index``, ``result`` or ``error`` (a StageError) and ``elapsed`` seconds
+    """
+    semaphores = stage_semaphores(
+        [name for name, _ in stages], concurrency, default=max_in_flight
+    )
+    admission = asyncio.Semaphore(max(1, max_in_flight))
+    finished = asyncio.Queue()
+    tasks = set()
+
+    async def drive(index, item):
+        started = time.perf_counter()
+        value = item
+        outcome = {"index": index}
+        try:
+            for name, stage in stages:
+                try:
+                    async with semaphores[name]:
+                        value = await stage(value)
+                except StageError:
+                    # Already attributed to a finer-grained stage (e.g. a StageGraph)
+                    raise
+                except Exception as e:
+                    raise StageError(name, e) from e
+            outcome["result"] = value
+        except StageError as e:
+            outcome["error"] = e
+        outcome["elapsed"] = time.perf_counter() - started
+        await finished.put(outcome)
+
+    async def feed():
+        count = 0
+        for index, item in enumerate(items):
+            await admission.acquire()
+            task = asyncio.create_task(drive(index, item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            count += 1
+        return count
+
+    feeder = asyncio.create_task(feed())
+    produced = 0
+    try:
+        while True:
+            # Stop once the feeder has run dry and every admitted item is out
+            if feeder.done() and produced == feeder.result():
+                break
+            getter = asyncio.ensure_future(finished.get())
+            waiting = {getter} if feeder.done() else {getter, feeder}
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+            if getter in done:
+                produced += 1
+                # Only admit a new item once a result has been handed over, so
+                # a slow consumer cannot make finished results pile up either
+                admission.release()
+                yield getter.result()
+            else:
+                getter.cancel()
+    finally:
+        # The consumer went away (e.g. client disconnected): stop all work
+        feeder.cancel()
+        for task in list(tasks):
+            task.cancel()
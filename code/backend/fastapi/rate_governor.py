@@ -0,0 +1,460 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from token_budget import CHARS_PER_TOKEN
+
+# Requests and tokens per minute for models without an entry in OPENAI_RATE_LIMITS
+OPENAI_RPM = float(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.getenv("OPENAI_TPM", "200000"))
+# Per-model limits as "model=rpm:tpm,model=rpm:tpm", e.g. the account's tier
+OPENAI_RATE_LIMITS = os.getenv("OPENAI_RATE_LIMITS", "")
+# Seconds of traffic a bucket can hold, i.e. the largest burst sent at once
+OPENAI_BURST_SECONDS = float(os.getenv("OPENAI_BURST_SECONDS", "10"))
+# Completion tokens counted for chat requests that don't set max_tokens
+OPENAI_COMPLETION_TOKENS = int(os.getenv("OPENAI_COMPLETION_TOKENS", "1000"))
+# Retries of rate limited (429), overloaded (5xx) and dropped requests; see retryable
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_RETRY_BASE = float(os.getenv("OPENAI_RETRY_BASE", "0.5"))
+OPENAI_RETRY_MAX = float(os.getenv("OPENAI_RETRY_MAX", "30"))
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+# Endpoints that create nothing, so a request that may have reached the API
+# can be sent again; creating a thread, message or run twice would duplicate it
+IDEMPOTENT_PATHS = ("/embeddings", "/chat/completions")
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Errors raised before the request was sent, which is always safe to repeat
+UNSENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# The OpenAI SDK's connection limits, which httpx ignores once a transport is given
+OPENAI_CONNECTION_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "1000")),
+    max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "100")),
+    keepalive_expiry=5.0,
+)
+
+# Lower values are served first
+LANES = {"interactive": 0, "batch": 1}
+_lane = contextvars.ContextVar("openai_lane", default="interactive")
+
+
+@contextlib.contextmanager
+def openai_lane(name):
+    """
+    Sends the OpenAI requests made in this context, and in tasks started from it, in a lane.
+
+    Requests in the ``interactive`` lane (the default) are let through before
+    waiting ``batch`` requests whenever the rate limits are the bottleneck.
+    """
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane():
+    return _lane.get()
+
+
+def lane_priority(name):
+    """Returns the place of a lane in LANES; unknown lanes go last."""
+    return LANES.get(name, len(LANES))
+
+
+def parse_rate_limits(text):
+    """
+    Parses OPENAI_RATE_LIMITS.
+
+    Returns:
+        dict: Model -> (requests per minute, tokens per minute)
+    """
+    limits = {}
+    for entry in filter(None, (part.strip() for part in text.split(","))):
+        model, _, values = entry.partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model.strip()] = (float(rpm), float(tpm or OPENAI_TPM))
+    return limits
+
+
+def retry_after(headers):
+    """Returns the delay a response asks for in seconds, or None."""
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_idempotent(request):
+    """Returns whether sending a request twice has the same effect as sending it once."""
+    return (
+        request.method in IDEMPOTENT_METHODS
+        or "idempotency-key" in request.headers
+        or request.url.path.endswith(IDEMPOTENT_PATHS)
+    )
+
+
+def retryable(request, status_code=None, error=None):
+    """
+    Returns whether a failed request may be sent again.
+
+    A 429 was rejected before doing anything and is always retried. A 5xx, a
+    408/409 or a dropped connection may have reached the API, so those are only
+    retried for idempotent requests (see is_idempotent), unless the request
+    never left this process.
+    """
+    if error is not None:
+        return isinstance(error, UNSENT_ERRORS) or is_idempotent(request)
+    if status_code == 429:
+        return True
+    return status_code in RETRY_STATUSES and is_idempotent(request)
+
+
+def retry_delay(attempt, headers=None):
+    """
+    Returns how long to wait before retrying a request.
+
+    The server's Retry-After is honoured, with up to 10% added so that clients
+    told the same delay don't all come back at once. Without one, the delay is
+    drawn uniformly up to an exponential backoff ("full jitter").
+
+    Args:
+        attempt (int): Retries made so far
+        headers (optional): The failed response's headers
+    """
+    requested = retry_after(headers) if headers is not None else None
+    if requested is not None:
+        return requested * random.uniform(1.0, 1.1)
+    return random.uniform(0, min(OPENAI_RETRY_MAX, OPENAI_RETRY_BASE * 2 ** attempt))
+
+
+def estimate_tokens(path, body):
+    """
+    Estimates the tokens a request counts against the tokens-per-minute limit.
+
+    Prompts are estimated from their length rather than tokenised, which would
+    cost more than the request itself on large embedding batches.
+
+    Args:
+        path (str): The request path
+        body (dict): The JSON request body
+
+    Returns:
+        int: Estimated prompt tokens plus the completion tokens allowed
+    """
+    if path.endswith("/embeddings"):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs or []
+        # Inputs are texts, or already lists of token ids
+        chars = sum(len(item) if isinstance(item, str) else CHARS_PER_TOKEN for item in inputs)
+        return int(chars / CHARS_PER_TOKEN) + 1
+    if path.endswith("/chat/completions"):
+        chars = 0
+        for message in body.get("messages") or []:
+            content = message.get("content")
+            if isinstance(content, list):
+                content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            chars += len(content or "")
+        completion = body.get("max_completion_tokens") or body.get("max_tokens") or OPENAI_COMPLETION_TOKENS
+        return int(chars / CHARS_PER_TOKEN) + completion
+    return 0
+
+
+class TokenBucket:
+    """
+    A token bucket refilled at a per-minute rate, holding OPENAI_BURST_SECONDS of it.
+
+    Takes may drive the level negative (a request larger than the bucket is
+    let through once it is full); later takes then wait for the debt.
+    """
+
+    def __init__(self, per_minute, burst_seconds=OPENAI_BURST_SECONDS):
+        self.set_rate(per_minute, burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def set_rate(self, per_minute, burst_seconds=OPENAI_BURST_SECONDS):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until ``amount`` (at most a full bucket) is available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate) if self.rate > 0 else (0.0 if missing <= 0 else float("inf"))
+
+    def take(self, amount, now):
+        self._refill(now)
+        self.level -= amount
+
+    def clamp(self, available, now):
+        """Lowers the level to what the server reports as left."""
+        self._refill(now)
+        self.level = min(self.level, available)
+
+
+class ModelLimiter:
+    """
+    Admits the requests for one model within its requests and tokens per minute.
+
+    Waiting requests are served by lane, then in arrival order; only the head
+    of the line watches the buckets, the others sleep until it has gone.
+    """
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.waiting = []
+        self.order = itertools.count()
+
+    def delay(self, tokens, now):
+        return max(
+            self.paused_until - now,
+            self.requests.wait_time(1, now),
+            self.tokens.wait_time(tokens, now),
+        )
+
+    def pause(self, seconds):
+        """Holds back every request for this model, e.g. after a 429."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def observe(self, headers):
+        """Adopts the limits and remaining capacity reported in the x-ratelimit headers."""
+        now = time.monotonic()
+        for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+            try:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                if limit and float(limit) / 60 != bucket.rate:
+                    bucket.set_rate(float(limit))
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining:
+                    bucket.clamp(float(remaining), now)
+            except ValueError:
+                pass
+
+    def _wake_head(self):
+        if self.waiting:
+            wake = self.waiting[0][3]
+            if wake is not None and not wake.done():
+                wake.set_result(None)
+
+    async def acquire(self, tokens, lane="interactive", order=None):
+        """
+        Waits until a request of ``tokens`` tokens may be sent.
+
+        Args:
+            tokens (int): Estimated tokens of the request
+            lane (str): One of LANES
+            order (int, optional): Place in line within the lane; a retry
+                passes the one it first got so it isn't sent to the back
+
+        Returns:
+            float: Seconds waited
+        """
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        order = next(self.order) if order is None else order
+        entry = [lane_priority(lane), order, tokens, None]
+        heapq.heappush(self.waiting, entry)
+        try:
+            while True:
+                if self.waiting[0] is entry:
+                    now = time.monotonic()
+                    delay = self.delay(tokens, now)
+                    if delay <= 0:
+                        heapq.heappop(self.waiting)
+                        self.requests.take(1, now)
+                        self.tokens.take(tokens, now)
+                        self._wake_head()
+                        return now - started
+                else:
+                    delay = None
+                entry[3] = loop.create_future()
+                try:
+                    await asyncio.wait_for(entry[3], timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if entry in self.waiting:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self._wake_head()
+            raise
+
+    def queued(self):
+        """Returns the number of waiting requests per lane."""
+        return {
+            name: sum(1 for entry in self.waiting if entry[0] == priority)
+            for name, priority in LANES.items()
+        }
+
+
+class RateGovernor:
+    """
+    Keeps the OpenAI requests of this process within the account's rate limits.
+
+    Every request passes through ``send`` (see GovernedTransport): it waits for
+    its model's requests-per-minute and tokens-per-minute buckets, in its lane,
+    and is retried with jittered backoff when the API answers 429, or 5xx or
+    the connection drops on an idempotent request (see retryable). A 429 pauses the whole model for its Retry-After, so one
+    rejection doesn't turn into a burst of them. Under a burst, requests queue
+    up and are sent at the sustainable rate instead of failing.
+
+    The buckets start at the configured limits and follow the limits the API
+    reports in its x-ratelimit headers.
+    """
+
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, limits=None, max_retries=OPENAI_MAX_RETRIES):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limits = parse_rate_limits(OPENAI_RATE_LIMITS) if limits is None else limits
+        self.max_retries = max_retries
+        self.limiters = {}
+        self.stats = {}
+
+    def limiter(self, model):
+        if model not in self.limiters:
+            self.limiters[model] = ModelLimiter(*self.limits.get(model, (self.rpm, self.tpm)))
+            self.stats[model] = {
+                "requests": 0,
+                "estimated_tokens": 0,
+                "throttled": 0,
+                "throttle_wait_seconds": 0.0,
+                "max_throttle_wait_seconds": 0.0,
+                "rate_limited": 0,
+                "retries": 0,
+                "failed": 0,
+            }
+        return self.limiters[model]
+
+    def _record_wait(self, stats, waited):
+        if waited > 0.001:
+            stats["throttled"] += 1
+            stats["throttle_wait_seconds"] += waited
+            stats["max_throttle_wait_seconds"] = max(stats["max_throttle_wait_seconds"], waited)
+
+    async def send(self, request, send):
+        """
+        Sends a request through the limiter of its model, retrying failures.
+
+        Args:
+            request (httpx.Request): The API request
+            send: ``async send(request)`` returning the httpx.Response
+
+        Returns:
+            httpx.Response: The final response, which may still be an error once
+            the retries are spent
+        """
+        model, tokens = "default", 0
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = json.loads(request.content or b"{}")
+                model = body.get("model") or model
+                tokens = estimate_tokens(request.url.path, body)
+            except (ValueError, AttributeError):
+                pass
+        limiter = self.limiter(model)
+        stats = self.stats[model]
+        lane = current_lane()
+        order = next(limiter.order)
+
+        for attempt in itertools.count():
+            self._record_wait(stats, await limiter.acquire(tokens, lane, order))
+            stats["requests"] += 1
+            stats["estimated_tokens"] += tokens
+            try:
+                response = await send(request)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or not retryable(request, error=e):
+                    stats["failed"] += 1
+                    raise
+                print(f"OpenAI request to {request.url.path} failed ({e!r}), retrying")
+                stats["retries"] += 1
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+
+            limiter.observe(response.headers)
+            if not retryable(request, response.status_code):
+                if response.status_code in RETRY_STATUSES:
+                    stats["failed"] += 1
+                return response
+            if response.status_code == 429:
+                stats["rate_limited"] += 1
+                await response.aread()
+                # An exhausted quota won't come back by waiting
+                if b"insufficient_quota" in response.content:
+                    stats["failed"] += 1
+                    return response
+            if attempt >= self.max_retries:
+                stats["failed"] += 1
+                return response
+
+            delay = retry_delay(attempt, response.headers)
+            await response.aclose()
+            stats["retries"] += 1
+            if response.status_code == 429:
+                limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    def get_stats(self):
+        """Returns per-model request, throttling and retry counters and the current queues."""
+        return {
+            model: {
+                **stats,
+                "throttle_wait_seconds": round(stats["throttle_wait_seconds"], 3),
+                "max_throttle_wait_seconds": round(stats["max_throttle_wait_seconds"], 3),
+                "avg_throttle_wait_seconds": round(stats["throttle_wait_seconds"] / stats["requests"], 4)
+                if stats["requests"]
+                else 0.0,
+                "rpm_limit": round(self.limiters[model].requests.rate * 60),
+                "tpm_limit": round(self.limiters[model].tokens.rate * 60),
+                "queued": self.limiters[model].queued(),
+            }
+            for model, stats in self.stats.items()
+        }
+
+
+class GovernedTransport(httpx.AsyncBaseTransport):
+    """
+    An httpx transport sending every request through a RateGovernor.
+
+    Pass it to the OpenAI client (with ``max_retries=0``, as the governor does
+    the retrying) to cover every API call the client makes. The default
+    transport keeps the SDK's connection limits.
+    """
+
+    def __init__(self, governor, transport=None):
+        self.governor = governor
+        self.transport = transport or httpx.AsyncHTTPTransport(limits=OPENAI_CONNECTION_LIMITS)
+
+    async def handle_async_request(self, request):
+        return await self.governor.send(request, self.transport.handle_async_request)
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,491 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+from bson import ObjectId
+
+from embedding_storage import decode_embedding, query_vector
+
+try:
+    import hnswlib
+except ImportError:  # approximate search on the local backend is optional
+    hnswlib = None
+
+# "atlas" uses the Atlas $vectorSearch index, "local" an in-process NumPy index
+SIMILARITY_BACKEND = os.getenv("SIMILARITY_BACKEND", "atlas").lower()
+SIMILAR_EMAILS_LIMIT = int(os.getenv("SIMILAR_EMAILS_LIMIT", "5"))
+# Exact search scans every vector; approximate (ANN) search only visits about
+# SIMILARITY_NUM_CANDIDATES of them, trading a little recall for latency that
+# stays flat as the collection grows.
+SIMILARITY_EXACT = os.getenv("SIMILARITY_EXACT", "true").lower() in ("1", "true", "yes")
+SIMILARITY_NUM_CANDIDATES = int(os.getenv("SIMILARITY_NUM_CANDIDATES", "100"))
+# Matches scoring below this are dropped; scores range from 0 to 1
+SIMILARITY_MIN_SCORE = float(os.getenv("SIMILARITY_MIN_SCORE", "0"))
+LOCAL_INDEX_DIR = os.getenv(
+    "LOCAL_INDEX_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "vector_index"),
+)
+# Rows added to the memory-mapped matrix whenever it runs out of space
+LOCAL_INDEX_GROWTH = int(os.getenv("LOCAL_INDEX_GROWTH", "4096"))
+# HNSW graph parameters for approximate search on the local backend
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+# Atlas rejects numCandidates above this
+ATLAS_MAX_CANDIDATES = 10000
+
+# Fields returned for every similar email, whichever backend found it. The
+# neighbours' own similar_emails are left out so results never nest.
+SIMILAR_EMAIL_PROJECTION = {
+    "_id": 1,
+    "email": 1,
+    "classification": 1,
+    "classification_source": 1,
+    "receiver_email": 1,
+    "created_at": 1,
+}
+
+
+def cosine_to_score(cosine):
+    """Maps cosine similarity to Atlas' normalised vectorSearchScore, (1 + cosine) / 2."""
+    return (1 + cosine) / 2
+
+
+def score_to_cosine(score):
+    return 2 * score - 1
+
+
+def search_options(limit=None, num_candidates=None, min_score=None, exact=None):
+    """
+    Fills in unset search knobs from the configuration.
+
+    Returns:
+        dict: ``limit``, ``num_candidates``, ``min_score`` and ``exact``
+    """
+    limit = SIMILAR_EMAILS_LIMIT if limit is None else limit
+    num_candidates = SIMILARITY_NUM_CANDIDATES if num_candidates is None else num_candidates
+    return {
+        "limit": limit,
+        # Fewer candidates than results can't fill the page
+        "num_candidates": max(num_candidates, limit),
+        "min_score": SIMILARITY_MIN_SCORE if min_score is None else min_score,
+        "exact": SIMILARITY_EXACT if exact is None else exact,
+    }
+
+
+class AtlasVectorSearch:
+    """Similarity search through the Atlas ``vector_index`` on the emails collection."""
+
+    def __init__(self, collection, index="vector_index"):
+        self.collection = collection
+        self.index = index
+
+    async def load(self):
+        pass
+
+    async def add(self, document_id, embedding):
+        # Atlas indexes documents as they are written
+        pass
+
+    async def search(self, embedding, limit=None, num_candidates=None, min_score=None, exact=None):
+        """
+        Returns the most similar emails, each with a ``score``.
+
+        Args:
+            embedding (list): The query vector
+            limit (int, optional): Maximum number of emails to return
+            num_candidates (int, optional): Nearest neighbours considered by an ANN search
+            min_score (float, optional): Drop matches scoring below this
+            exact (bool, optional): Scan every vector instead of the ANN graph
+
+        Unset arguments default to the SIMILARITY_* configuration.
+        """
+        options = search_options(limit, num_candidates, min_score, exact)
+        vector_search = {
+            "index": self.index,
+            "queryVector": query_vector(embedding),
+            "path": "embedding",
+            "limit": options["limit"],
+        }
+        if options["exact"]:
+            vector_search["exact"] = True
+        else:
+            vector_search["numCandidates"] = min(options["num_candidates"], ATLAS_MAX_CANDIDATES)
+
+        pipeline = [
+            {"$vectorSearch": vector_search},
+            {
+                "$project": {
+                    **SIMILAR_EMAIL_PROJECTION,
+                    "score": {"$meta": "vectorSearchScore"},
+                }
+            },
+        ]
+        if options["min_score"] > 0:
+            pipeline.append({"$match": {"score": {"$gte": options["min_score"]}}})
+        return await self.collection.aggregate(pipeline).to_list(length=None)
+
+    def get_stats(self):
+        return {"backend": "atlas", "exact": SIMILARITY_EXACT}
+
+
+class LocalVectorIndex:
+    """
+    Exact similarity search over a local, memory-mapped embedding matrix.
+
+    Embeddings are normalised once when added and kept in a contiguous float32
+    matrix on disk next to the ObjectIds they belong to, so a restart only maps
+    the files instead of re-reading every embedding from MongoDB. A query is a
+    single matrix-vector product followed by an ``argpartition`` top-k.
+
+    Approximate searches go through an in-memory HNSW graph (hnswlib) instead.
+    The graph is built from the mapped matrix on the first approximate query
+    and then kept up to date as emails are added; without hnswlib every search
+    is exact.
+
+    The files are written by this process only; run a single worker per index
+    directory.
+    """
+
+    def __init__(
+        self,
+        collection,
+        directory=LOCAL_INDEX_DIR,
+        growth=LOCAL_INDEX_GROWTH,
+        m=HNSW_M,
+        ef_construction=HNSW_EF_CONSTRUCTION,
+    ):
+        self.collection = collection
+        self.directory = directory
+        self.growth = growth
+        self.m = m
+        self.ef_construction = ef_construction
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.ids_path = os.path.join(directory, "ids.bin")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.dimensions = None
+        self.count = 0
+        self.capacity = 0
+        self.vectors = None
+        self.ids = None
+        self.loaded = False
+        self.load_lock = asyncio.Lock()
+        self.hnsw = None
+        self.hnsw_lock = asyncio.Lock()
+
+    # -- persistence -----------------------------------------------------
+
+    def _map(self, capacity):
+        """(Re)maps both files with room for ``capacity`` rows."""
+        self.vectors = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r+" if os.path.exists(self.vectors_path) else "w+",
+            shape=(capacity, self.dimensions),
+        )
+        # ObjectIds are a fixed 12 bytes, so they map as rows of uint8
+        self.ids = np.memmap(
+            self.ids_path,
+            dtype=np.uint8,
+            mode="r+" if os.path.exists(self.ids_path) else "w+",
+            shape=(capacity, 12),
+        )
+        self.capacity = capacity
+
+    def _grow(self, needed):
+        capacity = max(needed, self.capacity + self.growth)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.ids.flush()
+        for path, row_bytes in ((self.vectors_path, self.dimensions * 4), (self.ids_path, 12)):
+            with open(path, "ab") as f:
+                f.truncate(capacity * row_bytes)
+        self._map(capacity)
+
+    def _write_meta(self):
+        # Written last, so a crash mid-append just drops the unfinished rows
+        temp_path = self.meta_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"dimensions": self.dimensions, "count": self.count}, f)
+        os.replace(temp_path, self.meta_path)
+
+    def _open(self):
+        """Maps an existing index; returns False if there is none."""
+        if not os.path.exists(self.meta_path):
+            return False
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.dimensions = meta["dimensions"]
+        self.count = meta["count"]
+        capacity = os.path.getsize(self.vectors_path) // (self.dimensions * 4)
+        self._map(max(capacity, self.count))
+        return True
+
+    def _append(self, document_ids, embeddings):
+        """Normalises and appends rows; the caller persists metadata."""
+        if isinstance(embeddings, np.ndarray):
+            matrix = embeddings.astype(np.float32, copy=True)
+        else:
+            # Stored embeddings may be arrays or float32/int8 BinData
+            matrix = np.array([decode_embedding(e) for e in embeddings], dtype=np.float32)
+        if self.dimensions is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.dimensions = matrix.shape[1]
+        if matrix.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Embedding has {matrix.shape[1]} dimensions, index has {self.dimensions}"
+            )
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        start, end = self.count, self.count + len(matrix)
+        if end > self.capacity:
+            self._grow(end)
+        self.vectors[start:end] = matrix
+        self.ids[start:end] = np.frombuffer(
+            b"".join(ObjectId(document_id).binary for document_id in document_ids),
+            dtype=np.uint8,
+        ).reshape(-1, 12)
+        self.count = end
+        if self.hnsw is not None:
+            self._hnsw_add(self.hnsw, start, end)
+
+    async def rebuild(self, batch_size=1000):
+        """Rebuilds the index from every stored embedding in the collection."""
+        for path in (self.vectors_path, self.ids_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.dimensions, self.count, self.capacity = None, 0, 0
+        self.vectors = self.ids = self.hnsw = None
+
+        cursor = self.collection.find(
+            {"embedding": {"$exists": True}}, {"embedding": 1}, batch_size=batch_size
+        )
+        ids, embeddings = [], []
+        async for document in cursor:
+            ids.append(document["_id"])
+            embeddings.append(document["embedding"])
+            if len(ids) >= batch_size:
+                self._append(ids, embeddings)
+                ids, embeddings = [], []
+        if ids:
+            self._append(ids, embeddings)
+        if self.dimensions is not None:
+            self.vectors.flush()
+            self.ids.flush()
+            self._write_meta()
+        print(f"Local vector index rebuilt with {self.count} embeddings")
+
+    async def load(self):
+        """Maps the index from disk, building it from MongoDB the first time."""
+        async with self.load_lock:
+            if self.loaded:
+                return
+            if not self._open():
+                await self.rebuild()
+            self.loaded = True
+
+    # -- approximate search ----------------------------------------------
+
+    def _hnsw_add(self, index, start, end):
+        """Adds matrix rows ``start:end`` to an HNSW graph, labelled by row."""
+        if end > index.get_max_elements():
+            index.resize_index(max(end, index.get_max_elements() + self.growth))
+        index.add_items(self.vectors[start:end], np.arange(start, end))
+
+    def _build_hnsw(self, count):
+        index = hnswlib.Index(space="ip", dim=self.dimensions)
+        index.init_index(
+            max_elements=max(count, self.growth), M=self.m, ef_construction=self.ef_construction
+        )
+        if count:
+            self._hnsw_add(index, 0, count)
+        return index
+
+    async def _hnsw_index(self):
+        """Returns the HNSW graph, building it on first use."""
+        async with self.hnsw_lock:
+            if self.hnsw is None and self.dimensions is not None:
+                built = self.count
+                index = await asyncio.to_thread(self._build_hnsw, built)
+                # Emails stored while the graph was being built
+                if self.count > built:
+                    self._hnsw_add(index, built, self.count)
+                self.hnsw = index
+                print(f"HNSW graph built over {self.count} embeddings")
+        return self.hnsw
+
+    def ann_top_k(self, embedding, limit=SIMILAR_EMAILS_LIMIT, num_candidates=SIMILARITY_NUM_CANDIDATES):
+        """
+        Returns the rows most similar to an embedding according to the HNSW graph.
+
+        Args:
+            embedding (list): The query vector
+            limit (int): Maximum number of rows to return
+            num_candidates (int): Size of the candidate list explored (hnswlib's ``ef``)
+
+        Returns:
+            list: (row, cosine similarity) tuples, best first
+        """
+        count = self.hnsw.get_current_count()
+        if not count:
+            return []
+        limit = min(limit, count)
+        self.hnsw.set_ef(max(num_candidates, limit))
+        rows, distances = self.hnsw.knn_query(np.asarray(embedding, dtype=np.float32), k=limit)
+        # The "ip" space reports 1 - inner product with the unnormalised query
+        query_norm = np.linalg.norm(embedding) or 1.0
+        return [
+            (int(row), float((1 - distance) / query_norm))
+            for row, distance in zip(rows[0], distances[0])
+        ]
+
+    # -- backend interface -----------------------------------------------
+
+    async def add(self, document_id, embedding):
+        """Appends a newly stored email to the index."""
+        if not self.loaded:
+            await self.load()
+            # A first-time build from the collection may already include it
+            if self._contains(document_id):
+                return
+        self._append([document_id], [embedding])
+        self._write_meta()
+
+    def _contains(self, document_id):
+        if not self.count:
+            return False
+        key = np.frombuffer(ObjectId(document_id).binary, dtype=np.uint8)
+        return bool((self.ids[: self.count] == key).all(axis=1).any())
+
+    def top_k(self, embedding, limit=SIMILAR_EMAILS_LIMIT):
+        """
+        Returns the rows most similar to an embedding.
+
+        Scans the whole matrix, so ``search`` runs it in a thread; emails added
+        meanwhile are appended past the rows it reads.
+
+        Returns:
+            list: (row, cosine similarity) tuples, best first
+        """
+        vectors = self.vectors
+        # A concurrent _grow may have remapped the matrix after it was read
+        count = min(self.count, len(vectors)) if vectors is not None else 0
+        if not count:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        similarities = vectors[:count] @ query
+        limit = min(limit, count)
+        # argpartition finds the top k in linear time; only those k get sorted
+        candidates = np.argpartition(-similarities, limit - 1)[:limit]
+        best = candidates[np.argsort(-similarities[candidates])]
+        return [(int(row), float(similarities[row])) for row in best]
+
+    async def search(self, embedding, limit=None, num_candidates=None, min_score=None, exact=None):
+        """
+        Returns the most similar emails, each with a ``score``, like Atlas.
+
+        Takes the same arguments as AtlasVectorSearch.search.
+        """
+        options = search_options(limit, num_candidates, min_score, exact)
+        await self.load()
+        approximate = not options["exact"] and hnswlib is not None
+        if approximate and await self._hnsw_index() is not None:
+            matches = self.ann_top_k(embedding, options["limit"], options["num_candidates"])
+        else:
+            # The scan takes milliseconds per 100k emails; keep the event loop free
+            matches = await asyncio.to_thread(self.top_k, embedding, options["limit"])
+
+        min_cosine = score_to_cosine(options["min_score"])
+        matches = [(row, cosine) for row, cosine in matches if cosine >= min_cosine]
+        if not matches:
+            return []
+
+        ids = [ObjectId(self.ids[row].tobytes()) for row, _ in matches]
+        documents = await self.collection.find(
+            {"_id": {"$in": ids}}, SIMILAR_EMAIL_PROJECTION
+        ).to_list(length=None)
+        by_id = {document["_id"]: document for document in documents}
+
+        results = []
+        for document_id, (_, cosine) in zip(ids, matches):
+            # Documents deleted from MongoDB are skipped
+            if document_id in by_id:
+                results.append({**by_id[document_id], "score": cosine_to_score(cosine)})
+        return results
+
+    def get_stats(self):
+        return {
+            "backend": "local",
+            "vectors": self.count,
+            "dimensions": self.dimensions,
+            "capacity": self.capacity,
+            "exact": SIMILARITY_EXACT,
+            "hnsw_vectors": self.hnsw.get_current_count() if self.hnsw is not None else None,
+        }
+
+
+def similar_email_references(similar_emails):
+    """Returns the compact form of search results stored with an email: ``_id`` and ``score``."""
+    return [{"_id": neighbour["_id"], "score": neighbour["score"]} for neighbour in similar_emails]
+
+
+def is_reference(neighbour):
+    return "_id" in neighbour and set(neighbour) <= {"_id", "score"}
+
+
+async def hydrate_similar_emails(collection, documents, projection=SIMILAR_EMAIL_PROJECTION):
+    """
+    Resolves the similar-email references of several documents with one ``$in`` query.
+
+    References are replaced by the referenced email's fields plus their
+    ``score``. Emails stored before references were introduced embed their
+    neighbours and are left as they are; references to deleted emails are
+    dropped.
+
+    Args:
+        collection: The Motor emails collection
+        documents (list): Documents whose ``similar_emails`` are resolved in place
+        projection (dict): The neighbour fields to load
+
+    Returns:
+        list: The same documents
+    """
+    pending = [
+        reference
+        for document in documents
+        for reference in document.get("similar_emails") or []
+        if is_reference(reference)
+    ]
+    if not pending:
+        return documents
+
+    ids = list({reference["_id"] for reference in pending})
+    neighbours = await collection.find(
+        {"_id": {"$in": ids}}, {**projection, "_id": 1}
+    ).to_list(length=None)
+    by_id = {neighbour["_id"]: neighbour for neighbour in neighbours}
+
+    for document in documents:
+        if not document.get("similar_emails"):
+            continue
+        resolved = []
+        for reference in document["similar_emails"]:
+            if not is_reference(reference):
+                resolved.append(reference)
+            elif reference["_id"] in by_id:
+                resolved.append({**by_id[reference["_id"]], "score": reference.get("score")})
+        document["similar_emails"] = resolved
+    return documents
+
+
+def create_similarity_backend(collection):
+    """Creates the similarity backend configured by SIMILARITY_BACKEND."""
+    if SIMILARITY_BACKEND == "local":
+        return LocalVectorIndex(collection)
+    return AtlasVectorSearch(collection)
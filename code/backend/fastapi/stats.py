@@ -0,0 +1,224 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
+
+# Collection holding the incrementally maintained email counters
+STATS_COLLECTION = os.getenv("STATS_COLLECTION", "email_stats")
+# How long dashboard statistics are served from memory
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "30"))
+# Days of per-day counters returned with the summary
+STATS_RECENT_DAYS = int(os.getenv("STATS_RECENT_DAYS", "30"))
+# A rebuild marker older than this was left by a process that died mid-rebuild
+STATS_REBUILD_TIMEOUT = float(os.getenv("STATS_REBUILD_TIMEOUT", "600"))
+
+TOTALS_ID = "totals"
+REBUILD_ID = "rebuild"
+DAY_PREFIX = "day:"
+
+
+def primary_intent(classification):
+    """Returns the first (primary) intent of a classification, or "Uncategorized"."""
+    intents = (classification or {}).get("request_intents") or []
+    return (intents[0].get("intent") if intents else None) or "Uncategorized"
+
+
+def _field_name(name):
+    # Intents become field names, which may not contain dots or start with "$"
+    return name.replace(".", "_").lstrip("$") or "_"
+
+
+def email_counters(email_data):
+    """
+    Returns the counter increments for one stored email.
+
+    Returns:
+        tuple: (increments of the totals document, day id, increments of the day document)
+    """
+    attachments = len(email_data.get("attachments") or [])
+    totals = {
+        "emails": 1,
+        "attachments": attachments,
+        "emails_with_attachments": 1 if attachments else 0,
+        "classifications_reused": 1 if email_data.get("classification_reused_from") else 0,
+        "classifications_knn": 1 if email_data.get("classification_source") == "knn" else 0,
+        f"by_intent.{_field_name(primary_intent(email_data.get('classification')))}": 1,
+    }
+    created_at = email_data.get("created_at")
+    day = created_at.strftime("%Y-%m-%d") if created_at else "unknown"
+    return totals, DAY_PREFIX + day, {"emails": 1, "attachments": attachments}
+
+
+class EmailStats:
+    """
+    Email counters maintained incrementally in a summary collection.
+
+    Every stored email bumps a single totals document (emails, attachments,
+    reused and kNN classifications, emails per primary intent) and one document per
+    day, so reading the statistics costs a couple of small lookups however
+    large the emails collection grows.
+    """
+
+    def __init__(self, emails, summary):
+        self.emails = emails
+        self.summary_collection = summary
+
+    async def record(self, email_data):
+        """Adds a newly stored email to the counters."""
+        totals, day_id, day = email_counters(email_data)
+        await asyncio.gather(
+            self.summary_collection.update_one({"_id": TOTALS_ID}, {"$inc": totals}, upsert=True),
+            self.summary_collection.update_one({"_id": day_id}, {"$inc": day}, upsert=True),
+        )
+
+    async def rebuild(self, batch_size=1000):
+        """
+        Recomputes every counter from the emails collection.
+
+        Counter documents are replaced one by one rather than deleted and
+        inserted again, so readers never see the counters missing.
+        """
+        totals, days = {}, {}
+        cursor = self.emails.find(
+            {},
+            {
+                "attachments": 1,
+                "classification.request_intents": 1,
+                "classification_reused_from": 1,
+                "classification_source": 1,
+                "created_at": 1,
+            },
+            batch_size=batch_size,
+        )
+        async for document in cursor:
+            email_totals, day_id, day = email_counters(document)
+            day_totals = days.setdefault(day_id, {})
+            for counters, increments in ((totals, email_totals), (day_totals, day)):
+                for key, value in increments.items():
+                    counters[key] = counters.get(key, 0) + value
+
+        documents = [{"_id": day_id, **day} for day_id, day in days.items()]
+        if totals:
+            by_intent = {
+                key.split(".", 1)[1]: totals.pop(key)
+                for key in list(totals)
+                if key.startswith("by_intent.")
+            }
+            documents.append({"_id": TOTALS_ID, **totals, "by_intent": by_intent})
+        await asyncio.gather(
+            *(
+                self.summary_collection.replace_one({"_id": document["_id"]}, document, upsert=True)
+                for document in documents
+            )
+        )
+        # Days whose emails have all been deleted
+        await self.summary_collection.delete_many(
+            {"_id": {"$regex": f"^{DAY_PREFIX}", "$nin": list(days)}}
+        )
+        if not totals:
+            await self.summary_collection.delete_many({"_id": TOTALS_ID})
+        print(f"Email stats rebuilt from {totals.get('emails', 0)} emails")
+
+    async def ensure(self):
+        """
+        Builds the counters from existing emails the first time the app runs.
+
+        Runs before the app takes traffic, so no email is counted twice. When
+        several processes start at once, the one that inserts the rebuild
+        marker builds the counters and the others leave them alone.
+        """
+        if await self.summary_collection.find_one({"_id": TOTALS_ID}, {"_id": 1}) is not None:
+            return
+        now = datetime.now()
+        try:
+            # Inserts the marker, or takes over a stale one; a live marker
+            # makes the upsert's insert fail on the duplicate _id
+            await self.summary_collection.update_one(
+                {"_id": REBUILD_ID, "started_at": {"$lt": now - timedelta(seconds=STATS_REBUILD_TIMEOUT)}},
+                {"$set": {"started_at": now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            print("Email stats are being rebuilt by another process")
+            return
+        try:
+            await self.rebuild()
+        finally:
+            await self.summary_collection.delete_one({"_id": REBUILD_ID})
+
+    async def summary(self, days=STATS_RECENT_DAYS):
+        """
+        Returns the email counters.
+
+        Returns:
+            dict: Totals, emails per primary intent and per-day counts for the
+            most recent ``days`` days; emails without a date only count in the totals
+        """
+        totals, recent = await asyncio.gather(
+            self.summary_collection.find_one({"_id": TOTALS_ID}),
+            # "day:unknown" would sort before every date
+            self.summary_collection.find({"_id": {"$regex": f"^{DAY_PREFIX}[0-9]"}})
+            .sort("_id", -1)
+            .limit(days)
+            .to_list(length=days),
+        )
+        totals = totals or {}
+        return {
+            "total_emails": totals.get("emails", 0),
+            "attachments": totals.get("attachments", 0),
+            "emails_with_attachments": totals.get("emails_with_attachments", 0),
+            "classifications_reused": totals.get("classifications_reused", 0),
+            "classifications_knn": totals.get("classifications_knn", 0),
+            "by_intent": totals.get("by_intent", {}),
+            "by_day": [
+                {
+                    "date": day["_id"][len(DAY_PREFIX):],
+                    "emails": day.get("emails", 0),
+                    "attachments": day.get("attachments", 0),
+                }
+                for day in recent
+            ],
+        }
+
+
+class StatsCache:
+    """
+    Serves expensive statistics from memory for STATS_CACHE_TTL seconds.
+
+    Concurrent requests for an expired entry share one computation.
+    """
+
+    def __init__(self, ttl=STATS_CACHE_TTL, maxsize=64):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def get(self, key, compute):
+        """
+        Returns the cached value for a key, computing it on a miss.
+
+        Args:
+            key (str): The cache key
+            compute (callable): Async callable returning the value
+        """
+        if key in self.cache:
+            self.stats["hits"] += 1
+            return self.cache[key]
+        if key in self.inflight:
+            self.stats["hits"] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(compute())
+        self.inflight[key] = task
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            self.inflight.pop(key, None)
+        self.cache[key] = value
+        return value
+
+    def get_stats(self):
+        return {**self.stats, "entries": len(self.cache)}
@@ -0,0 +1,152 @@
+import math
+import os
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # token counts are estimated from the text length without it
+    tiktoken = None
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+# Tokens of email content sent to the classifier; the body is served first
+CLASSIFY_TOKEN_BUDGET = int(os.getenv("CLASSIFY_TOKEN_BUDGET", "6000"))
+CLASSIFY_BODY_TOKENS = int(os.getenv("CLASSIFY_BODY_TOKENS", "3000"))
+# Long emails are embedded in chunks of this many tokens (the model accepts 8191)
+EMBEDDING_CHUNK_TOKENS = int(os.getenv("EMBEDDING_CHUNK_TOKENS", "2000"))
+# Content beyond this many chunks is not embedded
+EMBEDDING_MAX_CHUNKS = int(os.getenv("EMBEDDING_MAX_CHUNKS", "8"))
+
+# Average characters per token of English text, used without tiktoken
+CHARS_PER_TOKEN = 4
+# No token is longer than this many characters in practice, so text past
+# limit * MAX_CHARS_PER_TOKEN can be dropped before it is ever tokenised
+MAX_CHARS_PER_TOKEN = 16
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    return tiktoken.get_encoding(TOKEN_ENCODING) if tiktoken is not None else None
+
+
+def _encode(text):
+    return _encoding().encode(text, disallowed_special=())
+
+
+def count_tokens(text):
+    """Returns the number of tokens in a text (estimated without tiktoken)."""
+    if _encoding() is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(_encode(text))
+
+
+def truncate_tokens(text, limit):
+    """
+    Returns the start of a text that fits in ``limit`` tokens.
+
+    Only the first ``limit * MAX_CHARS_PER_TOKEN`` characters are tokenised,
+    so the cost doesn't grow with the length of the text.
+    """
+    if limit <= 0:
+        return ""
+    head = text[: limit * MAX_CHARS_PER_TOKEN]
+    if _encoding() is None:
+        return head[: limit * CHARS_PER_TOKEN]
+    tokens = _encode(head)
+    if len(tokens) <= limit:
+        return head
+    return _encoding().decode(tokens[:limit])
+
+
+def split_tokens(text, size=EMBEDDING_CHUNK_TOKENS, max_chunks=EMBEDDING_MAX_CHUNKS):
+    """
+    Splits a text into chunks of at most ``size`` tokens.
+
+    Args:
+        text (str): The text to split
+        size (int): Tokens per chunk
+        max_chunks (int): Chunks to return at most; the rest of the text is dropped
+
+    Returns:
+        list: The chunks, in order; a text that fits in one chunk is returned as is
+    """
+    head = text[: size * max_chunks * MAX_CHARS_PER_TOKEN]
+    if _encoding() is None:
+        step = size * CHARS_PER_TOKEN
+        chunks = [head[start : start + step] for start in range(0, len(head), step)]
+        return chunks[:max_chunks] or [text]
+    tokens = _encode(head)
+    if len(tokens) <= size and len(head) == len(text):
+        return [text]
+    return [
+        _encoding().decode(tokens[start : start + size])
+        for start in range(0, min(len(tokens), size * max_chunks), size)
+    ]
+
+
+def allocate(counts, budget):
+    """
+    Shares a token budget fairly: small sections get all they need and the rest
+    is split evenly among the larger ones.
+
+    Args:
+        counts (list): Tokens each section needs
+        budget (int): Tokens available
+
+    Returns:
+        list: Tokens granted to each section, in order
+    """
+    granted = [0] * len(counts)
+    remaining = max(budget, 0)
+    pending = sorted(range(len(counts)), key=lambda index: counts[index])
+    while pending:
+        share = remaining // len(pending)
+        index = pending.pop(0)
+        granted[index] = min(counts[index], share)
+        remaining -= granted[index]
+    return granted
+
+
+def format_sections(sections):
+    """Joins the body and attachment sections into the email text."""
+    text = sections[0][1]
+    for heading, section_text in sections[1:]:
+        text += f"\n\n{heading}" + (f"\n{section_text}" if section_text else "")
+    return text
+
+
+def budget_sections(sections, budget=CLASSIFY_TOKEN_BUDGET, body_tokens=CLASSIFY_BODY_TOKENS):
+    """
+    Fits an email into a token budget for classification.
+
+    The body gets up to ``body_tokens`` first, attachments share what is left
+    (see allocate) and any budget they don't use goes back to the body. Cut
+    sections end with a note saying how much was left out.
+
+    Args:
+        sections (list): (heading, text) tuples; the first is the body, whose
+            heading is ignored, the others attachments
+        budget (int): Tokens available for the whole email
+        body_tokens (int): Tokens reserved for the body
+
+    Returns:
+        tuple: (text to classify, tokens it uses)
+    """
+    # Only the part of each section that could possibly fit is tokenised
+    heads = [text[: budget * MAX_CHARS_PER_TOKEN] for _, text in sections]
+    counts = [count_tokens(head) for head in heads]
+    headings = sum(count_tokens(heading) + 2 for heading, _ in sections[1:])
+
+    body = min(counts[0], body_tokens, budget)
+    granted = allocate(counts[1:], budget - headings - body)
+    granted = [max(min(counts[0], budget - headings - sum(granted)), 0)] + granted
+
+    budgeted = []
+    for (heading, text), head, count, tokens in zip(sections, heads, counts, granted):
+        if tokens >= count and len(head) == len(text):
+            budgeted.append((heading, text))
+            continue
+        kept = truncate_tokens(head, tokens)
+        note = f"[... {len(text) - len(kept)} more characters not shown]"
+        budgeted.append((heading, f"{kept}\n{note}" if kept else note))
+    text = format_sections(budgeted)
+    return text, count_tokens(text)
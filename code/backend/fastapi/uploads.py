@@ -0,0 +1,158 @@
+import mmap
+import os
+import tempfile
+
+# Largest single uploaded file, and all files of one request together
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_REQUEST_UPLOAD_BYTES = int(os.getenv("MAX_REQUEST_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+# All files of one /process_emails/batch request together, and the largest
+# email inside an archive (zip members are checked before they are inflated)
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(500 * 1024 * 1024)))
+MAX_BATCH_EMAIL_BYTES = int(os.getenv("MAX_BATCH_EMAIL_BYTES", str(MAX_UPLOAD_BYTES)))
+# Uploads larger than this are kept in an anonymous temporary file instead of memory
+UPLOAD_SPILL_BYTES = int(os.getenv("UPLOAD_SPILL_BYTES", str(8 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES or the request exceeds its total."""
+
+
+class SpooledContent:
+    """
+    The content of one upload, in memory or spilled to an anonymous temporary file.
+
+    ``view()`` exposes it as a memoryview without copying: over the in-memory
+    buffer, or over a read-only memory map of the spill file, so large uploads
+    are paged in by the OS instead of held on the heap. The spill file has no
+    name, so nothing is left behind on disk and concurrent requests can't
+    collide.
+    """
+
+    def __init__(self, spill_bytes=UPLOAD_SPILL_BYTES):
+        self.spill_bytes = spill_bytes
+        self.buffer = bytearray()
+        self.file = None
+        self.map = None
+        self.size = 0
+        self.views = []
+        self.owns_file = True
+
+    @classmethod
+    def of_file(cls, file, size):
+        """Wraps a file already holding the whole content, without copying it; the caller closes the file."""
+        content = cls()
+        content.file = file
+        content.size = size
+        content.owns_file = False
+        return content
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.file is None and self.size > self.spill_bytes:
+            self.file = tempfile.TemporaryFile(prefix="upload-")
+            self.file.write(self.buffer)
+            self.buffer = bytearray()
+        if self.file is not None:
+            self.file.write(chunk)
+        else:
+            self.buffer += chunk
+
+    def view(self):
+        """Returns the content as a read-only memoryview."""
+        if self.file is None:
+            view = memoryview(self.buffer).toreadonly()
+        else:
+            if self.map is None:
+                self.file.flush()
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self.map)
+        self.views.append(view)
+        return view
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def close(self):
+        try:
+            for view in self.views:
+                view.release()
+            if self.map is not None:
+                self.map.close()
+        except BufferError:
+            # A timed-out extraction thread still holds part of the content;
+            # it is freed once that thread lets go
+            pass
+        self.views = []
+        self.map = None
+        if self.file is not None and self.owns_file:
+            self.file.close()
+        self.file = None
+        self.buffer = bytearray()
+
+
+async def read_upload(upload, limit=MAX_UPLOAD_BYTES, budget=None, spill_bytes=UPLOAD_SPILL_BYTES):
+    """
+    Reads an UploadFile chunk by chunk, enforcing the size caps as it goes.
+
+    A file larger than ``spill_bytes`` that the multipart parser already
+    spooled to disk is mapped in place instead.
+
+    Args:
+        upload: The FastAPI UploadFile
+        limit (int): Largest allowed size of this file
+        budget (UploadBudget, optional): Shared cap for all files of the request
+        spill_bytes (int): Size above which the content is spilled to disk
+
+    Returns:
+        SpooledContent: The content; the caller must close it
+
+    Raises:
+        UploadTooLarge: As soon as a cap is exceeded, without reading the rest
+    """
+    name = upload.filename or "upload"
+    # Fail before reading anything when the size is already known
+    if upload.size is not None and upload.size > limit:
+        raise UploadTooLarge(f"{name} is larger than {limit} bytes")
+
+    if upload.size is not None and upload.size > spill_bytes:
+        try:
+            # The multipart parser has already spooled the file to disk
+            # (and the request was size-checked while it arrived); map that
+            # file instead of copying it into a second one
+            upload.file.fileno()
+        except OSError:
+            pass
+        else:
+            if budget is not None:
+                budget.consume(upload.size)
+            return SpooledContent.of_file(upload.file, upload.size)
+
+    content = SpooledContent(spill_bytes)
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                return content
+            if content.size + len(chunk) > limit:
+                raise UploadTooLarge(f"{name} is larger than {limit} bytes")
+            if budget is not None:
+                budget.consume(len(chunk))
+            content.write(chunk)
+    except BaseException:
+        content.close()
+        raise
+
+
+class UploadBudget:
+    """Caps the combined size of every file uploaded with one request."""
+
+    def __init__(self, limit=MAX_REQUEST_UPLOAD_BYTES):
+        self.limit = limit
+        self.used = 0
+
+    def consume(self, size):
+        self.used += size
+        if self.used > self.limit:
+            raise UploadTooLarge(f"Uploads are larger than {self.limit} bytes in total")
@@ -0,0 +1,168 @@
+import pickle
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class WorkerCrashed(Exception):
+    """Raised for a task whose worker process died, or was killed, while running it."""
+
+
+def portable_error(error):
+    """
+    Returns an exception that survives the trip back from a worker process.
+
+    Exceptions whose constructor takes other arguments than their message
+    (e.g. pytesseract's TesseractNotFoundError) can't be unpickled; they are
+    passed on as a RuntimeError carrying their repr.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(repr(error))
+
+
+def _worker_main(connection):
+    """Runs tasks received on a pipe until it is closed."""
+    while True:
+        try:
+            function, args = connection.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            reply = ("ok", function(*args))
+        except BaseException as e:
+            reply = ("error", portable_error(e))
+        try:
+            connection.send(reply)
+        except Exception as e:
+            # The result itself couldn't be pickled
+            connection.send(("error", RuntimeError(f"Could not return the result: {e!r}")))
+
+
+class Task:
+    """A submitted call; ``future`` holds its outcome and ``kill`` stops it."""
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.future = Future()
+        self.process = None
+        self.killed = False
+
+    def kill(self):
+        """Cancels the task, terminating its worker process if it is already running."""
+        self.killed = True
+        if not self.future.cancel() and self.process is not None:
+            self.process.terminate()
+
+
+class WorkerPool:
+    """
+    A pool of long-lived worker processes, each fed through its own pipe.
+
+    Unlike ProcessPoolExecutor, where one dead worker breaks the whole pool
+    and fails every task in it, a worker here can be killed (e.g. on a
+    timeout) or crash without affecting the tasks of the other workers; it is
+    replaced before its next task.
+    """
+
+    def __init__(self, max_workers, mp_context):
+        self.max_workers = max(1, max_workers)
+        self.mp_context = mp_context
+        self.tasks = queue.Queue()
+        self.threads = []
+        self.running = set()
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def submit(self, function, *args):
+        """
+        Queues a call of a module-level function in a worker process.
+
+        Returns:
+            Task: The task, whose ``future`` resolves to the result
+        """
+        task = Task(function, args)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The worker pool is shut down")
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._serve, name="extract-worker", daemon=True)
+                self.threads.append(thread)
+                thread.start()
+        self.tasks.put(task)
+        return task
+
+    def _spawn(self):
+        parent, child = self.mp_context.Pipe()
+        process = self.mp_context.Process(target=_worker_main, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+
+    def _stop(self, process, connection):
+        connection.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    def _serve(self):
+        """Feeds tasks to one worker process, replacing it whenever it dies."""
+        process = connection = None
+        try:
+            while True:
+                task = self.tasks.get()
+                if task is None:
+                    return
+                if not task.future.set_running_or_notify_cancel():
+                    continue
+                if process is None:
+                    process, connection = self._spawn()
+                task.process = process
+                self.running.add(task)
+                if task.killed:
+                    # Killed between being taken and being given its process
+                    process.terminate()
+                try:
+                    connection.send((task.function, task.args))
+                    status, value = connection.recv()
+                except (EOFError, OSError):
+                    self.running.discard(task)
+                    self._stop(process, connection)
+                    process = connection = None
+                    task.future.set_exception(
+                        WorkerCrashed("Worker was stopped" if task.killed else "Worker process died")
+                    )
+                    continue
+                except Exception as e:
+                    # The task's arguments couldn't be pickled
+                    self.running.discard(task)
+                    task.future.set_exception(e)
+                    continue
+                self.running.discard(task)
+                if status == "ok":
+                    task.future.set_result(value)
+                else:
+                    task.future.set_exception(value)
+        finally:
+            if process is not None:
+                self._stop(process, connection)
+
+    def shutdown(self):
+        """Stops every worker; queued tasks are cancelled, running ones killed."""
+        with self.lock:
+            self.closed = True
+            threads = list(self.threads)
+        while True:
+            try:
+                task = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            if task is not None:
+                task.future.cancel()
+        for task in list(self.running):
+            task.kill()
+        for _ in threads:
+            self.tasks.put(None)
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# Make the FastAPI backend modules importable
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "fastapi")
+)
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("EXTRACTION_CACHE_BACKEND", "none")
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """Points the app at an in-memory stand-in for MongoDB."""
+    import main
+    from jobs import JobQueue
+    from stats import EmailStats, StatsCache
+
+    mongo_client = AsyncMongoMockClient()
+    database = mongo_client["dashboard"]
+    monkeypatch.setattr(main, "client_db", mongo_client)
+    monkeypatch.setattr(main, "db", database)
+    monkeypatch.setattr(main, "collection", database["emails"])
+    monkeypatch.setattr(main, "email_stats", EmailStats(database["emails"], database["email_stats"]))
+    monkeypatch.setattr(main, "stats_cache", StatsCache())
+    monkeypatch.setattr(main, "job_queue", JobQueue(database["jobs"], database["job_files"]))
+    return database
+
+
+@pytest.fixture
+def seed(mongo):
+    """Inserts ``count`` emails a minute apart, and one other collection."""
+
+    def insert(count=3):
+        now = datetime(2025, 1, 1)
+        documents = [
+            {"email": f"email {i}", "created_at": now + timedelta(minutes=i), "embedding": [0.1, 0.2]}
+            for i in range(count)
+        ]
+
+        async def run():
+            await mongo["emails"].insert_many(documents)
+            await mongo["configs"].insert_one({"name": "x"})
+
+        asyncio.run(run())
+
+    return insert
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import assistant_runs
+from assistant_runs import RunError, run_assistant
+
+
+class FakeRuns:
+    """Stands in for client.beta.threads.runs, replaying a list of statuses."""
+
+    def __init__(self, statuses, stream_error=None):
+        self.statuses = list(statuses)
+        self.stream_error = stream_error
+        self.retrieve_calls = 0
+        self.cancelled = []
+
+    def _run(self):
+        return SimpleNamespace(id="run_1", status=self.statuses.pop(0), last_error=None)
+
+    def stream(self, thread_id, assistant_id):
+        raise self.stream_error or RuntimeError("streaming disabled in test")
+
+    async def create(self, thread_id, assistant_id):
+        return self._run()
+
+    async def retrieve(self, thread_id, run_id):
+        self.retrieve_calls += 1
+        return self._run()
+
+    async def cancel(self, thread_id, run_id):
+        self.cancelled.append(run_id)
+
+
+def make_client(runs):
+    return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs)))
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(assistant_runs, "RUN_POLL_INITIAL_DELAY", 0.001)
+    monkeypatch.setattr(assistant_runs, "RUN_POLL_MAX_DELAY", 0.004)
+
+
+def test_polls_until_completed_and_counts_calls():
+    runs = FakeRuns(["queued", "in_progress", "in_progress", "completed"])
+    stats = {}
+    run = asyncio.run(run_assistant(make_client(runs), "thread_1", "asst_1", stats=stats))
+    assert run.status == "completed"
+    assert stats["run_polls"] == runs.retrieve_calls == 3
+
+
+@pytest.mark.parametrize("status", ["failed", "cancelled", "expired", "incomplete"])
+def test_terminal_failures_raise(status):
+    runs = FakeRuns(["queued", status])
+    with pytest.raises(RunError) as excinfo:
+        asyncio.run(run_assistant(make_client(runs), "thread_1", "asst_1"))
+    assert excinfo.value.status == status
+
+
+def test_requires_action_cancels_run():
+    runs = FakeRuns(["in_progress", "requires_action"])
+    with pytest.raises(RunError) as excinfo:
+        asyncio.run(run_assistant(make_client(runs), "thread_1", "asst_1"))
+    assert excinfo.value.status == "requires_action"
+    assert runs.cancelled == ["run_1"]
+
+
+def test_deadline_cancels_run(monkeypatch):
+    monkeypatch.setattr(assistant_runs, "RUN_TIMEOUT", 0.01)
+    runs = FakeRuns(["in_progress"] * 1000)
+    with pytest.raises(RunError) as excinfo:
+        asyncio.run(run_assistant(make_client(runs), "thread_1", "asst_1"))
+    assert excinfo.value.status == "timeout"
+    assert runs.cancelled == ["run_1"]
+
+
+def test_backoff_grows_and_is_capped():
+    delay = assistant_runs.RUN_POLL_INITIAL_DELAY
+    for _ in range(10):
+        sleep_for, next_delay = assistant_runs.next_poll_delay(delay)
+        assert delay / 2 <= sleep_for <= delay
+        assert next_delay <= assistant_runs.RUN_POLL_MAX_DELAY
+        delay = next_delay
+    assert delay == assistant_runs.RUN_POLL_MAX_DELAY
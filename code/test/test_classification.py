@@ -0,0 +1,87 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from classification import (
+    CLASSIFICATION_SCHEMA,
+    ClassificationError,
+    ReferenceExamples,
+    classify_with_chat,
+    parse_json_reply,
+    parse_reference_examples,
+)
+
+REPLY = {"request_intents": [{"intent": "Payoff", "reasoning": "asks", "confidence_score": 0.9}], "sub_requests": []}
+
+
+class KeywordEmbeddings:
+    """Embeds texts by the topics they mention."""
+
+    TOPICS = ["payoff", "escrow", "insurance"]
+
+    async def embed(self, text):
+        return [float(topic in text.lower()) + 0.01 for topic in self.TOPICS]
+
+    async def embed_many(self, texts):
+        return [await self.embed(text) for text in texts]
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.requests = []
+
+    async def create(self, **request):
+        self.requests.append(request)
+        usage = SimpleNamespace(
+            prompt_tokens=1500, prompt_tokens_details=SimpleNamespace(cached_tokens=1024)
+        )
+        message = SimpleNamespace(content=json.dumps(REPLY), refusal=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def test_parse_json_reply_handles_fences_and_errors():
+    assert parse_json_reply('```json\n{"a": 1}\n```') == {"a": 1}
+    assert parse_json_reply('Here you go:\n```\n{"a": 2}\n```') == {"a": 2}
+    assert parse_json_reply('{"a": 3}') == {"a": 3}
+    with pytest.raises(ClassificationError):
+        parse_json_reply("not json")
+
+
+def test_reference_examples_are_parsed_by_format():
+    csv_text = "email,intent\nSend payoff,Payoff\nEscrow shortage,Escrow\n"
+    assert parse_reference_examples("data.csv", csv_text) == [
+        "email: Send payoff\nintent: Payoff",
+        "email: Escrow shortage\nintent: Escrow",
+    ]
+    jsonl = '{"email": "Send payoff"}\n\n{"email": "Escrow shortage"}\n'
+    assert parse_reference_examples("data.jsonl", jsonl) == ["email: Send payoff", "email: Escrow shortage"]
+    assert parse_reference_examples("data.txt", "First\nexample\n\n\nSecond") == ["First\nexample", "Second"]
+
+
+def test_chat_classifier_makes_one_structured_call(tmp_path):
+    references = ReferenceExamples(KeywordEmbeddings(), path=str(tmp_path / "examples.jsonl"), static_count=1)
+    references.replace(["Static example", "Escrow example", "Payoff example", "Insurance example"])
+    completions = FakeCompletions()
+    client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    metrics = {}
+    result = asyncio.run(classify_with_chat(client, references, "Please send my payoff quote", metrics))
+    asyncio.run(classify_with_chat(client, references, "Is my insurance paid?", {}))
+
+    assert result == REPLY
+    assert metrics == {"prompt_tokens": 1500, "cached_prompt_tokens": 1024}
+    first, second = completions.requests
+    assert first["response_format"]["json_schema"]["schema"] == CLASSIFICATION_SCHEMA
+    # The system prompt is the same for every email, so it can be cached
+    assert first["messages"][0] == second["messages"][0]
+    assert "Static example" in first["messages"][0]["content"]
+    # Retrieved examples come first in the per-email message, best match first
+    assert first["messages"][1]["content"].startswith("Similar reference example 1:\nPayoff example")
+    assert second["messages"][1]["content"].startswith("Similar reference example 1:\nInsurance example")
+
+    # Saved examples are loaded again on the next start
+    reloaded = ReferenceExamples(KeywordEmbeddings(), path=str(tmp_path / "examples.jsonl"))
+    reloaded.load()
+    assert reloaded.examples == references.examples
@@ -0,0 +1,53 @@
+import asyncio
+from datetime import datetime
+
+import main
+from database import count_collections, describe_databases, fetch_documents, fetch_page
+
+
+def test_fetch_documents_sorts_skips_and_limits(mongo, seed):
+    seed(5)
+    documents = asyncio.run(
+        fetch_documents(
+            mongo["emails"], projection={"_id": False}, sort=[("created_at", -1)], skip=1, limit=2
+        )
+    )
+    assert [d["email"] for d in documents] == ["email 3", "email 2"]
+    assert "_id" not in documents[0]
+
+
+def test_fetch_page_walks_every_document_once(mongo, seed):
+    seed(5)
+    # Equal timestamps are ordered by _id
+    asyncio.run(
+        mongo["emails"].insert_many(
+            [{"email": f"tie {i}", "created_at": datetime(2025, 1, 1, 0, 2)} for i in range(3)]
+        )
+    )
+
+    async def walk():
+        seen, position = [], None
+        while True:
+            documents, position = await fetch_page(
+                mongo["emails"], projection={"email": True, "_id": False}, after=position, limit=3
+            )
+            seen.extend(documents)
+            if position is None:
+                return seen
+
+    documents = asyncio.run(walk())
+    assert len(documents) == 8
+    assert len({d["email"] for d in documents}) == 8
+    assert documents[0]["email"] == "email 4"
+    # Sort keys fetched for the position are not leaked into the page
+    assert set(documents[0]) == {"email"}
+
+
+def test_count_and_describe(mongo, seed):
+    seed()
+    counts = {c["name"]: c["document_count"] for c in asyncio.run(count_collections(mongo))}
+    assert counts == {"emails": 3, "configs": 1}
+
+    databases = asyncio.run(describe_databases(main.client_db))
+    assert databases[0]["name"] == "dashboard"
+    assert sorted(databases[0]["collection_names"]) == ["configs", "emails"]
@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+import pytest
+from bson.binary import Binary, BinaryVectorDtype
+from mongomock_motor import AsyncMongoMockClient
+
+from embedding_storage import decode_embedding, encode_embedding, migrate_embeddings, storage_format
+from similarity import LocalVectorIndex
+
+EMBEDDING = [0.12, -0.5, 0.33, 0.0, 0.07]
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def test_formats_round_trip():
+    float32 = encode_embedding(EMBEDDING, "float32")
+    assert storage_format(float32) == "float32"
+    # Interoperates with the driver's own vector BinData
+    assert float32 == Binary.from_vector(EMBEDDING, BinaryVectorDtype.FLOAT32)
+    assert decode_embedding(float32) == pytest.approx(EMBEDDING)
+
+    int8 = encode_embedding(EMBEDDING, "int8")
+    assert storage_format(int8) == "int8" and len(int8) == 2 + len(EMBEDDING)
+    assert cosine(decode_embedding(int8), EMBEDDING) == pytest.approx(1, abs=1e-3)
+
+    assert storage_format(encode_embedding(EMBEDDING, "array")) == "array"
+    with pytest.raises(ValueError):
+        decode_embedding(Binary(b"\x00\x01", 0))
+
+
+def test_migration_converts_only_other_formats():
+    emails = AsyncMongoMockClient()["dashboard"]["emails"]
+
+    async def run():
+        await emails.insert_many(
+            [
+                {"email": "a", "embedding": EMBEDDING},
+                {"email": "b", "embedding": encode_embedding(EMBEDDING, "int8")},
+                {"email": "c"},
+            ]
+        )
+        dry_run = await migrate_embeddings(emails, "int8", batch_size=1, dry_run=True)
+        report = await migrate_embeddings(emails, "int8", batch_size=1)
+        rerun = await migrate_embeddings(emails, "int8")
+        stored = await emails.find_one({"email": "a"})
+        return dry_run, report, rerun, stored
+
+    dry_run, report, rerun, stored = asyncio.run(run())
+    assert dry_run["converted"] == report["converted"] == 1
+    assert report["scanned"] == 2 and report["bytes_after"] < report["bytes_before"]
+    assert rerun["converted"] == 0
+    assert storage_format(stored["embedding"]) == "int8"
+
+
+def test_local_index_reads_binary_embeddings(tmp_path):
+    emails = AsyncMongoMockClient()["dashboard"]["emails"]
+
+    async def run():
+        await emails.insert_many(
+            [
+                {"email": "float", "embedding": encode_embedding([1, 0, 0], "float32")},
+                {"email": "quantized", "embedding": encode_embedding([0, 0.5, 0], "int8")},
+            ]
+        )
+        index = LocalVectorIndex(emails, str(tmp_path))
+        return await index.search([0, 1, 0], limit=1)
+
+    results = asyncio.run(run())
+    assert results[0]["email"] == "quantized"
+    assert results[0]["score"] == pytest.approx(1.0)
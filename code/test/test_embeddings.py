@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from embeddings import EmbeddingService
+from rate_governor import current_lane, openai_lane
+
+
+class FakeEmbeddings:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.lanes = []
+        self.fail = fail
+
+    async def create(self, input, model):
+        self.calls.append(list(input))
+        self.lanes.append(current_lane())
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("rate limited")
+        return SimpleNamespace(
+            data=[SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        )
+
+
+def make_service(**kwargs):
+    embeddings = FakeEmbeddings(**{k: kwargs.pop(k) for k in ["fail"] if k in kwargs})
+    service = EmbeddingService(SimpleNamespace(embeddings=embeddings), batch_window=0.01, **kwargs)
+    return service, embeddings
+
+
+def test_concurrent_requests_share_one_call():
+    service, embeddings = make_service()
+
+    async def run():
+        return await asyncio.gather(*(service.embed("x" * n) for n in range(1, 6)))
+
+    assert asyncio.run(run()) == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert len(embeddings.calls) == 1
+
+
+def test_repeated_text_is_cached_and_deduplicated():
+    service, embeddings = make_service()
+
+    async def run():
+        await asyncio.gather(service.embed("same"), service.embed("same"))
+        return await service.embed("same")
+
+    assert asyncio.run(run()) == [4.0]
+    assert embeddings.calls == [["same"]]
+    stats = service.get_stats()
+    assert stats["coalesced"] == 1 and stats["cache_hits"] == 1
+
+
+def test_cache_is_bounded_by_bytes():
+    # Room for two one-dimension float32 vectors
+    service, embeddings = make_service(cache_bytes=8)
+
+    async def run():
+        await service.embed_many(["a", "bb", "ccc"])
+        return await service.embed("ccc"), await service.embed("a")
+
+    assert asyncio.run(run()) == ([3.0], [1.0])
+    # "a" was evicted, "ccc" came from the cache
+    assert embeddings.calls == [["a", "bb", "ccc"], ["a"]]
+    stats = service.get_stats()
+    assert stats["cache_entries"] == 2 and stats["cache_bytes"] == 8
+
+
+def test_batches_are_split_at_max_batch():
+    service, embeddings = make_service(max_batch=2)
+
+    async def run():
+        return await service.embed_many(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert asyncio.run(run()) == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert [len(call) for call in embeddings.calls] == [2, 2, 1]
+
+
+def test_api_errors_reach_every_waiter():
+    service, _ = make_service(fail=True)
+
+    async def run():
+        return await asyncio.gather(service.embed("a"), service.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_shared_batch_is_sent_in_the_most_urgent_lane():
+    service, embeddings = make_service()
+
+    async def embed(text, lane):
+        with openai_lane(lane):
+            return await service.embed(text)
+
+    async def run():
+        await embed("batch only", "batch")
+        await asyncio.gather(embed("queued email", "batch"), embed("upload", "interactive"))
+
+    asyncio.run(run())
+    assert embeddings.lanes == ["batch", "interactive"]
@@ -0,0 +1,148 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+from fpdf import FPDF
+from PIL import Image
+
+import extraction
+from extraction import (
+    ExtractionCrashed,
+    ExtractionTimeout,
+    UnsupportedFileType,
+    extract_many,
+    extract_text_async,
+)
+
+
+@pytest.fixture(autouse=True)
+def thread_pool(monkeypatch):
+    monkeypatch.setattr(extraction, "EXTRACTION_POOL", "thread")
+    yield
+    extraction.shutdown_pool()
+
+
+def test_extracts_eml_headers_and_body():
+    eml = b"From: a@b.com\nTo: c@d.com\nSubject: Payoff\n\nPlease send my payoff quote.\n"
+    text = asyncio.run(extract_text_async("mail.eml", eml))
+    assert "Subject: Payoff" in text
+    assert "Please send my payoff quote." in text
+
+
+def test_extract_many_keeps_order_and_isolates_failures():
+    files = [("a.txt", b"first"), ("b.xyz", b"??"), ("c.txt", b"third")]
+    results = asyncio.run(extract_many(files))
+    assert results[0] == "first"
+    assert isinstance(results[1], UnsupportedFileType)
+    assert results[2] == "third"
+
+
+def test_slow_file_times_out(monkeypatch):
+    def slow_extract(filename, content):
+        time.sleep(0.5)
+        return "late"
+
+    monkeypatch.setattr(extraction, "extract_text", slow_extract)
+    with pytest.raises(ExtractionTimeout):
+        asyncio.run(extract_text_async("slow.txt", b"", timeout=0.05))
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    monkeypatch.setattr(extraction, "EXTRACTION_POOL", "process")
+    monkeypatch.setattr(extraction, "EXTRACTION_WORKERS", 2)
+    extraction.shutdown_pool()
+
+
+def test_timeout_only_stops_its_own_worker(process_pool):
+    async def run():
+        # time.sleep stands in for a hung extractor
+        hung = extraction._extract_on_pool("hung.pdf", b"", 0.5, time.sleep, 30)
+        other = extraction._extract_on_pool("other.pdf", b"", 10, time.sleep, 1.5)
+        return await asyncio.gather(hung, other, return_exceptions=True)
+
+    started = time.perf_counter()
+    hung, other = asyncio.run(run())
+    assert isinstance(hung, ExtractionTimeout)
+    # The other file's worker was left alone
+    assert other is None
+    assert time.perf_counter() - started < 10
+    assert asyncio.run(extract_text_async("after.txt", b"still working")) == "still working"
+
+
+def test_crashed_worker_is_replaced(process_pool):
+    async def run():
+        crash = extraction._extract_on_pool("crash.pdf", b"", 10, os._exit, 1)
+        text = extract_text_async("mail.txt", b"unaffected")
+        return await asyncio.gather(crash, text, return_exceptions=True)
+
+    crash, text = asyncio.run(run())
+    assert isinstance(crash, ExtractionCrashed)
+    assert text == "unaffected"
+
+
+@pytest.mark.skipif(shutil.which("tesseract") is not None, reason="needs tesseract to be missing")
+def test_unpicklable_worker_errors_are_reported(process_pool):
+    image = io.BytesIO()
+    Image.new("RGB", (50, 50), "white").save(image, format="PNG")
+    # pytesseract's TesseractNotFoundError can't be unpickled as it is
+    results = asyncio.run(extract_many([("scan.png", image.getvalue()), ("mail.txt", b"fine")]))
+    assert isinstance(results[0], RuntimeError)
+    assert "Tesseract" in str(results[0])
+    assert results[1] == "fine"
+
+
+def make_pdf(pages):
+    """Builds a PDF with one page per entry: text, or None for a scanned image page."""
+    pdf = FPDF()
+    with tempfile.TemporaryDirectory() as directory:
+        scan = os.path.join(directory, "scan.jpg")
+        Image.new("RGB", (200, 100), "white").save(scan)
+        for text in pages:
+            pdf.add_page()
+            if text is None:
+                pdf.image(scan, 10, 10, 100)
+            else:
+                pdf.set_font("Arial", size=12)
+                pdf.cell(0, 10, text)
+        return pdf.output(dest="S").encode("latin-1")
+
+
+def test_pdf_pages_are_extracted_in_parallel_with_ocr_for_scans(monkeypatch):
+    scanned = []
+
+    def fake_ocr(image):
+        scanned.append(image.size)
+        return "Scanned payoff request"
+
+    monkeypatch.setattr(extraction, "ocr_image", fake_ocr)
+    monkeypatch.setattr(extraction, "PDF_PAGES_PER_TASK", 2)
+    pages = [f"Typed statement page number {number}" for number in range(5)]
+    pages[3] = None
+
+    text = asyncio.run(extract_text_async("statement.pdf", make_pdf(pages)))
+    assert text.split("\n") == [
+        "Typed statement page number 0",
+        "Typed statement page number 1",
+        "Typed statement page number 2",
+        "Scanned payoff request",
+        "Typed statement page number 4",
+    ]
+    # Only the page without a text layer is OCRed
+    assert scanned == [(200, 100)]
+
+
+def test_pdf_page_cap_stops_early(monkeypatch):
+    monkeypatch.setattr(extraction, "PDF_MAX_PAGES", 3)
+    monkeypatch.setattr(extraction, "PDF_PAGES_PER_TASK", 2)
+    content = make_pdf([f"Typed statement page number {number}" for number in range(7)])
+
+    text = asyncio.run(extract_text_async("statement.pdf", content))
+    assert "page number 2" in text and "page number 3" not in text
+    assert text.endswith("[Truncated: extracted 3 of 7 pages]")
+    # The synchronous extractor used by the inline pool agrees
+    assert extraction.extract_text("statement.pdf", content) == text
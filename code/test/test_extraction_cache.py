@@ -0,0 +1,106 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from extraction_cache import (
+    DiskTextStore,
+    ExtractionCache,
+    MongoTextStore,
+    cache_key,
+    settings_fingerprint,
+)
+
+
+def counting_extractor(calls, text="statement text"):
+    async def extract():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return text
+
+    return extract
+
+
+def test_repeat_attachment_is_served_from_memory():
+    cache = ExtractionCache()
+    calls = []
+
+    async def run():
+        for _ in range(3):
+            assert await cache.get_or_extract("s.pdf", b"%PDF", counting_extractor(calls)) == "statement text"
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    stats = cache.get_stats()
+    assert stats["misses"] == 1 and stats["memory_hits"] == 2
+
+
+def test_concurrent_misses_share_one_extraction():
+    cache = ExtractionCache()
+    calls = []
+
+    async def run():
+        return await asyncio.gather(
+            *(cache.get_or_extract("s.pdf", b"%PDF", counting_extractor(calls)) for _ in range(5))
+        )
+
+    assert asyncio.run(run()) == ["statement text"] * 5
+    assert len(calls) == 1
+    assert cache.get_stats()["coalesced"] == 4
+
+
+def test_cancelled_caller_does_not_cancel_other_waiters():
+    cache = ExtractionCache()
+    calls = []
+
+    async def run():
+        first = asyncio.ensure_future(cache.get_or_extract("s.pdf", b"%PDF", counting_extractor(calls)))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_extract("s.pdf", b"%PDF", counting_extractor(calls)))
+        await asyncio.sleep(0)
+        # The first request's client disconnects
+        first.cancel()
+        return await asyncio.gather(second, return_exceptions=True)
+
+    assert asyncio.run(run()) == ["statement text"]
+    assert len(calls) == 1
+    assert cache.inflight == {}
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    calls = []
+    asyncio.run(ExtractionCache(DiskTextStore(str(tmp_path))).get_or_extract(
+        "s.pdf", b"%PDF", counting_extractor(calls)
+    ))
+
+    fresh = ExtractionCache(DiskTextStore(str(tmp_path)))
+    text = asyncio.run(fresh.get_or_extract("s.pdf", b"%PDF", counting_extractor(calls)))
+    assert text == "statement text"
+    assert len(calls) == 1
+    assert fresh.get_stats()["persistent_hits"] == 1
+
+
+def test_key_depends_on_content_and_type():
+    assert cache_key("a.pdf", b"x") == cache_key("b.pdf", b"x")
+    assert cache_key("a.pdf", b"x") != cache_key("a.pdf", b"y")
+    assert cache_key("a.txt", b"x") != cache_key("a.eml", b"x")
+
+
+def test_key_depends_on_extraction_settings():
+    assert settings_fingerprint({"PDF_MAX_PAGES": "50"}) == settings_fingerprint({"PDF_MAX_PAGES": "50"})
+    fewer_pages = settings_fingerprint({"PDF_MAX_PAGES": "5"})
+    other_language = settings_fingerprint({"OCR_LANG": "deu"})
+    assert len({settings_fingerprint({}), fewer_pages, other_language}) == 3
+    assert cache_key("a.pdf", b"x", fewer_pages) != cache_key("a.pdf", b"x", other_language)
+
+
+def test_mongo_entries_expire():
+    collection = AsyncMongoMockClient()["dashboard"]["extraction_cache"]
+    cache = ExtractionCache(MongoTextStore(collection, ttl_days=2))
+
+    async def run():
+        await cache.ensure_indexes()
+        return await collection.index_information()
+
+    indexes = asyncio.run(run())
+    ttl = [index for index in indexes.values() if index["key"] == [("created_at", 1)]]
+    assert ttl and ttl[0]["expireAfterSeconds"] == 2 * 24 * 3600
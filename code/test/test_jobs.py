@@ -0,0 +1,144 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import jobs
+from jobs import JobQueue, PermanentJobError, run_job
+
+
+def make_queue(**kwargs):
+    database = AsyncMongoMockClient()["dashboard"]
+    return JobQueue(database["jobs"], database["job_files"], **kwargs)
+
+
+def test_enqueued_files_come_back_in_parts(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_FILE_PART_BYTES", 4)
+    queue = make_queue()
+
+    async def scenario():
+        job_id = await queue.enqueue(
+            {"email_body": None}, [("email", "a.txt", b"0123456789"), ("attachment", "empty.txt", b"")]
+        )
+        assert await queue.files.count_documents({"job_id": job_id}) == 4
+        job = await queue.claim("worker-1")
+        assert job["_id"] == job_id
+        assert job["status"] == "running" and job["attempts"] == 1
+        # Claimed jobs are not handed out twice
+        assert await queue.claim("worker-2") is None
+        return await queue.load_files(job)
+
+    assert asyncio.run(scenario()) == [("email", "a.txt", b"0123456789"), ("attachment", "empty.txt", b"")]
+
+
+def test_failed_attempts_back_off_then_fail(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_RETRY_DELAY", 10)
+    queue = make_queue(max_attempts=2)
+
+    async def flaky(job, files):
+        raise RuntimeError("OpenAI timed out")
+
+    async def scenario():
+        job_id = await queue.enqueue({})
+        await run_job(queue, await queue.claim("w"), flaky, "w")
+        job = await queue.get(job_id)
+        assert job["status"] == "queued" and job["error"] == "OpenAI timed out"
+        assert job["run_after"] > datetime.now() + timedelta(seconds=5)
+        # Not due yet
+        assert await queue.claim("w") is None
+
+        await queue.jobs.update_one({"_id": job_id}, {"$set": {"run_after": datetime.now()}})
+        await run_job(queue, await queue.claim("w"), flaky, "w")
+        return await queue.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "failed" and job["attempts"] == 2
+
+
+def test_expired_lease_is_claimed_again():
+    queue = make_queue(max_attempts=2)
+
+    async def scenario():
+        job_id = await queue.enqueue({})
+        await queue.claim("dead-worker")
+        expire = {"$set": {"lease_until": datetime.now() - timedelta(seconds=1)}}
+        await queue.jobs.update_one({"_id": job_id}, expire)
+        job = await queue.claim("live-worker")
+        assert job["worker"] == "live-worker" and job["attempts"] == 2
+        # The dead worker can no longer renew it
+        assert not await queue.renew(job, "dead-worker")
+
+        # Out of attempts: the job fails instead of running a third time
+        await queue.jobs.update_one({"_id": job_id}, expire)
+        assert await queue.claim("another-worker") is None
+        return await queue.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert job["status"] == "failed"
+
+
+def test_run_job_records_result_or_permanent_error():
+    queue = make_queue()
+
+    async def handler(job, files):
+        if job["request"]["bad"]:
+            raise PermanentJobError("Unsupported file type")
+        return {"size": len(files[0][2])}
+
+    async def scenario():
+        good = await queue.enqueue({"bad": False}, [("email", "a.txt", b"hello")])
+        bad = await queue.enqueue({"bad": True})
+        for _ in range(2):
+            await run_job(queue, await queue.claim("w"), handler, "w")
+        assert await queue.files.count_documents({}) == 0
+        return await queue.get(good), await queue.get(bad), await queue.counts()
+
+    good, bad, counts = asyncio.run(scenario())
+    assert good["status"] == "done" and good["result"] == {"size": 5}
+    assert bad["status"] == "failed" and bad["attempts"] == 1
+    assert counts == {"queued": 0, "running": 0, "done": 1, "failed": 1}
+
+
+def test_worker_that_lost_its_lease_cannot_record_an_outcome():
+    queue = make_queue()
+
+    async def scenario():
+        job_id = await queue.enqueue({}, [("email", "a.txt", b"hello")])
+        stale = await queue.claim("slow-worker")
+        expire = {"$set": {"lease_until": datetime.now() - timedelta(seconds=1)}}
+        await queue.jobs.update_one({"_id": job_id}, expire)
+        await queue.claim("live-worker")
+
+        assert not await queue.finish(stale, result={"from": "slow-worker"})
+        assert not await queue.retry_later(stale, "late failure")
+        job = await queue.get(job_id)
+        assert job["status"] == "running" and job["worker"] == "live-worker"
+        assert job["result"] is None and job["error"] is None
+        # The live worker still needs the files
+        assert await queue.files.count_documents({"job_id": job_id}) == 1
+
+    asyncio.run(scenario())
+
+
+def test_lost_lease_cancels_the_handler():
+    queue = make_queue(lease_seconds=0.3)
+    cancelled = []
+
+    async def handler(job, files):
+        # Another worker takes the job over while this one is still busy
+        await queue.jobs.update_one({"_id": job["_id"]}, {"$set": {"worker": "other-worker"}})
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return {"from": "slow-worker"}
+
+    async def scenario():
+        job_id = await queue.enqueue({})
+        await asyncio.wait_for(run_job(queue, await queue.claim("w"), handler, "w"), timeout=2)
+        return await queue.get(job_id)
+
+    job = asyncio.run(scenario())
+    assert cancelled
+    assert job["status"] == "running" and job["worker"] == "other-worker" and job["result"] is None
@@ -0,0 +1,71 @@
+
+from knn_classifier import KnnClassifier, top_intent
+
+
+def neighbour(intent, score, confidence=0.9):
+    return {
+        "score": score,
+        "classification": {
+            "request_intents": [
+                {"intent": "Other", "confidence_score": 0.1},
+                {"intent": intent, "confidence_score": confidence},
+            ],
+            "sub_requests": [{"sub_request": intent, "reasoning": "r"}],
+        },
+    }
+
+
+def test_top_intent_ignores_case_and_missing_labels():
+    assert top_intent(neighbour(" Loan Balance ", 1)["classification"]) == "loan balance"
+    assert top_intent({"request_intents": []}) is None
+    assert top_intent(None) is None
+
+
+def test_vote_is_weighted_by_score():
+    classifier = KnnClassifier(confidence=0.6, min_neighbours=3, min_score=0.5)
+    vote = classifier.vote(
+        [neighbour("Payoff", 0.95), neighbour("payoff", 0.9), neighbour("Escrow", 0.6)]
+    )
+    assert vote["neighbours"] == 3
+    assert round(vote["confidence"], 3) == round(1.85 / 2.45, 3)
+    intents = vote["classification"]["request_intents"]
+    # The closest neighbour's spelling wins
+    assert [intent["intent"] for intent in intents] == ["Payoff", "Escrow"]
+    assert vote["classification"]["sub_requests"] == [{"sub_request": "Payoff", "reasoning": "r"}]
+    assert classifier.is_confident(vote)
+
+
+def test_too_few_or_distant_neighbours_do_not_vote():
+    classifier = KnnClassifier(min_neighbours=3, min_score=0.9)
+    assert classifier.vote([neighbour("Payoff", 0.95), neighbour("Payoff", 0.95)]) is None
+    assert classifier.vote([neighbour("Payoff", 0.95)] * 2 + [neighbour("Payoff", 0.5)]) is None
+    assert classifier.vote([neighbour("Payoff", 0.95)] * 2 + [{"score": 0.99}]) is None
+
+
+def test_agreement_is_tracked_for_shadow_and_audited_votes():
+    classifier = KnnClassifier(min_neighbours=1, min_score=0)
+    vote = classifier.vote([neighbour("Payoff", 0.9)])
+    classifier.record_fast_path(True)
+    classifier.record_fast_path(False)
+    classifier.record_agreement(vote, neighbour("payoff", 1)["classification"])
+    classifier.record_agreement(vote, neighbour("Escrow", 1)["classification"], audited=True)
+    classifier.record_agreement(None, neighbour("Escrow", 1)["classification"])
+
+    stats = classifier.get_stats()
+    assert stats["fast_path_share"] == 0.5
+    assert stats["shadow_agreement"] == 1.0
+    assert stats["audit_agreement"] == 0.0
+
+
+def test_only_llm_labels_vote():
+    classifier = KnnClassifier(min_neighbours=2, min_score=0.5)
+    copied = [
+        dict(neighbour("Escrow", 0.99), classification_source=source) for source in ("knn", "reused")
+    ]
+    assert classifier.vote(copied + [neighbour("Payoff", 0.9)]) is None
+
+    # Labels stored without a source predate kNN and came from the LLM
+    labelled = [dict(neighbour("Payoff", 0.9), classification_source="llm"), neighbour("Payoff", 0.8)]
+    vote = classifier.vote(copied + labelled)
+    assert vote["neighbours"] == 2 and vote["confidence"] == 1
+    assert top_intent(vote["classification"]) == "payoff"
@@ -0,0 +1,495 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import zipfile
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import main
+from jobs import run_job
+
+
+def test_database_endpoints(mongo, seed):
+    seed()
+    client = TestClient(main.app)
+
+    stats = client.get("/database/stats").json()
+    assert stats["total_documents"] == 4
+
+    page = client.get("/database/collections/emails/documents?limit=2").json()
+    assert page["total_documents"] == 3
+    assert page["page"]["has_more"] is True
+    assert [d["email"] for d in page["documents"]] == ["email 2", "email 1"]
+
+    assert "embedding" not in page["documents"][0]
+
+    next_page = client.get(
+        "/database/collections/emails/documents",
+        params={"limit": 2, "cursor": page["page"]["next_cursor"], "fields": "email,_id"},
+    ).json()
+    assert [d["email"] for d in next_page["documents"]] == ["email 0"]
+    assert isinstance(next_page["documents"][0]["_id"], str)
+    assert next_page["page"] == {"limit": 2, "skip": 0, "has_more": False, "next_cursor": None}
+
+    assert client.get("/database/collections/emails/documents?cursor=bogus").status_code == 400
+    assert client.get("/database/collections/missing/documents").status_code == 404
+    assert client.get("/database/list").json()["total_databases"] == 1
+
+
+def test_similar_email_sub_fields_are_resolved(mongo):
+    async def insert():
+        neighbour = await mongo["emails"].insert_one({"email": "Earlier question", "receiver_email": "a@b.c"})
+        await mongo["emails"].insert_one(
+            {"email": "New question", "similar_emails": [{"_id": neighbour.inserted_id, "score": 0.9}]}
+        )
+        return neighbour.inserted_id
+
+    neighbour_id = asyncio.run(insert())
+    client = TestClient(main.app)
+
+    def neighbours(fields):
+        # Newest first, so the email with the reference comes first
+        documents = client.get("/database/collections/emails/documents", params={"fields": fields}).json()
+        return documents["documents"][0]["similar_emails"]
+
+    assert neighbours("email,similar_emails.email") == [{"email": "Earlier question"}]
+    assert neighbours("similar_emails.email,similar_emails.score") == [
+        {"email": "Earlier question", "score": 0.9}
+    ]
+    assert neighbours("similar_emails._id,similar_emails.receiver_email") == [
+        {"_id": str(neighbour_id), "receiver_email": "a@b.c"}
+    ]
+
+
+def test_export_streams_ndjson(mongo, seed):
+    seed(4)
+    client = TestClient(main.app)
+
+    response = client.get(
+        "/database/collections/emails/export",
+        params={"created_after": "2025-01-01T00:01:00", "created_before": "2025-01-01T00:03:00"},
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["email"] for line in lines] == ["email 1", "email 2"]
+    assert "embedding" not in lines[0] and isinstance(lines[0]["_id"], str)
+
+    response = client.get(
+        "/database/collections/emails/export", params={"compress": True, "fields": "email"}
+    )
+    lines = gzip.decompress(response.content).decode().splitlines()
+    assert [json.loads(line) for line in lines] == [{"email": f"email {i}"} for i in range(4)]
+
+
+def test_process_email_stores_document(mongo, monkeypatch):
+    async def fake_classify(text, metrics=None):
+        return {"request_intents": [{"intent": "Loan Balance Inquiry", "confidence_score": 0.9}]}
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    async def fake_search(embedding):
+        neighbours = await main.collection.find(
+            {"email": "Earlier balance question"}, {"_id": 1, "email": 1}
+        ).to_list(length=None)
+        return [{**neighbour, "score": 0.5} for neighbour in neighbours]
+
+    monkeypatch.setattr(main, "classify_email", fake_classify)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    # mongomock has no $vectorSearch
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+    neighbour_id = asyncio.run(
+        mongo["emails"].insert_one(
+            {"email": "Earlier balance question", "created_at": datetime(2025, 1, 1)}
+        )
+    ).inserted_id
+
+    response = TestClient(main.app).post(
+        "/process_email", data={"email_body": "What is my loan balance?"}
+    )
+    assert response.status_code == 200
+
+    assert response.json()["similar_emails"][0]["_id"] == str(neighbour_id)
+
+    stored = asyncio.run(mongo["emails"].find_one({"email": "What is my loan balance?"}))
+    # Neighbours are stored as references and resolved when listed
+    assert stored["similar_emails"] == [{"_id": neighbour_id, "score": 0.5}]
+    listed = TestClient(main.app).get("/database/collections/emails/documents").json()
+    assert listed["documents"][0]["similar_emails"] == [
+        {"_id": str(neighbour_id), "email": "Earlier balance question", "score": 0.5}
+    ]
+    assert stored["classification"]["request_intents"][0]["intent"] == "Loan Balance Inquiry"
+
+    stats = TestClient(main.app).get("/database/stats").json()
+    assert stats["emails"]["total_emails"] == 1
+    assert stats["emails"]["by_intent"] == {"Loan Balance Inquiry": 1}
+
+
+def test_classification_timeout_is_reported_as_504(mongo, monkeypatch):
+    async def timed_out(client, assistant_id, text, metrics=None):
+        raise main.ClassificationError("Assistant run timeout", status_code=504)
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    async def fake_search(embedding, **options):
+        return []
+
+    monkeypatch.setattr(main, "CLASSIFIER_ENGINE", "assistant")
+    monkeypatch.setattr(main, "classify_with_assistant", timed_out)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+    response = TestClient(main.app).post("/process_email", data={"email_body": "Balance?"})
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Assistant run timeout"
+
+
+def test_async_process_email_queues_a_job(mongo, monkeypatch):
+    async def fake_classify(text, metrics=None):
+        return {"request_intents": [{"intent": "Loan Payoff Request", "confidence_score": 0.9}]}
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    async def fake_search(embedding):
+        return []
+
+    monkeypatch.setattr(main, "classify_email", fake_classify)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+    client = TestClient(main.app)
+
+    response = client.post(
+        "/process_email?async=true",
+        data={"email_body": "Please send a payoff quote."},
+        files={"attachments": ("note.txt", b"Loan 1234", "text/plain")},
+    )
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    assert client.get(response.json()["status_url"]).json()["status"] == "queued"
+    assert asyncio.run(mongo["emails"].count_documents({})) == 0
+
+    async def work():
+        await run_job(main.job_queue, await main.job_queue.claim("test"), main.process_job, "test")
+
+    asyncio.run(work())
+    job = client.get(f"/jobs/{job_id}").json()
+    assert job["status"] == "done"
+    assert job["result"]["classification"]["request_intents"][0]["intent"] == "Loan Payoff Request"
+    assert job["result"]["attachments"] == ["note.txt"]
+    assert asyncio.run(mongo["emails"].count_documents({})) == 1
+
+    listed = client.get("/jobs?status=done").json()
+    assert [listed_job["_id"] for listed_job in listed["jobs"]] == [job_id]
+    assert "result" not in listed["jobs"][0]
+    assert listed["counts"]["done"] == 1
+    assert client.get("/jobs?status=lost").status_code == 400
+    assert client.get("/jobs/not-an-id").status_code == 400
+
+
+def read_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_process_email_stream_reports_stages(mongo, monkeypatch):
+    async def slow_classify(text, metrics=None):
+        await asyncio.sleep(0.1)
+        return {"request_intents": [{"intent": "Loan Balance Inquiry", "confidence_score": 0.9}]}
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    async def fake_search(embedding, **options):
+        return [{"_id": "64b7f0000000000000000000", "email": "Earlier question", "score": 0.5}]
+
+    monkeypatch.setattr(main, "classify_email", slow_classify)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+
+    response = TestClient(main.app).post(
+        "/process_email/stream", data={"email_body": "What is my loan balance?"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = read_events(response.text)
+
+    finished = [data["stage"] for event, data in events if event == "stage" and data["status"] == "finished"]
+    # The similar emails arrive before the slow classification
+    assert finished == ["extract", "embed", "search", "classify", "store"]
+    search = next(data for event, data in events if data.get("stage") == "search" and data["status"] == "finished")
+    assert search["result"]["similar_emails"][0]["email"] == "Earlier question"
+    assert search["elapsed"] >= 0
+
+    event, result = events[-1]
+    assert event == "result"
+    assert result["classification"]["request_intents"][0]["intent"] == "Loan Balance Inquiry"
+    assert asyncio.run(mongo["emails"].count_documents({})) == 1
+
+
+def test_process_email_stream_reports_errors(mongo):
+    response = TestClient(main.app).post("/process_email/stream", data={})
+    event, error = read_events(response.text)[-1]
+    assert event == "error"
+    assert error == {"stage": "extract", "status_code": 400, "detail": "No email content provided"}
+
+
+def test_cancelled_attachment_extraction_is_noted_not_used_as_text(monkeypatch):
+    async def fake_extract_many(files, cache=None):
+        return [asyncio.CancelledError(), "statement text"]
+
+    monkeypatch.setattr(main, "extract_many", fake_extract_many)
+    sections, attachments = asyncio.run(
+        main.extract_email_text("Body", attachments=[("a.pdf", b"a"), ("b.pdf", b"b")])
+    )
+    assert sections[1:] == [
+        ("[Attachment: a.pdf - Could not extract text]", ""),
+        ("[Attachment: b.pdf]", "statement text"),
+    ]
+    assert attachments == ["a.pdf", "b.pdf"]
+
+
+def test_long_email_is_embedded_in_pooled_chunks(monkeypatch):
+    embedded = []
+
+    async def fake_embedding(text):
+        embedded.append(text)
+        return [1.0, 0.0] if len(embedded) == 1 else [0.0, 1.0]
+
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    state = main.new_email_state()
+    state["email"] = "statement line " * 3000
+
+    asyncio.run(main.embed_stage(state))
+    assert len(embedded) == state["metrics"]["embedding_chunks"] > 1
+    assert abs(sum(value * value for value in state["embedding"]) - 1) < 1e-9
+
+
+def test_confident_knn_vote_skips_the_llm(monkeypatch):
+    async def fail_classify(text, metrics=None):
+        raise AssertionError("the LLM should not be called")
+
+    neighbours = [
+        {
+            "_id": index,
+            "score": 0.97,
+            "classification": {
+                "request_intents": [{"intent": "Payoff Request", "confidence_score": 0.9}],
+                "sub_requests": [],
+            },
+        }
+        for index in range(4)
+    ]
+    monkeypatch.setattr(main, "classify_email", fail_classify)
+    monkeypatch.setattr(main, "knn_classifier", main.KnnClassifier(confidence=0.8, min_neighbours=3))
+    monkeypatch.setattr(main, "KNN_AUDIT_RATE", 0)
+
+    async def run():
+        search = asyncio.get_running_loop().create_future()
+        search.set_result(None)
+        state = main.new_email_state()
+        state.update(stages={"search": search}, similar_emails=neighbours, classification_text="payoff?")
+        return await main.classify_stage(state)
+
+    state = asyncio.run(run())
+    assert state["metrics"]["classification_source"] == "knn"
+    assert state["classification"]["request_intents"][0]["intent"] == "Payoff Request"
+    assert main.knn_classifier.get_stats()["fast_path_share"] == 1.0
+
+
+def reuse_scenario(mongo, monkeypatch, score):
+    classified = []
+
+    async def llm_classify(text, metrics=None):
+        # Starts speculatively alongside the search; cancelled if a duplicate turns up
+        await asyncio.sleep(0.2)
+        classified.append(text)
+        return {"request_intents": [{"intent": "Escrow Question", "confidence_score": 0.8}]}
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    neighbour_id = asyncio.run(
+        mongo["emails"].insert_one(
+            {
+                "email": "What is my loan balance?",
+                "classification": {"request_intents": [{"intent": "Loan Balance Inquiry"}]},
+                "receiver_email": "support@example.com",
+            }
+        )
+    ).inserted_id
+
+    async def fake_search(embedding):
+        neighbour = await mongo["emails"].find_one({"_id": neighbour_id}, main.SIMILAR_EMAIL_PROJECTION)
+        return [{**neighbour, "score": score}]
+
+    monkeypatch.setattr(main, "classify_email", llm_classify)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+    monkeypatch.setattr(main, "CLASSIFICATION_REUSE_THRESHOLD", 0.99)
+    response = TestClient(main.app).post("/process_email", data={"email_body": "What's my loan balance?"})
+    assert response.status_code == 200
+    return response.json(), classified, neighbour_id
+
+
+def test_near_duplicate_reuses_the_classification(mongo, monkeypatch):
+    result, classified, neighbour_id = reuse_scenario(mongo, monkeypatch, score=0.995)
+    assert classified == []
+    assert result["metrics"]["classification_source"] == "reused"
+    assert result["classification"]["request_intents"][0]["intent"] == "Loan Balance Inquiry"
+    assert result["classification_reused_from"]["_id"] == str(neighbour_id)
+    assert result["classification_reused_from"]["score"] == 0.995
+
+    stored = asyncio.run(mongo["emails"].find_one({"email": "What's my loan balance?"}))
+    assert stored["classification_reused_from"]["_id"] == neighbour_id
+
+
+def test_neighbour_below_the_reuse_threshold_goes_to_the_llm(mongo, monkeypatch):
+    result, classified, _ = reuse_scenario(mongo, monkeypatch, score=0.95)
+    assert classified == ["What's my loan balance?"]
+    assert result["metrics"]["classification_source"] == "llm"
+    assert result["classification"]["request_intents"][0]["intent"] == "Escrow Question"
+    assert result["classification_reused_from"] is None
+
+
+def test_oversized_upload_is_rejected_with_cors_headers(monkeypatch):
+    monkeypatch.setattr(main, "MAX_REQUEST_UPLOAD_BYTES", 10)
+    response = TestClient(main.app).post(
+        "/process_email",
+        files={"attachments": ("big.txt", b"x" * (main.UPLOAD_CHUNK_BYTES + 100), "text/plain")},
+        headers={"Origin": "http://localhost:5173"},
+    )
+    assert response.status_code == 413
+    # The browser UI sees the size error instead of a CORS failure
+    assert response.headers["access-control-allow-origin"] == "*"
+
+
+def test_chunked_upload_is_stopped_once_it_crosses_the_cap(monkeypatch):
+    monkeypatch.setattr(main, "MAX_REQUEST_UPLOAD_BYTES", 10)
+    chunk = b"x" * (main.UPLOAD_CHUNK_BYTES // 4)
+    head = b'--b\r\nContent-Disposition: form-data; name="attachments"; filename="big.txt"\r\n\r\n'
+    chunks = [head] + [chunk] * 40 + [b"\r\n--b--\r\n"]
+    received, sent = [], []
+
+    async def receive():
+        received.append(1)
+        return {"type": "http.request", "body": chunks[len(received) - 1], "more_body": len(received) < len(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    # No Content-Length: the body arrives chunked
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/process_email",
+        "raw_path": b"/process_email",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"multipart/form-data; boundary=b")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+        "state": {},
+    }
+    asyncio.run(main.app(scope, receive, send))
+    assert sent[0]["status"] == 413
+    # Stopped a chunk past the cap (10 bytes plus a chunk of multipart allowance)
+    assert len(received) == 5
+
+
+def fake_pipeline(monkeypatch):
+    async def fake_classify(text, metrics=None):
+        return {"request_intents": [{"intent": "Payoff Request", "confidence_score": 0.9}]}
+
+    async def fake_embedding(text):
+        return [0.3, 0.4]
+
+    async def fake_search(embedding, **options):
+        return []
+
+    monkeypatch.setattr(main, "classify_email", fake_classify)
+    monkeypatch.setattr(main, "get_embedding", fake_embedding)
+    monkeypatch.setattr(main, "search_similar_emails", fake_search)
+
+
+def read_batch(response):
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    summary = lines.pop()["summary"]
+    return sorted(lines, key=lambda line: line["filename"]), summary
+
+
+def test_batch_expands_zip_and_mbox_archives(mongo, monkeypatch, tmp_path):
+    fake_pipeline(monkeypatch)
+    monkeypatch.setattr(main, "BATCH_SPOOL_DIR", str(tmp_path))
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        zip_file.writestr("first.txt", "Please send my payoff quote.")
+        zip_file.writestr("second.eml", "Subject: Payoff\n\nWhat is my payoff amount?\n")
+        zip_file.writestr("__MACOSX/", "")
+    mbox = (
+        b"From a@example.com Mon Jan  1 00:00:00 2025\nSubject: One\n\nFirst message\n\n"
+        b"From b@example.com Mon Jan  1 00:00:00 2025\nSubject: Two\n\nSecond message\n"
+    )
+
+    response = TestClient(main.app).post(
+        "/process_emails/batch",
+        files=[
+            ("emails", ("single.txt", b"Loan balance please", "text/plain")),
+            ("emails", ("archive.zip", archive.getvalue(), "application/zip")),
+            ("emails", ("inbox.mbox", mbox, "application/mbox")),
+        ],
+    )
+    assert response.status_code == 200
+    lines, summary = read_batch(response)
+    assert [line["filename"] for line in lines] == [
+        "first.txt",
+        "inbox.mbox#0.eml",
+        "inbox.mbox#1.eml",
+        "second.eml",
+        "single.txt",
+    ]
+    assert all(line["status"] == "ok" for line in lines)
+    assert summary["succeeded"] == 5 and summary["failed"] == 0
+    assert asyncio.run(mongo["emails"].count_documents({})) == 5
+    # The spooled uploads are removed once the batch is done
+    assert os.listdir(tmp_path) == []
+
+
+def test_batch_reports_corrupt_archive_and_continues(mongo, monkeypatch):
+    fake_pipeline(monkeypatch)
+    response = TestClient(main.app).post(
+        "/process_emails/batch",
+        files=[
+            ("emails", ("broken.zip", b"PK\x03\x04 not really a zip", "application/zip")),
+            ("emails", ("single.txt", b"Loan balance please", "text/plain")),
+        ],
+    )
+    assert response.status_code == 200
+    (broken, single), summary = read_batch(response)
+    assert broken["status"] == "error" and broken["stage"] == "load"
+    assert "Could not open broken.zip" in broken["error"]
+    assert single["status"] == "ok"
+    assert summary == {**summary, "total": 2, "succeeded": 1, "failed": 1}
+
+
+def test_batch_upload_cap(mongo, monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "BATCH_SPOOL_DIR", str(tmp_path))
+    monkeypatch.setattr(main, "MAX_BATCH_UPLOAD_BYTES", 100)
+    response = TestClient(main.app).post(
+        "/process_emails/batch",
+        files=[
+            ("emails", ("a.txt", b"x" * 60, "text/plain")),
+            ("emails", ("b.txt", b"x" * 60, "text/plain")),
+        ],
+    )
+    assert response.status_code == 413
+    assert os.listdir(tmp_path) == []
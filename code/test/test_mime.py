@@ -0,0 +1,82 @@
+import asyncio
+from email.message import EmailMessage
+
+import extraction
+from extraction import extract_text_async, parse_email_async
+from mime import FORWARDED_SEPARATOR, format_email_text, html_to_text, parse_eml
+
+
+def test_attachments_are_collected_in_the_same_pass():
+    message = EmailMessage()
+    message["Subject"] = "Statement"
+    message.set_content("See attached.")
+    message.add_attachment(
+        b"%PDF-1.4", maintype="application", subtype="pdf", filename="../../etc/statement.pdf"
+    )
+    message.add_attachment("café notes", subtype="plain", charset="latin-1", filename="notes.txt")
+    message.add_attachment(b"\x89PNG", maintype="image", subtype="png")
+
+    parsed = parse_eml(memoryview(message.as_bytes()))
+    assert parsed["body"] == "See attached.\n"
+    # Sender-chosen paths are reduced to a base name
+    assert parsed["attachments"] == [
+        ("statement.pdf", b"%PDF-1.4"),
+        ("notes.txt", "café notes\n".encode("utf-8")),
+        ("attachment-3.png", b"\x89PNG"),
+    ]
+
+
+def test_html_only_body_is_converted_to_text():
+    message = EmailMessage()
+    message["From"] = "a@b.com"
+    message.set_content(
+        "<html><head><style>p {color: red}</style></head><body>"
+        "<p>Please send my   payoff quote.</p><ul><li>Loan 123</li></ul>"
+        "<script>track()</script></body></html>",
+        subtype="html",
+    )
+
+    parsed = parse_eml(message.as_bytes())
+    assert parsed["body"] == "Please send my payoff quote.\n\nLoan 123"
+    assert html_to_text("a&amp;b<br>c") == "a&b\nc"
+
+
+def test_plain_alternative_is_preferred_over_html():
+    message = EmailMessage()
+    message.set_content("Plain version")
+    message.add_alternative("<p>HTML version</p>", subtype="html")
+
+    assert parse_eml(message.as_bytes())["body"] == "Plain version\n"
+
+
+def test_forwarded_message_is_parsed_with_its_attachments():
+    inner = EmailMessage()
+    inner["From"] = "borrower@example.com"
+    inner["Subject"] = "Wire details"
+    inner.set_content("Funds were wired today.")
+    inner.add_attachment(b"%PDF-1.4", maintype="application", subtype="pdf", filename="wire.pdf")
+
+    outer = EmailMessage()
+    outer["From"] = "servicer@example.com"
+    outer["Subject"] = "Fwd: Wire details"
+    outer.set_content("FYI, see below.")
+    outer.add_attachment(inner)
+
+    parsed = parse_eml(outer.as_bytes())
+    assert parsed["headers"]["subject"] == "Fwd: Wire details"
+    assert parsed["forwarded"][0]["headers"]["from"] == "borrower@example.com"
+    assert parsed["attachments"] == [("wire.pdf", b"%PDF-1.4")]
+
+    text = format_email_text(parsed)
+    assert text.index("FYI, see below.") < text.index(FORWARDED_SEPARATOR)
+    assert text.index(FORWARDED_SEPARATOR) < text.index("Funds were wired today.")
+
+
+def test_parsing_on_the_pool_matches_extraction(monkeypatch):
+    monkeypatch.setattr(extraction, "EXTRACTION_POOL", "thread")
+    eml = b"From: a@b.com\nTo: c@d.com\nSubject: Payoff\n\nPlease send my payoff quote.\n"
+    try:
+        parsed = asyncio.run(parse_email_async("mail.eml", eml))
+        assert format_email_text(parsed) == asyncio.run(extract_text_async("mail.eml", eml))
+    finally:
+        extraction.shutdown_pool()
@@ -0,0 +1,62 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import ocr
+from ocr import otsu_threshold, preprocess, tile_bounds
+
+
+def jpeg(image, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", **params)
+    return Image.open(io.BytesIO(buffer.getvalue()))
+
+
+def test_phone_photo_is_downsampled_and_binarised():
+    photo = Image.new("RGB", (4032, 3024), (200, 190, 180))
+    ImageDraw.Draw(photo).rectangle((100, 100, 2000, 140), fill=(30, 30, 30))
+
+    prepared = preprocess(jpeg(photo))
+    assert prepared.mode == "1"
+    assert prepared.size == (3400, 2550)
+    ink = ~np.asarray(prepared)
+    # The dark bar is ink, the tinted paper is not
+    assert ink[90:110, 100:1600].all()
+    assert ink[1000:].mean() == 0
+
+
+def test_scan_dpi_is_reduced_to_the_target(monkeypatch):
+    monkeypatch.setattr(ocr, "OCR_TARGET_DPI", 300)
+    scan = jpeg(Image.new("L", (1200, 1600), 255), dpi=(600, 600))
+    assert preprocess(scan).size == (600, 800)
+    # Small images are never scaled up
+    assert preprocess(Image.new("L", (300, 200), 255)).size == (300, 200)
+
+
+def test_light_text_on_dark_background_is_inverted():
+    image = Image.new("L", (200, 100), 20)
+    ImageDraw.Draw(image).rectangle((10, 10, 60, 20), fill=230)
+    ink = ~np.asarray(preprocess(image))
+    assert ink[12:18, 12:58].all()
+    assert ink.mean() < 0.1
+
+
+def test_otsu_threshold_splits_two_levels():
+    pixels = np.array([40] * 100 + [210] * 300, dtype=np.uint8)
+    assert 40 <= otsu_threshold(pixels) < 210
+
+
+def test_tall_images_are_cut_between_lines():
+    page = Image.new("L", (400, 2500), 255)
+    draw = ImageDraw.Draw(page)
+    lines = [(top, top + 12) for top in range(20, 2480, 50)]
+    for top, bottom in lines:
+        draw.rectangle((10, top, 300, bottom), fill=0)
+
+    bounds = tile_bounds(preprocess(page), tile_height=1000)
+    assert bounds[0][0] == 0 and bounds[-1][1] == 2500
+    assert all(height <= 1000 for height in (bottom - top for top, bottom in bounds))
+    for _, cut in bounds[:-1]:
+        # No cut passes through a line of text
+        assert not any(top <= cut <= bottom for top, bottom in lines)
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+from pipeline import StageError, StageGraph, run_pipeline
+
+
+async def collect(items, stages, **kwargs):
+    return [outcome async for outcome in run_pipeline(items, stages, **kwargs)]
+
+
+def test_stage_concurrency_is_bounded():
+    active = {"slow": 0}
+    peak = {"slow": 0}
+
+    async def slow(value):
+        active["slow"] += 1
+        peak["slow"] = max(peak["slow"], active["slow"])
+        await asyncio.sleep(0.01)
+        active["slow"] -= 1
+        return value * 2
+
+    async def fast(value):
+        return value + 1
+
+    outcomes = asyncio.run(
+        collect(range(20), [("slow", slow), ("fast", fast)], concurrency={"slow": 3})
+    )
+    assert peak["slow"] == 3
+    assert sorted(o["result"] for o in outcomes) == [i * 2 + 1 for i in range(20)]
+
+
+def test_results_are_yielded_as_they_complete():
+    async def wait(value):
+        await asyncio.sleep(value)
+        return value
+
+    outcomes = asyncio.run(collect([0.05, 0.0, 0.02], [("wait", wait)]))
+    assert [o["index"] for o in outcomes] == [1, 2, 0]
+
+
+def test_failures_are_reported_per_item():
+    async def check(value):
+        if value == 2:
+            raise ValueError("bad email")
+        return value
+
+    outcomes = asyncio.run(collect(range(4), [("check", check)]))
+    errors = [o for o in outcomes if "error" in o]
+    assert len(outcomes) == 4
+    assert len(errors) == 1 and errors[0]["index"] == 2
+    assert isinstance(errors[0]["error"], StageError)
+    assert errors[0]["error"].stage == "check"
+
+
+def test_in_flight_items_are_bounded():
+    admitted = []
+
+    def items():
+        for i in range(10):
+            admitted.append(i)
+            yield i
+
+    async def noop(value):
+        await asyncio.sleep(0)
+        return value
+
+    async def run():
+        seen = []
+        async for outcome in run_pipeline(items(), [("noop", noop)], max_in_flight=2):
+            # Two items in flight plus the one waiting for admission
+            assert len(admitted) - len(seen) <= 3
+            seen.append(outcome)
+        return seen
+
+    assert len(asyncio.run(run())) == 10
+
+
+def test_stage_graph_runs_independent_branches_concurrently():
+    async def extract(state):
+        state["text"] = "email"
+
+    def slow(name):
+        async def stage(state):
+            await asyncio.sleep(0.05)
+            state[name] = True
+
+        return stage
+
+    async def store(state):
+        assert state["classified"] and state["searched"]
+
+    async def run():
+        graph = StageGraph(
+            [
+                ("extract", extract, []),
+                ("classify", slow("classified"), ["extract"]),
+                ("search", slow("searched"), ["extract"]),
+                ("store", store, ["classify", "search"]),
+            ]
+        )
+        return await graph.run({})
+
+    state = asyncio.run(run())
+    timings = state["metrics"]["stage_timings"]
+    assert set(timings) == {"extract", "classify", "search", "store", "total"}
+    # Both 50ms branches overlap instead of adding up
+    assert timings["total"] < 0.09
+    assert "stages" not in state
+
+
+def test_stage_graph_runs_with_and_without_semaphores():
+    async def stage(state):
+        state.setdefault("ran", []).append(True)
+
+    graph = StageGraph([("extract", stage, []), ("classify", stage, ["extract"])])
+
+    async def run():
+        # Single emails run without semaphores; batches bound only some stages
+        alone = await graph.run({})
+        bounded = await graph.run({}, semaphores={"classify": asyncio.Semaphore(1)})
+        return alone, bounded
+
+    for state in asyncio.run(run()):
+        assert state["ran"] == [True, True]
+
+
+def test_stage_graph_reports_stages_to_listener():
+    events = []
+
+    def stage(delay):
+        async def run(state):
+            await asyncio.sleep(delay)
+
+        return run
+
+    def listener(event, name, state):
+        events.append((event, name, name in state["metrics"]["stage_timings"]))
+
+    graph = StageGraph(
+        [("extract", stage(0), []), ("classify", stage(0.05), ["extract"]), ("search", stage(0.01), ["extract"])]
+    )
+    asyncio.run(graph.run({}, listener=listener))
+    assert events == [
+        ("started", "extract", False),
+        ("finished", "extract", True),
+        ("started", "classify", False),
+        ("started", "search", False),
+        # The faster branch is reported first
+        ("finished", "search", True),
+        ("finished", "classify", True),
+    ]
+
+
+def test_stage_graph_failure_cancels_other_stages():
+    cancelled = []
+
+    async def fail(state):
+        raise ValueError("no content")
+
+    async def wait(state):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    graph = StageGraph([("wait", wait, []), ("extract", fail, [])])
+    with pytest.raises(StageError) as excinfo:
+        asyncio.run(graph.run({}))
+    assert excinfo.value.stage == "extract"
+    assert cancelled == [True]
+
+
+def test_stage_graph_rejects_unknown_requirements():
+    async def noop(state):
+        pass
+
+    with pytest.raises(ValueError):
+        StageGraph([("store", noop, ["classify"])])
@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+import requests
+import urllib3
+from openai import AsyncOpenAI
+
+import helper
+from rate_governor import (
+    GovernedTransport,
+    ModelLimiter,
+    RateGovernor,
+    estimate_tokens,
+    openai_lane,
+    parse_rate_limits,
+    retry_after,
+    retryable,
+)
+
+
+def test_retry_after_headers():
+    assert retry_after(httpx.Headers({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(httpx.Headers({"retry-after": "3"})) == 3.0
+    assert retry_after(httpx.Headers({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0.0
+    assert retry_after(httpx.Headers({})) is None
+
+
+def test_estimates_and_limits():
+    assert estimate_tokens("/v1/embeddings", {"input": ["a" * 400, "b" * 40]}) == 111
+    chat = {"messages": [{"role": "user", "content": "x" * 80}], "max_tokens": 50}
+    assert estimate_tokens("/v1/chat/completions", chat) == 70
+    assert estimate_tokens("/v1/threads", {}) == 0
+    assert parse_rate_limits("gpt-4o-mini=500:200000, text-embedding-3-small=3000:1000000") == {
+        "gpt-4o-mini": (500.0, 200000.0),
+        "text-embedding-3-small": (3000.0, 1000000.0),
+    }
+
+
+def test_interactive_lane_goes_first():
+    # 10 requests a second, with the bucket empty
+    limiter = ModelLimiter(rpm=600, tpm=1e9)
+    limiter.requests.level = 0
+    served = []
+
+    async def request(name, lane):
+        with openai_lane(lane):
+            await limiter.acquire(0, lane)
+        served.append(name)
+
+    async def run():
+        batch = [asyncio.ensure_future(request(f"batch {i}", "batch")) for i in range(3)]
+        await asyncio.sleep(0.01)
+        await request("upload", "interactive")
+        await asyncio.gather(*batch)
+
+    started = time.monotonic()
+    asyncio.run(run())
+    assert served[0] == "upload"
+    assert served[1:] == ["batch 0", "batch 1", "batch 2"]
+    # Admitted at the bucket's rate rather than all at once
+    assert time.monotonic() - started >= 0.3
+
+
+def test_token_bucket_spaces_out_large_requests():
+    # 600 tokens a second; each request takes 100
+    limiter = ModelLimiter(rpm=1e6, tpm=36000)
+    limiter.tokens.level = 0
+
+    async def run():
+        return await asyncio.gather(*(limiter.acquire(100) for _ in range(3)))
+
+    waits = asyncio.run(run())
+    assert 0.45 <= max(waits) < 1.0
+
+
+def openai_client(governor, responses, seen):
+    def handler(request):
+        seen.append(request.url.path)
+        return responses.pop(0)
+
+    transport = GovernedTransport(governor, httpx.MockTransport(handler))
+    return AsyncOpenAI(
+        api_key="test-key",
+        base_url="http://openai.test/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=transport),
+    )
+
+
+def embedding_response():
+    return httpx.Response(
+        200,
+        json={
+            "object": "list",
+            "data": [{"object": "embedding", "index": 0, "embedding": [0.1, 0.2]}],
+            "model": "text-embedding-3-small",
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        },
+        headers={"x-ratelimit-limit-requests": "3000", "x-ratelimit-remaining-tokens": "999000"},
+    )
+
+
+def test_rate_limited_requests_are_retried_after_the_requested_delay():
+    governor = RateGovernor(limits={})
+    rate_limited = httpx.Response(
+        429, json={"error": {"code": "rate_limit_exceeded"}}, headers={"retry-after-ms": "100"}
+    )
+    seen = []
+    client = openai_client(governor, [rate_limited, embedding_response()], seen)
+
+    started = time.monotonic()
+    response = asyncio.run(client.embeddings.create(input=["hello"], model="text-embedding-3-small"))
+    assert response.data[0].embedding == [0.1, 0.2]
+    assert time.monotonic() - started >= 0.1
+    assert seen == ["/v1/embeddings", "/v1/embeddings"]
+
+    stats = governor.get_stats()["text-embedding-3-small"]
+    assert stats["rate_limited"] == 1 and stats["retries"] == 1 and stats["failed"] == 0
+    assert stats["throttle_wait_seconds"] >= 0.1
+    # The limits reported by the API replace the configured ones
+    assert stats["rpm_limit"] == 3000
+
+
+def test_exhausted_quota_is_not_retried():
+    governor = RateGovernor(limits={})
+    no_quota = httpx.Response(429, json={"error": {"code": "insufficient_quota", "message": "quota"}})
+    seen = []
+    client = openai_client(governor, [no_quota, embedding_response()], seen)
+
+    async def run():
+        try:
+            await client.embeddings.create(input=["hello"], model="text-embedding-3-small")
+        except Exception as e:
+            return e
+
+    assert type(asyncio.run(run())).__name__ == "RateLimitError"
+    assert len(seen) == 1
+    assert governor.get_stats()["text-embedding-3-small"]["failed"] == 1
+
+
+def test_only_idempotent_requests_are_retried_after_5xx_or_dropped_connections():
+    run = httpx.Request("POST", "http://openai.test/v1/threads/thread_1/runs", json={})
+    embed = httpx.Request("POST", "http://openai.test/v1/embeddings", json={})
+    poll = httpx.Request("GET", "http://openai.test/v1/threads/thread_1/runs/run_1")
+    keyed = httpx.Request("POST", run.url, headers={"Idempotency-Key": "k"}, json={})
+
+    assert retryable(run, 429)
+    assert not retryable(run, 500) and not retryable(run, error=httpx.ReadError("reset"))
+    # Never sent, so it can't have started a run
+    assert retryable(run, error=httpx.ConnectError("refused"))
+    assert all(retryable(request, 503) for request in (embed, poll, keyed))
+    assert not retryable(embed, 400)
+
+
+def test_failed_run_creation_is_not_sent_twice():
+    governor = RateGovernor(limits={})
+    sent = []
+
+    async def send(request):
+        sent.append(request)
+        return httpx.Response(500, json={"error": {"message": "server error"}})
+
+    request = httpx.Request("POST", "http://openai.test/v1/threads/thread_1/runs", json={"assistant_id": "a"})
+    response = asyncio.run(governor.send(request, send))
+    assert response.status_code == 500 and len(sent) == 1
+    assert governor.get_stats()["default"]["failed"] == 1
+
+
+def test_sync_helper_does_not_repeat_creating_posts(monkeypatch):
+    monkeypatch.setattr(helper, "retry_delay", lambda attempt, headers=None: 0)
+    outcomes = []
+
+    def fake_post(url, **kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code, response._content = outcome, b"{}"
+        return response
+
+    monkeypatch.setattr(helper.requests, "post", fake_post)
+    url = "https://api.openai.com/v1/assistants"
+
+    outcomes[:] = [502, 200]
+    assert helper.post_with_retries(url).status_code == 502
+    outcomes[:] = [429, 200]
+    assert helper.post_with_retries(url).status_code == 200
+
+    refused = requests.ConnectionError(
+        urllib3.exceptions.MaxRetryError(None, url, urllib3.exceptions.NewConnectionError(None, "refused"))
+    )
+    outcomes[:] = [refused, 200]
+    assert helper.post_with_retries(url).status_code == 200
+    # Dropped after sending: the assistant may exist already
+    outcomes[:] = [requests.ConnectionError("Connection reset by peer"), 200]
+    with pytest.raises(requests.ConnectionError):
+        helper.post_with_retries(url)
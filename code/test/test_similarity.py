@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from similarity import AtlasVectorSearch, LocalVectorIndex, hydrate_similar_emails
+
+
+def unit(*values):
+    vector = np.array(values, dtype=np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@pytest.fixture
+def emails():
+    return AsyncMongoMockClient()["dashboard"]["emails"]
+
+
+async def store(index, collection, text, embedding):
+    result = await collection.insert_one(
+        {"email": text, "embedding": embedding, "classification": {"request_intents": []}}
+    )
+    await index.add(result.inserted_id, embedding)
+
+
+def test_search_returns_atlas_shaped_results_best_first(emails, tmp_path):
+    async def run():
+        index = LocalVectorIndex(emails, str(tmp_path), growth=2)
+        await store(index, emails, "balance", unit(1, 0, 0))
+        await store(index, emails, "payoff", unit(0, 1, 0))
+        await store(index, emails, "balance again", unit(1, 0.1, 0))
+        return index, await index.search(unit(1, 0, 0), limit=2)
+
+    index, results = asyncio.run(run())
+    assert [r["email"] for r in results] == ["balance", "balance again"]
+    assert results[0]["score"] == pytest.approx(1.0)
+    assert "embedding" not in results[0]
+    # Results carry the _id that stored emails reference them by
+    assert results[0]["_id"] is not None and "similar_emails" not in results[0]
+    # Grew past the initial capacity of two rows
+    assert index.count == 3 and index.capacity >= 3
+
+
+def test_exact_scan_runs_off_the_event_loop(emails, tmp_path, monkeypatch):
+    threads = []
+    scan = LocalVectorIndex.top_k
+
+    def recording_top_k(self, embedding, limit):
+        threads.append(threading.current_thread())
+        return scan(self, embedding, limit)
+
+    monkeypatch.setattr(LocalVectorIndex, "top_k", recording_top_k)
+
+    async def run():
+        index = LocalVectorIndex(emails, str(tmp_path))
+        await store(index, emails, "balance", unit(1, 0, 0))
+        return await index.search(unit(1, 0, 0), limit=1, exact=True)
+
+    assert [r["email"] for r in asyncio.run(run())] == ["balance"]
+    assert threads and threads[0] is not threading.main_thread()
+
+
+def test_index_is_reopened_from_disk(emails, tmp_path):
+    async def run():
+        first = LocalVectorIndex(emails, str(tmp_path))
+        await store(first, emails, "balance", unit(1, 0, 0))
+        await store(first, emails, "payoff", unit(0, 1, 0))
+
+        reopened = LocalVectorIndex(emails, str(tmp_path))
+        return reopened, await reopened.search(unit(0, 1, 0), limit=1)
+
+    reopened, results = asyncio.run(run())
+    assert reopened.count == 2
+    assert results[0]["email"] == "payoff"
+
+
+def test_missing_index_is_built_from_the_collection(emails, tmp_path):
+    async def run():
+        await emails.insert_many(
+            [{"email": "balance", "embedding": unit(1, 0)}, {"email": "payoff", "embedding": unit(0, 1)}]
+        )
+        index = LocalVectorIndex(emails, str(tmp_path))
+        return index, await index.search(unit(0.1, 1))
+
+    index, results = asyncio.run(run())
+    assert index.count == 2
+    assert [r["email"] for r in results] == ["payoff", "balance"]
+
+
+def test_approximate_search_matches_exact_search(emails, tmp_path):
+    pytest.importorskip("hnswlib")
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(300, 16)).astype(np.float32)
+
+    async def run():
+        index = LocalVectorIndex(emails, str(tmp_path))
+        for position, vector in enumerate(vectors):
+            await store(index, emails, f"email {position}", vector.tolist())
+        query = vectors[7].tolist()
+        exact = await index.search(query, limit=5, exact=True)
+        approximate = await index.search(query, limit=5, num_candidates=100, exact=False)
+        # Emails stored after the graph was built are searchable too
+        await store(index, emails, "late", (vectors[7] * 2).tolist())
+        late = await index.search(query, limit=1, exact=False)
+        return index, exact, approximate, late
+
+    index, exact, approximate, late = asyncio.run(run())
+    assert [r["email"] for r in approximate] == [r["email"] for r in exact]
+    assert [r["score"] for r in approximate] == pytest.approx([r["score"] for r in exact], abs=1e-5)
+    assert late[0]["score"] == pytest.approx(1.0)
+    assert index.get_stats()["hnsw_vectors"] == 301
+
+
+def test_min_score_drops_weak_matches(emails, tmp_path):
+    async def run():
+        index = LocalVectorIndex(emails, str(tmp_path))
+        await store(index, emails, "balance", unit(1, 0))
+        await store(index, emails, "payoff", unit(0, 1))
+        return await index.search(unit(1, 0), limit=5, min_score=0.9)
+
+    assert [r["email"] for r in asyncio.run(run())] == ["balance"]
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return self
+
+    async def to_list(self, length=None):
+        return []
+
+
+def test_atlas_search_sends_approximate_query_options():
+    collection = RecordingCollection()
+    atlas = AtlasVectorSearch(collection)
+    asyncio.run(atlas.search([0.1, 0.2], limit=3, num_candidates=50000, min_score=0.8, exact=False))
+    asyncio.run(atlas.search([0.1, 0.2], limit=3, exact=True))
+
+    approximate, exact = collection.pipelines
+    assert approximate[0]["$vectorSearch"]["numCandidates"] == 10000
+    assert "exact" not in approximate[0]["$vectorSearch"]
+    assert approximate[-1] == {"$match": {"score": {"$gte": 0.8}}}
+    assert exact[0]["$vectorSearch"]["exact"] is True
+    assert "numCandidates" not in exact[0]["$vectorSearch"]
+
+
+def test_hydrate_resolves_references_in_one_query(emails):
+    async def run():
+        first, second = (
+            await emails.insert_many(
+                [
+                    {"email": "balance", "classification": {"request_intents": []}},
+                    {"email": "payoff", "classification": {"request_intents": []}},
+                ]
+            )
+        ).inserted_ids
+        documents = [
+            {"similar_emails": [{"_id": second, "score": 0.9}, {"_id": first, "score": 0.8}]},
+            # Stored before references: neighbours are embedded already
+            {"similar_emails": [{"email": "legacy", "score": 0.7}]},
+            # The referenced email was deleted
+            {"similar_emails": [{"_id": ObjectId(), "score": 0.6}]},
+        ]
+        return await hydrate_similar_emails(emails, documents, {"email": 1})
+
+    documents = asyncio.run(run())
+    assert [(n["email"], n["score"]) for n in documents[0]["similar_emails"]] == [
+        ("payoff", 0.9),
+        ("balance", 0.8),
+    ]
+    assert "classification" not in documents[0]["similar_emails"][0]
+    assert documents[1]["similar_emails"] == [{"email": "legacy", "score": 0.7}]
+    assert documents[2]["similar_emails"] == []
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime
+
+from mongomock_motor import AsyncMongoMockClient
+
+from stats import EmailStats, StatsCache
+
+
+def email(intent, day, attachments=(), reused=None):
+    return {
+        "email": "text",
+        "classification": {"request_intents": [{"intent": intent}]} if intent else {},
+        "classification_reused_from": reused,
+        "attachments": list(attachments),
+        "created_at": datetime(2025, 1, day, 12),
+    }
+
+
+EMAILS = [
+    email("Loan Balance Inquiry", 1, ["statement.pdf"]),
+    email("Loan Balance Inquiry", 2, reused={"score": 0.995}),
+    email("Payoff Request", 2, ["a.pdf", "b.png"]),
+    email(None, 3),
+]
+
+
+def test_recorded_counters_match_a_rebuild():
+    database = AsyncMongoMockClient()["dashboard"]
+    stats = EmailStats(database["emails"], database["email_stats"])
+
+    async def run():
+        for document in EMAILS:
+            await database["emails"].insert_one(dict(document))
+            await stats.record(document)
+        recorded = await stats.summary()
+        await stats.rebuild()
+        return recorded, await stats.summary(days=2)
+
+    recorded, rebuilt = asyncio.run(run())
+    assert recorded["total_emails"] == 4
+    assert recorded["attachments"] == 3
+    assert recorded["emails_with_attachments"] == 2
+    assert recorded["classifications_reused"] == 1
+    assert recorded["by_intent"] == {"Loan Balance Inquiry": 2, "Payoff Request": 1, "Uncategorized": 1}
+    assert [day["date"] for day in recorded["by_day"]] == ["2025-01-03", "2025-01-02", "2025-01-01"]
+    assert recorded["by_day"][1] == {"date": "2025-01-02", "emails": 2, "attachments": 2}
+
+    assert rebuilt == {**recorded, "by_day": recorded["by_day"][:2]}
+
+
+def test_undated_emails_stay_out_of_the_recent_days():
+    database = AsyncMongoMockClient()["dashboard"]
+    stats = EmailStats(database["emails"], database["email_stats"])
+
+    async def run():
+        await stats.record(EMAILS[0])
+        await stats.record({**EMAILS[1], "created_at": None})
+        return await stats.summary(days=1)
+
+    summary = asyncio.run(run())
+    assert summary["total_emails"] == 2
+    assert [day["date"] for day in summary["by_day"]] == ["2025-01-01"]
+
+
+def test_only_one_process_builds_the_counters():
+    database = AsyncMongoMockClient()["dashboard"]
+    builds = []
+
+    class CountingStats(EmailStats):
+        async def rebuild(self, batch_size=1000):
+            builds.append(self)
+            await asyncio.sleep(0.05)
+            await super().rebuild(batch_size)
+
+    async def run():
+        await database["emails"].insert_many([dict(document) for document in EMAILS])
+        processes = [CountingStats(database["emails"], database["email_stats"]) for _ in range(3)]
+        await asyncio.gather(*(process.ensure() for process in processes))
+        # Built once, the counters are kept as they are
+        await processes[0].ensure()
+        return await processes[0].summary(), await database["email_stats"].count_documents({})
+
+    summary, documents = asyncio.run(run())
+    assert len(builds) == 1
+    assert summary["total_emails"] == 4
+    # Totals and three days; the rebuild marker is gone
+    assert documents == 4
+
+
+def test_stats_cache_serves_and_coalesces():
+    cache = StatsCache(ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"total": len(calls)}
+
+    async def run():
+        first = await asyncio.gather(*(cache.get("stats", compute) for _ in range(5)))
+        return first, await cache.get("stats", compute)
+
+    first, second = asyncio.run(run())
+    assert len(calls) == 1
+    assert first == [{"total": 1}] * 5 and second == {"total": 1}
+    assert cache.get_stats() == {"hits": 5, "misses": 1, "entries": 1}
@@ -0,0 +1,55 @@
+import asyncio
+
+import numpy as np
+
+from embeddings import pool_embeddings
+from token_budget import allocate, budget_sections, count_tokens, format_sections, split_tokens
+
+
+def test_allocate_gives_small_sections_all_they_need():
+    assert allocate([10, 500, 5000, 3], 1000) == [10, 493, 494, 3]
+    assert allocate([10, 20], 1000) == [10, 20]
+    assert allocate([10, 20], -5) == [0, 0]
+
+
+def test_short_email_is_unchanged():
+    sections = [("", "What is my payoff amount?"), ("[Attachment: note.txt]", "Loan 123")]
+    text, tokens = budget_sections(sections, budget=1000, body_tokens=500)
+    assert text == format_sections(sections)
+    assert text == "What is my payoff amount?\n\n[Attachment: note.txt]\nLoan 123"
+    assert tokens == count_tokens(text)
+
+
+def test_huge_attachment_is_cut_to_the_budget_and_the_body_kept():
+    body = "Please send the payoff quote for loan 123. " * 20
+    sections = [
+        ("", body),
+        ("[Attachment: statement.pdf]", "Balance forward 1,234.56 " * 200000),
+        ("[Attachment: id.png - Could not extract text]", ""),
+    ]
+    text, tokens = budget_sections(sections, budget=1000, body_tokens=600)
+    assert text.startswith(body)
+    assert "more characters not shown]" in text
+    assert text.endswith("[Attachment: id.png - Could not extract text]")
+    # A small allowance for the notes added to cut sections
+    assert tokens <= 1000 + 20
+
+
+def test_body_is_cut_after_attachments_get_their_share():
+    sections = [("", "word " * 5000), ("[Attachment: a.txt]", "attachment " * 5000)]
+    text, _ = budget_sections(sections, budget=1000, body_tokens=600)
+    body, attachment = text.split("\n\n[Attachment: a.txt]\n")
+    assert count_tokens(body) > count_tokens(attachment)
+
+
+def test_split_tokens_keeps_short_text_and_caps_chunks():
+    assert split_tokens("short email", size=100, max_chunks=3) == ["short email"]
+    chunks = split_tokens("statement line " * 10000, size=100, max_chunks=3)
+    assert len(chunks) == 3
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+
+
+def test_pooled_embedding_is_unit_length():
+    pooled = pool_embeddings([[1.0, 0.0], [0.0, 1.0]], weights=[3, 1])
+    assert np.isclose(np.linalg.norm(pooled), 1.0)
+    assert pooled[0] > pooled[1] > 0
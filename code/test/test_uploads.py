@@ -0,0 +1,67 @@
+import asyncio
+import io
+import tempfile
+
+import pytest
+from fastapi import UploadFile
+
+import uploads
+from uploads import SpooledContent, UploadBudget, UploadTooLarge, read_upload
+
+
+def upload(content, filename="mail.eml", size=None):
+    return UploadFile(io.BytesIO(content), filename=filename, size=size)
+
+
+def test_small_content_stays_in_memory():
+    content = asyncio.run(read_upload(upload(b"hello"), spill_bytes=10))
+    assert not content.spilled
+    assert content.view() == b"hello"
+    content.close()
+
+
+def test_large_content_spills_to_an_anonymous_file(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 4)
+    content = asyncio.run(read_upload(upload(b"0123456789abcdef"), spill_bytes=10))
+    assert content.spilled
+    view = content.view()
+    assert bytes(view[:4]) == b"0123" and len(view) == 16
+    content.close()
+    assert content.file is None
+
+
+def test_caps_are_enforced_while_reading(monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_BYTES", 4)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(upload(b"x" * 20), limit=10))
+    # A declared size fails before anything is read
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(upload(b"", size=11), limit=10))
+
+    budget = UploadBudget(limit=12)
+    asyncio.run(read_upload(upload(b"x" * 8), budget=budget)).close()
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(read_upload(upload(b"x" * 8), budget=budget))
+
+
+def test_spooled_upload_file_is_mapped_not_copied():
+    spool = tempfile.SpooledTemporaryFile(max_size=4)
+    spool.write(b"0123456789")
+    budget = UploadBudget(limit=100)
+    content = asyncio.run(
+        read_upload(UploadFile(spool, filename="big.pdf", size=10), budget=budget, spill_bytes=4)
+    )
+    assert content.file is spool and budget.used == 10
+    assert bytes(content.view()) == b"0123456789"
+    content.close()
+    # The upload's own file is left for the framework to close
+    assert not spool.closed
+    spool.close()
+
+
+def test_close_is_safe_with_outstanding_slices():
+    content = SpooledContent(spill_bytes=2)
+    content.write(b"abcdef")
+    part = content.view()[1:3]
+    content.close()
+    assert bytes(part) == b"bc"